@@ -1,3 +1,6 @@
+import json
+
+import click
 from flask import Flask
 from flask_restx import Api
 
@@ -9,7 +12,17 @@ from corefw.appfw.routes import (
     integration_ns,
     integration_routes,
 )
+from corefw.appfw.services.apikeys_services import ApiKeysService
 from corefw.constants.constants import API_PREFIX
+from corefw.exceptionsfw.exceptions import LockNotAcquiredException
+from corefw.loggerfw import logger
+from corefw.metricsfw.metrics import install_metrics
+from corefw.mongofw.indexes import reconcile_indexes
+from corefw.mongofw.locks import lock
+from corefw.mongofw.mirror import start_mirrors
+from corefw.mongofw.profiler import install_profiler
+
+LOGGER = logger.get_logger(__name__)
 
 
 def initialize_app(title, description, version, config_val, is_doc=True):
@@ -29,8 +42,47 @@ def initialize_app(title, description, version, config_val, is_doc=True):
         doc=is_doc,
     )
     app.config.update(config_val)
+    install_profiler(app.config)
+    install_metrics(app)
     api.add_namespace(health_ns, path="/")
     api.add_namespace(health_ns, path="/")
     api.add_namespace(apikeys_ns, path=API_PREFIX)
     api.add_namespace(integration_ns, path=API_PREFIX)
+    register_commands(app)
+    # opt in: run "flask reconcile-indexes" at deploy time otherwise
+    if app.config.get("RECONCILE_INDEXES_ON_STARTUP", False):
+        with app.app_context():
+            try:
+                with lock("reconcile-indexes", ttl=60, blocking=False):
+                    reconcile_indexes()
+            except LockNotAcquiredException:
+                LOGGER.info("Index reconciliation running in another worker")
+            except Exception as exception:
+                # index problems must not stop workers from serving
+                LOGGER.exception(exception)
+    start_mirrors(app)
     return app, api
+
+
+def register_commands(app):
+    """
+    Register flask cli commands
+    """
+
+    @app.cli.command("reconcile-indexes")
+    @click.option("--dry-run", is_flag=True, help="Only report missing indexes")
+    def reconcile_indexes_command(dry_run):
+        """
+        Create missing mongo indexes and report drift
+        """
+        reports = reconcile_indexes(dry_run=dry_run)
+        click.echo(json.dumps(reports, indent=2, default=str))
+
+    @app.cli.command("refresh-permissions")
+    @click.option("--group", "groups", multiple=True, help="Only keys of this group")
+    def refresh_permissions_command(groups):
+        """
+        Recompute the permissions stored on api keys from their groups
+        """
+        updated = ApiKeysService().refresh_permissions(list(groups) or None)
+        click.echo("%s api keys updated" % updated)
@@ -1,20 +1,45 @@
 from flask import request
-from flask_restx import Resource, reqparse
+from flask_restx import Resource, inputs, reqparse
 
 from corefw.appfw.routes import apikeys_ns
 from corefw.appfw.services.apikeys_services import ApiKeysService
+from corefw.authfw.gw_validation import expect
 from corefw.authfw.internal_auth import internal_auth
-from corefw.constants.constants import API_KEY, CODE, MESSAGE
+from corefw.constants.constants import (
+    API_KEY,
+    BATCH_SIZE,
+    CODE,
+    LIMIT,
+    MESSAGE,
+    NEXT_PAGE_TOKEN_HEADER,
+    PAGE_NO,
+    PAGE_TOKEN,
+    TOTAL_COUNT_HEADER,
+)
 from corefw.constants.messages import (
     API_KEY_CREATED,
     BAD_REQUEST,
     FORBIDDEN,
     GROUP_CREATED,
 )
-from corefw.constants.urls import APIK_GROUP_URL, APIKEYS_URL
+from corefw.constants.urls import (
+    APIK_GROUP_EXPORT_URL,
+    APIK_GROUP_URL,
+    APIKEYS_EXPORT_URL,
+    APIKEYS_URL,
+)
+from corefw.helpersfw.response_helpers import ndjson_response, raw_json_response
 from corefw.models.v1.request_model import CREATE_APIKEY_MODEL, CREATE_GROUP_MODEL
 
 api_key_routes_parser = reqparse.RequestParser()
+group_list_parser = reqparse.RequestParser()
+group_list_parser.add_argument("x-api-key", location="headers", required=True)
+group_list_parser.add_argument(LIMIT, type=inputs.positive, location="args")
+group_list_parser.add_argument(PAGE_TOKEN, location="args")
+group_list_parser.add_argument(PAGE_NO, type=inputs.positive, location="args")
+export_parser = reqparse.RequestParser()
+export_parser.add_argument("x-api-key", location="headers", required=True)
+export_parser.add_argument(BATCH_SIZE, type=inputs.positive, location="args")
 
 
 @apikeys_ns.route(APIKEYS_URL)
@@ -27,7 +52,7 @@ class APIKeysRoutes(Resource):
 
     @apikeys_ns.response(403, description=FORBIDDEN)
     @apikeys_ns.response(400, description=BAD_REQUEST)
-    @apikeys_ns.expect(CREATE_APIKEY_MODEL, api_key_routes_parser, validate=True)
+    @expect(apikeys_ns, CREATE_APIKEY_MODEL, api_key_routes_parser)
     @internal_auth
     def post(self):
         """
@@ -51,21 +76,36 @@ class APIGroupRoutes(Resource):
 
     @apikeys_ns.response(403, description=FORBIDDEN)
     @apikeys_ns.response(400, description=BAD_REQUEST)
-    @apikeys_ns.expect(api_key_routes_parser, validate=True)
+    @apikeys_ns.expect(group_list_parser, validate=True)
     @internal_auth
     def get(self):
         """
         Get API Group list
+        docs: pass limit and/or page_token to page through the list, the next
+        page token is returned in the X-Next-Page-Token header. Pass pageno
+        (and limit) for numbered pages with the total in X-Total-Count.
         :return:
         """
-        result, status = ApiKeysService().get_group_list()
-        return result, status
+        args = group_list_parser.parse_args()
+        if args.get(PAGE_NO) is not None:
+            (result, total), status = ApiKeysService().get_group_list_with_total(
+                page_no=args.get(PAGE_NO), limit=args.get(LIMIT)
+            )
+            return result, status, {TOTAL_COUNT_HEADER: str(total)}
+        if args.get(LIMIT) is None and args.get(PAGE_TOKEN) is None:
+            result, status = ApiKeysService().get_group_list(raw=True)
+            return raw_json_response(result, status)
+        (result, next_page_token), status = ApiKeysService().get_group_page(
+            page_token=args.get(PAGE_TOKEN), limit=args.get(LIMIT)
+        )
+        headers = {NEXT_PAGE_TOKEN_HEADER: next_page_token} if next_page_token else {}
+        return result, status, headers
 
     # @apikeys_ns.response(200, model=CREATE_APIKEY_SUCCESS, description=SUCCESS)
 
     @apikeys_ns.response(403, description=FORBIDDEN)
     @apikeys_ns.response(400, description=BAD_REQUEST)
-    @apikeys_ns.expect(CREATE_GROUP_MODEL, api_key_routes_parser, validate=True)
+    @expect(apikeys_ns, CREATE_GROUP_MODEL, api_key_routes_parser)
     @internal_auth
     def post(self):
         """
@@ -76,3 +116,43 @@ class APIGroupRoutes(Resource):
         result, status = ApiKeysService().create_group(**request.get_json())
         response = {MESSAGE: GROUP_CREATED[1], CODE: GROUP_CREATED[0]}
         return response, status
+
+
+@apikeys_ns.route(APIKEYS_EXPORT_URL)
+class APIKeysExportRoutes(Resource):
+    """
+    APIKeys export
+    """
+
+    @apikeys_ns.response(403, description=FORBIDDEN)
+    @apikeys_ns.response(400, description=BAD_REQUEST)
+    @apikeys_ns.expect(export_parser, validate=True)
+    @internal_auth
+    def get(self):
+        """
+        Export API keys as newline delimited JSON, key values are not exported
+        :return:
+        """
+        args = export_parser.parse_args()
+        rows = ApiKeysService().export_api_keys(batch_size=args.get(BATCH_SIZE))
+        return ndjson_response(rows, filename="api_keys.ndjson")
+
+
+@apikeys_ns.route(APIK_GROUP_EXPORT_URL)
+class APIGroupExportRoutes(Resource):
+    """
+    API Group export
+    """
+
+    @apikeys_ns.response(403, description=FORBIDDEN)
+    @apikeys_ns.response(400, description=BAD_REQUEST)
+    @apikeys_ns.expect(export_parser, validate=True)
+    @internal_auth
+    def get(self):
+        """
+        Export API Groups as newline delimited JSON
+        :return:
+        """
+        args = export_parser.parse_args()
+        rows = ApiKeysService().export_groups(batch_size=args.get(BATCH_SIZE))
+        return ndjson_response(rows, filename="api_groups.ndjson")
@@ -1,10 +1,20 @@
-from flask_restx import Resource
+from flask_restx import Resource, reqparse
 
 from corefw.appfw.routes import health_ns
+from corefw.authfw.internal_auth import internal_auth
 from corefw.loggerfw import logger
+from corefw.metricsfw.metrics import registry
+from corefw.mongofw.audit import get_audit_writer
+from corefw.mongofw.locks import lock_metrics
+from corefw.mongofw.mirror import mirror_registry
+from corefw.mongofw.profiler import get_profiler
+from corefw.mongofw.write_behind import get_last_used_buffer
 
 logger = logger.get_logger(__name__)
 
+internal_parser = reqparse.RequestParser()
+internal_parser.add_argument("x-api-key", location="headers", required=True)
+
 
 @health_ns.route("health")
 class Health(Resource):
@@ -19,3 +29,39 @@ class MongoHealth(Resource):
         logger.info("check health")
         logger.critical("error check health")
         return {"message": "Success"}, 200
+
+
+@health_ns.route("mongoprofile")
+class MongoProfile(Resource):
+    @health_ns.expect(internal_parser, validate=True)
+    @internal_auth
+    def get(self):
+        """
+        Mongo command latency histograms, slow queries, lock contention,
+        mirror, write behind and audit log status of this worker, and the
+        latency percentiles of the metrics registry
+        """
+        profiler = get_profiler()
+        last_used_buffer = get_last_used_buffer()
+        audit_writer = get_audit_writer()
+        status = {
+            "locks": lock_metrics.snapshot(),
+            "mirrors": mirror_registry.status(),
+            "last_used": last_used_buffer.status() if last_used_buffer else None,
+            "audit": audit_writer.status() if audit_writer else None,
+            "metrics": registry.snapshot() if registry.enabled else None,
+        }
+        if profiler is None:
+            return dict(enabled=False, **status), 200
+        return dict(enabled=True, **status, **profiler.snapshot()), 200
+
+    @health_ns.expect(internal_parser, validate=True)
+    @internal_auth
+    def delete(self):
+        """
+        Reset the profiler stats of this worker
+        """
+        profiler = get_profiler()
+        if profiler is not None:
+            profiler.reset()
+        return {}, 204
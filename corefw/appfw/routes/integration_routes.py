@@ -1,19 +1,29 @@
 from flask import request
-from flask_restx import Resource, reqparse
+from flask_restx import Resource, inputs, reqparse
 
 from corefw.appfw.routes import integration_ns
 from corefw.appfw.services.integration_services import IntegrationService
-from corefw.constants.constants import MESSAGE
+from corefw.authfw.gw_validation import expect
+from corefw.authfw.internal_auth import internal_auth
+from corefw.constants.constants import BATCH_SIZE, MESSAGE
 from corefw.constants.messages import BAD_REQUEST, FORBIDDEN
 from corefw.constants.urls import (
     INTEGRATION_DETAILS_URL,
+    INTEGRATION_EXPORT_URL,
     INTEGRATION_URL,
     SANDBOX_INTEGRATION_DETAILS_URL,
+    SANDBOX_INTEGRATION_EXPORT_URL,
     SANDBOX_INTEGRATION_URL,
 )
+from corefw.helpersfw.response_helpers import ndjson_response, raw_json_response
 from corefw.models.v1.request_model import CREATE_INTEGRATION, UPDATE_INTEGRATION
 
 integration_parser = reqparse.RequestParser()
+integration_export_parser = reqparse.RequestParser()
+integration_export_parser.add_argument("x-api-key", location="headers", required=True)
+integration_export_parser.add_argument(
+    BATCH_SIZE, type=inputs.positive, location="args"
+)
 
 
 @integration_ns.route(INTEGRATION_URL)
@@ -26,7 +36,7 @@ class Integration(Resource):
 
     @integration_ns.response(403, description=FORBIDDEN)
     @integration_ns.response(400, description=BAD_REQUEST)
-    @integration_ns.expect(CREATE_INTEGRATION, integration_parser, validate=True)
+    @expect(integration_ns, CREATE_INTEGRATION, integration_parser)
     def post(self):
         """
         Create Integrations
@@ -55,12 +65,12 @@ class IntegrationDetails(Resource):
         :return:
         """
         # ** request.get_json()
-        result, status = IntegrationService().get_integration(provider_code)
-        return result, status
+        result, status = IntegrationService().get_integration(provider_code, raw=True)
+        return raw_json_response(result, status)
 
     @integration_ns.response(403, description=FORBIDDEN)
     @integration_ns.response(400, description=BAD_REQUEST)
-    @integration_ns.expect(UPDATE_INTEGRATION, integration_parser, validate=True)
+    @expect(integration_ns, UPDATE_INTEGRATION, integration_parser)
     def patch(self, provider_code):
         """
         Update Integrations by provider_code
@@ -92,7 +102,7 @@ class SandboxIntegration(Resource):
 
     @integration_ns.response(403, description=FORBIDDEN)
     @integration_ns.response(400, description=BAD_REQUEST)
-    @integration_ns.expect(CREATE_INTEGRATION, integration_parser, validate=True)
+    @expect(integration_ns, CREATE_INTEGRATION, integration_parser)
     def post(self):
         """
         Create sandbox Integrations
@@ -122,19 +132,21 @@ class SandboxIntegrationDetails(Resource):
         :return:
         """
         # ** request.get_json()
-        result, status = IntegrationService().get_sandbox_integration(provider_code)
-        return result, status
+        result, status = IntegrationService().get_sandbox_integration(
+            provider_code, raw=True
+        )
+        return raw_json_response(result, status)
 
     @integration_ns.response(403, description=FORBIDDEN)
     @integration_ns.response(400, description=BAD_REQUEST)
-    @integration_ns.expect(UPDATE_INTEGRATION, integration_parser, validate=True)
+    @expect(integration_ns, UPDATE_INTEGRATION, integration_parser)
     def patch(self, provider_code):
         """
         update sandbox Integrations
         :return:
         """
         # ** request.get_json()
-        result, status = IntegrationService().update_integration(
+        result, status = IntegrationService().update_sandbox_integration(
             provider_code, **request.get_json()
         )
         response = {MESSAGE: result}
@@ -144,5 +156,49 @@ class SandboxIntegrationDetails(Resource):
     @integration_ns.response(400, description=BAD_REQUEST)
     @integration_ns.expect(integration_parser, validate=True)
     def delete(self, provider_code):
-        IntegrationService().delete_integration(provider_code)
+        IntegrationService().delete_sandbox_integration(provider_code)
         return {}, 204
+
+
+@integration_ns.route(INTEGRATION_EXPORT_URL)
+class IntegrationExport(Resource):
+    """
+    Vendor integration export
+    """
+
+    @integration_ns.response(403, description=FORBIDDEN)
+    @integration_ns.response(400, description=BAD_REQUEST)
+    @integration_ns.expect(integration_export_parser, validate=True)
+    @internal_auth
+    def get(self):
+        """
+        Export Integrations as newline delimited JSON with masked credentials
+        :return:
+        """
+        args = integration_export_parser.parse_args()
+        rows = IntegrationService().export_integrations(
+            batch_size=args.get(BATCH_SIZE)
+        )
+        return ndjson_response(rows, filename="integrations.ndjson")
+
+
+@integration_ns.route(SANDBOX_INTEGRATION_EXPORT_URL)
+class SandboxIntegrationExport(Resource):
+    """
+    Vendor sandbox integration export
+    """
+
+    @integration_ns.response(403, description=FORBIDDEN)
+    @integration_ns.response(400, description=BAD_REQUEST)
+    @integration_ns.expect(integration_export_parser, validate=True)
+    @internal_auth
+    def get(self):
+        """
+        Export sandbox Integrations as newline delimited JSON
+        :return:
+        """
+        args = integration_export_parser.parse_args()
+        rows = IntegrationService().export_integrations(
+            sandbox=True, batch_size=args.get(BATCH_SIZE)
+        )
+        return ndjson_response(rows, filename="sandbox_integrations.ndjson")
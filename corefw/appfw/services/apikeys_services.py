@@ -5,7 +5,21 @@ from http import HTTPStatus
 from flask import current_app
 
 from corefw import get_settings
-from corefw.constants.constants import API_KEY, ASSOCIATED_APPS
+from corefw.authfw.decisions import invalidate_all, invalidate_api_key
+from corefw.authfw.rate_limit import most_permissive
+from corefw.authfw.signed_keys import get_signed_keys
+from corefw.constants.constants import (
+    ALL_APPS,
+    API_KEY,
+    ASSOCIATED_APPS,
+    ASSOCIATED_GROUPS,
+    EFFECTIVE_APPS,
+    EXPIRES_AT,
+    KEY_ID,
+    LAST_USED,
+    NAME,
+    RATE_LIMIT,
+)
 from corefw.constants.messages import (
     DUPLICATE_APIKEY_NAME,
     DUPLICATE_GROUP_NAME,
@@ -13,12 +27,26 @@ from corefw.constants.messages import (
     FAILED_TO_CREATE_GROUP,
     FAILED_TO_GET_APIKEY_DETAILS,
     FAILED_TO_GET_ASSOCIATED_APPS,
+    FAILED_TO_REFRESH_PERMISSIONS,
     FAILED_TO_UPDATE_API_KEY,
+    FAILED_TO_UPDATE_GROUP,
+    GROUP_NOT_FOUND,
+    INVALID_API_KEY,
+    INVALID_PAGE_TOKEN,
+    SIGNED_KEYS_NOT_CONFIGURED,
 )
 from corefw.exceptionsfw.exceptions import DataBaseException, GatewayException
 from corefw.loggerfw.logger import get_logger
-from corefw.models.v1.schema import APIGroupSchema, ApiKeySchema, ApiKeyUpdateSchema
-from corefw.mongofw.data_access import DataAccessObject
+from corefw.models.v1.schema import (
+    APIGroupSchema,
+    APIGroupUpdateSchema,
+    ApiKeySchema,
+    ApiKeyUpdateSchema,
+)
+from corefw.mongofw.bulk import UPDATE
+from corefw.mongofw.data_access import DEFAULT_BATCH_SIZE, DataAccessObject
+from corefw.mongofw.pagination import DEFAULT_PAGE_LIMIT, InvalidPageToken
+from corefw.mongofw.write_behind import get_last_used_buffer
 
 LOGGER = get_logger(__name__)
 
@@ -78,41 +106,166 @@ class ApiKeysService:
                 message=FAILED_TO_GET_ASSOCIATED_APPS, exception=db_ex
             )
 
+    def get_rate_limit(self, api_key_details):
+        """
+        ``rate_limit`` spec of an api key: its own, else the most permissive
+        of its groups, else None for the configured default
+        """
+        if api_key_details.get(RATE_LIMIT):
+            return api_key_details[RATE_LIMIT]
+        group_list = api_key_details.get(ASSOCIATED_GROUPS)
+        if not group_list:
+            return None
+        try:
+            filter_dict = {NAME: {"$in": group_list}, RATE_LIMIT: {"$exists": True}}
+            groups = DataAccessObject(
+                collection_name=get_settings(current_app, "GROUPS_COLLECTION")
+            ).find_all_with_collation(filter_dict=filter_dict, sort_by="name")
+            return most_permissive([row.get(RATE_LIMIT) for row in groups])
+        except DataBaseException as db_ex:
+            LOGGER.error(db_ex)
+            raise GatewayException(
+                message=FAILED_TO_GET_APIKEY_DETAILS, exception=db_ex
+            )
+
+    @staticmethod
+    def permissions(apps):
+        """
+        Denormalized permissions stored on an api key: its apps and the
+        ``"*"`` wildcard flag
+        """
+        apps = set(apps or ())
+        return {EFFECTIVE_APPS: sorted(apps - {"*"}), ALL_APPS: "*" in apps}
+
+    def get_permissions(self, group_list):
+        """
+        Permissions of an api key in the groups of group_list
+        """
+        if not group_list:
+            return self.permissions([])
+        return self.permissions(self.get_associated_apps(group_list))
+
+    def refresh_permissions(self, group_names=None, batch_size=None):
+        """
+        Recompute the stored permissions of the api keys in any of
+        group_names, every api key when None. create_group and update_group
+        run it; a group changed any other way (e.g. directly in mongo) needs
+        ``flask refresh-permissions``. Keys are found through
+        apikey_groups_index.
+        :return: number of api keys updated
+        """
+        batch_size = batch_size or DEFAULT_BATCH_SIZE
+        filter_dict = {}
+        if group_names is not None:
+            filter_dict = {ASSOCIATED_GROUPS: {"$in": list(group_names)}}
+        api_keys_dao = DataAccessObject(
+            collection_name=get_settings(current_app, "APIKEY_COLLECTION")
+        )
+        groups_dao = DataAccessObject(
+            collection_name=get_settings(current_app, "GROUPS_COLLECTION")
+        )
+        rows = api_keys_dao.iter_all(
+            filter_dict=filter_dict,
+            project_fields={"_id": 0, API_KEY: 1, ASSOCIATED_GROUPS: 1},
+            batch_size=batch_size,
+        )
+        updated = 0
+        while True:
+            keys = list(itertools.islice(rows, batch_size))
+            if not keys:
+                return updated
+            names = set()
+            for row in keys:
+                names.update(row.get(ASSOCIATED_GROUPS) or [])
+            group_apps = {
+                group[NAME]: group.get(ASSOCIATED_APPS) or []
+                for group in groups_dao.iter_all(
+                    filter_dict={NAME: {"$in": sorted(names)}},
+                    project_fields={"_id": 0, NAME: 1, ASSOCIATED_APPS: 1},
+                )
+            }
+            operations = [
+                {
+                    "op": UPDATE,
+                    "filter": {API_KEY: row[API_KEY]},
+                    "data": self.permissions(
+                        itertools.chain.from_iterable(
+                            group_apps.get(name, [])
+                            for name in row.get(ASSOCIATED_GROUPS) or []
+                        )
+                    ),
+                }
+                for row in keys
+            ]
+            result = api_keys_dao.bulk_write(operations)
+            for error in result["errors"]:
+                LOGGER.error(error)
+            updated += result["modified_count"]
+            invalidate_api_key(*[row[API_KEY] for row in keys])
+
     def update_api_key(self, api_key, **data):
         """
-        Update API key here
+        Update API key here, in a single round trip
         """
         try:
             api_key_data = ApiKeyUpdateSchema(**data)
+            if ASSOCIATED_GROUPS in api_key_data:
+                api_key_data.update(
+                    self.get_permissions(api_key_data[ASSOCIATED_GROUPS])
+                )
             filter_dict = {API_KEY: api_key}
-            DataAccessObject().update(data=api_key_data, filter_dict=filter_dict)
-            return "success", 200
+            updated = DataAccessObject().update_existing(
+                data=api_key_data, filter_dict=filter_dict
+            )
         except DataBaseException as db_ex:
             LOGGER.error(db_ex)
             raise GatewayException(message=FAILED_TO_UPDATE_API_KEY, exception=db_ex)
+        if not updated:
+            raise GatewayException(message=INVALID_API_KEY, status=404)
+        if set(api_key_data) - {LAST_USED}:
+            invalidate_api_key(api_key)
+        return "success", 200
 
-    def create_api_key(self, **data):
+    def touch_last_used(self, api_key):
+        """
+        Record an api key use. Written behind in batches, see
+        write_behind.get_last_used_buffer
+        """
+        last_used_buffer = get_last_used_buffer()
+        if last_used_buffer is None:
+            return self.update_api_key(api_key=api_key, **{LAST_USED: True})
+        last_used_buffer.set(
+            get_settings(current_app, "APIKEY_COLLECTION"),
+            {API_KEY: api_key},
+            ApiKeyUpdateSchema(**{LAST_USED: True}),
+        )
+        return "success", 200
+
+    def create_api_key(self, signed=False, expires_in=None, **data):
         """
         Create API key
+        :param signed: issue a signed key verified without a database read,
+        see corefw.authfw.signed_keys
+        :param expires_in: lifetime of a signed key in seconds
         """
+        signed_keys = get_signed_keys() if signed else None
+        if signed and signed_keys is None:
+            raise GatewayException(message=SIGNED_KEYS_NOT_CONFIGURED, status=400)
         try:
-            indexes = [
-                {
-                    "indexname": "apikey_name_index",
-                    "field_name": "name",
-                    "is_unique": True,
-                },
-                {
-                    "indexname": "apikey_api_keys_index",
-                    "field_name": "api_key",
-                    "is_unique": True,
-                },
-            ]
-            DataAccessObject().create_indexes(indexes=indexes)
-            api_key = str(uuid.uuid4()) + str(uuid.uuid4())
-            api_key = api_key.replace("-", "")
+            permissions = self.get_permissions(data.get(ASSOCIATED_GROUPS))
+            if signed:
+                api_key, key_id, expires_at = signed_keys.issue(
+                    data.get(NAME), permissions, expires_in=expires_in
+                )
+            else:
+                api_key = str(uuid.uuid4()) + str(uuid.uuid4())
+                api_key = api_key.replace("-", "")
             data["api_key"] = api_key
             apikey_model = ApiKeySchema(**data)
+            apikey_model.update(permissions)
+            if signed:
+                apikey_model[KEY_ID] = key_id
+                apikey_model[EXPIRES_AT] = expires_at
             DataAccessObject().create(data=apikey_model)
             return api_key, 201
         except DataBaseException as exception:
@@ -130,22 +283,10 @@ class ApiKeysService:
         Create Group here
         """
         try:
-            # create index
-            indexes = [
-                {
-                    "indexname": "group_name_index",
-                    "field_name": "name",
-                    "is_unique": True,
-                }
-            ]
-            DataAccessObject(
-                collection_name=get_settings(current_app, "GROUPS_COLLECTION")
-            ).create_indexes(indexes=indexes)
             api_group = APIGroupSchema(**data)
             DataAccessObject(
                 collection_name=get_settings(current_app, "GROUPS_COLLECTION")
             ).create(data=api_group)
-            return "success", 201
         except DataBaseException as exception:
             LOGGER.error(exception.error)
             if "duplicate key" in exception.error:
@@ -157,16 +298,56 @@ class ApiKeysService:
                 exception=exception,
                 status=HTTPStatus.INTERNAL_SERVER_ERROR,
             )
+        # keys may already list the new group
+        self.refresh_group_permissions(api_group[NAME])
+        return "success", 201
 
-    def get_group_list(self):
+    def update_group(self, name, **data):
+        """
+        Update a group in a single round trip, then the permissions of its
+        api keys when its apps changed
+        """
+        try:
+            group_data = APIGroupUpdateSchema(**data)
+            updated = DataAccessObject(
+                collection_name=get_settings(current_app, "GROUPS_COLLECTION")
+            ).update_existing(data=group_data, filter_dict={NAME: name})
+        except DataBaseException as exception:
+            LOGGER.error(exception.error)
+            raise GatewayException(message=FAILED_TO_UPDATE_GROUP, exception=exception)
+        if not updated:
+            raise GatewayException(message=GROUP_NOT_FOUND, status=404)
+        if ASSOCIATED_APPS in group_data:
+            self.refresh_group_permissions(name)
+        else:
+            invalidate_all()
+        return "success", 200
+
+    def refresh_group_permissions(self, name):
+        """
+        Refresh the api keys of a group already saved. A failure leaves the
+        group in place, so it is reported apart from the group write.
+        """
+        try:
+            self.refresh_permissions([name])
+        except DataBaseException as exception:
+            LOGGER.error(exception.error)
+            raise GatewayException(
+                message=FAILED_TO_REFRESH_PERMISSIONS, exception=exception
+            )
+        finally:
+            invalidate_all()
+
+    def get_group_list(self, raw=False):
         """
         Get Group list
+        :param raw: RawBSONDocument rows, for response_helpers.raw_json_response
         """
         try:
             filter_dict = {}
             groups = DataAccessObject(
                 collection_name=get_settings(current_app, "GROUPS_COLLECTION")
-            ).find_all_with_collation(filter_dict=filter_dict, sort_by="name")
+            ).find_all_with_collation(filter_dict=filter_dict, sort_by="name", raw=raw)
             return groups, 200
         except DataBaseException as exception:
             LOGGER.error(exception)
@@ -175,3 +356,68 @@ class ApiKeysService:
             raise GatewayException(
                 message=str(exception), status=HTTPStatus.INTERNAL_SERVER_ERROR
             )
+
+    def get_group_page(self, page_token=None, limit=None):
+        """
+        Get one page of the Group list
+        :return: (groups, next page token or None), status
+        """
+        try:
+            groups, next_page_token = DataAccessObject(
+                collection_name=get_settings(current_app, "GROUPS_COLLECTION")
+            ).find_page_with_collation(
+                filter_dict={}, sort_by="name", page_token=page_token, limit=limit
+            )
+            return (groups, next_page_token), 200
+        except InvalidPageToken:
+            raise GatewayException(message=INVALID_PAGE_TOKEN, status=400)
+        except DataBaseException as exception:
+            LOGGER.error(exception)
+            raise GatewayException(
+                message=str(exception), status=HTTPStatus.INTERNAL_SERVER_ERROR
+            )
+
+    def get_group_list_with_total(self, page_no=1, limit=None):
+        """
+        Get one numbered page of the Group list with the total group count,
+        fetched together in a single query
+        :return: (groups, total), status
+        """
+        try:
+            limit = limit or DEFAULT_PAGE_LIMIT
+            groups, total = DataAccessObject(
+                collection_name=get_settings(current_app, "GROUPS_COLLECTION")
+            ).find_with_total(
+                filter_dict={},
+                sort_by="name",
+                offset=(max(page_no, 1) - 1) * limit,
+                limit=limit,
+            )
+            return (groups, total), 200
+        except DataBaseException as exception:
+            LOGGER.error(exception)
+            raise GatewayException(
+                message=str(exception), status=HTTPStatus.INTERNAL_SERVER_ERROR
+            )
+
+    def export_api_keys(self, batch_size=None):
+        """
+        Stream every api key, without the key value, for export
+        :return: generator of api key documents
+        """
+        return DataAccessObject(
+            collection_name=get_settings(current_app, "APIKEY_COLLECTION")
+        ).iter_all(
+            filter_dict={},
+            project_fields={"_id": 0, API_KEY: 0},
+            batch_size=batch_size or DEFAULT_BATCH_SIZE,
+        )
+
+    def export_groups(self, batch_size=None):
+        """
+        Stream every group for export
+        :return: generator of group documents
+        """
+        return DataAccessObject(
+            collection_name=get_settings(current_app, "GROUPS_COLLECTION")
+        ).iter_all(filter_dict={}, batch_size=batch_size or DEFAULT_BATCH_SIZE)
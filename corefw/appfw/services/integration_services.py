@@ -4,6 +4,7 @@ from flask import current_app
 from flask_restx import abort
 
 from corefw import get_settings
+from corefw.authfw.credential_cache import invalidate_integration
 from corefw.constants.constants import (
     CREDENTIALS,
     INTEGRATION_ID,
@@ -16,30 +17,60 @@ from corefw.constants.messages import PROVIDER_NOT_FOUND
 from corefw.exceptionsfw.exceptions import DataBaseException
 from corefw.loggerfw.logger import get_logger
 from corefw.models.v1.schema import IntegrationSchema, UpdateIntegrationSchema
-from corefw.mongofw.data_access import DataAccessObject
+from corefw.mongofw.data_access import DEFAULT_BATCH_SIZE, DataAccessObject
 
 LOGGER = get_logger(__name__)
 
 
+def mask_credentials(integration_detail):
+    """
+    Copy of the integration with credential values masked, keeping the names.
+    Works on RawBSONDocuments too, other fields are left undecoded.
+    """
+    masked = dict(integration_detail)
+    masked[CREDENTIALS] = [
+        {NAME: row.get(NAME), VALUE: "***********"}
+        for row in integration_detail.get(CREDENTIALS) or []
+    ]
+    return masked
+
+
 class IntegrationService:
     def __init__(self, collection_name="integrations"):
         self.collection_name = collection_name
 
-    def get_integration(self, provider_code):
+    def get_integration(self, provider_code, raw=False):
         """
         Get Provider code
+        :param raw: read the stored document undecoded, for
+        response_helpers.raw_json_response
         """
-        credentials = []
         filter_dict = {PROVIDER_CODE: provider_code}
         get_resource = DataAccessObject(
             collection_name=get_settings(current_app, "INTEGRATION_COLLECTION")
-        ).get_resource(filter_dict=filter_dict, project_fields={"_id": 0, SALT_KEY: 0})
+        ).get_resource(
+            filter_dict=filter_dict, project_fields={"_id": 0, SALT_KEY: 0}, raw=raw
+        )
         if not get_resource:
             abort(404, PROVIDER_NOT_FOUND[1])
-        for row in get_resource.get(CREDENTIALS):
-            credentials.append({NAME: row.get(NAME), VALUE: "***********"})
-        get_resource[CREDENTIALS] = credentials
-        return get_resource, 200
+        return mask_credentials(get_resource), 200
+
+    def export_integrations(self, sandbox=False, batch_size=None):
+        """
+        Stream every integration with masked credentials for export
+        :return: generator of integration documents
+        """
+        collection_name = get_settings(current_app, "INTEGRATION_COLLECTION")
+        if sandbox:
+            collection_name = get_settings(
+                current_app, "SANDBOX_INTEGRATION_COLLECTION"
+            )
+        rows = DataAccessObject(collection_name=collection_name).iter_all(
+            filter_dict={},
+            project_fields={"_id": 0, SALT_KEY: 0},
+            batch_size=batch_size or DEFAULT_BATCH_SIZE,
+        )
+        return (mask_credentials(row) for row in rows)
 
     def create_integration(self, **data):
         """
@@ -49,21 +80,6 @@ class IntegrationService:
             integration_id = str(uuid.uuid4())
             integration_model = IntegrationSchema(**data)
             integration_model[INTEGRATION_ID] = integration_id
-            credential_indexes = [
-                {
-                    "indexname": "integration_id_index",
-                    "field_name": INTEGRATION_ID,
-                    "is_unique": True,
-                },
-                {
-                    "indexname": "integration_provider_index",
-                    "field_name": PROVIDER_CODE,
-                    "is_unique": True,
-                },
-            ]
-            DataAccessObject(
-                collection_name=get_settings(current_app, "INTEGRATION_COLLECTION")
-            ).create_indexes(indexes=credential_indexes)
             DataAccessObject(
                 collection_name=get_settings(current_app, "INTEGRATION_COLLECTION")
             ).create(data=integration_model)
@@ -76,59 +92,66 @@ class IntegrationService:
 
     def update_integration(self, provider_code, **data):
         """
-        Create integration
+        Update integration
+        """
+        return self.update_provider(
+            get_settings(current_app, "INTEGRATION_COLLECTION"), provider_code, data
+        )
+
+    def delete_integration(self, provider_code):
+        return self.delete_provider(
+            get_settings(current_app, "INTEGRATION_COLLECTION"), provider_code
+        )
+
+    def update_provider(self, collection_name, provider_code, data):
+        """
+        Update the integration of provider_code in a single round trip
         """
         try:
-            filter_dict = {PROVIDER_CODE: provider_code}
-            get_resource = DataAccessObject(
-                collection_name=get_settings(current_app, "INTEGRATION_COLLECTION")
-            ).get_resource(filter_dict=filter_dict)
-            if not get_resource:
-                abort(404, PROVIDER_NOT_FOUND[1])
             integration_model = UpdateIntegrationSchema(**data)
-            DataAccessObject(
-                collection_name=get_settings(current_app, "INTEGRATION_COLLECTION")
-            ).update(data=integration_model, filter_dict=filter_dict)
-
-            return "success", 200
+            updated = DataAccessObject(collection_name=collection_name).update_existing(
+                data=integration_model, filter_dict={PROVIDER_CODE: provider_code}
+            )
         except DataBaseException as exception:
             LOGGER.exception(exception)
             abort(500, str(exception))
             raise
+        if not updated:
+            abort(404, PROVIDER_NOT_FOUND[1])
+        invalidate_integration(provider_code)
+        return "success", 200
 
-    def delete_integration(self, provider_code):
+    def delete_provider(self, collection_name, provider_code):
+        """
+        Delete the integration of provider_code in a single round trip
+        """
         try:
-            filter_dict = {PROVIDER_CODE: provider_code}
-            get_resource = DataAccessObject(
-                collection_name=get_settings(current_app, "INTEGRATION_COLLECTION")
-            ).get_resource(filter_dict=filter_dict)
-            if not get_resource:
-                abort(404, PROVIDER_NOT_FOUND[1])
-
-            DataAccessObject(
-                collection_name=get_settings(current_app, "INTEGRATION_COLLECTION")
-            ).delete(filter_dict=filter_dict)
-
-            return "success", 200
+            deleted = DataAccessObject(collection_name=collection_name).delete_existing(
+                filter_dict={PROVIDER_CODE: provider_code}
+            )
         except DataBaseException as exception:
             LOGGER.exception(exception)
             abort(500, str(exception))
+            raise
+        if not deleted:
+            abort(404, PROVIDER_NOT_FOUND[1])
+        invalidate_integration(provider_code)
+        return "success", 200
 
-    def get_sandbox_integration(self, provider_code):
+    def get_sandbox_integration(self, provider_code, raw=False):
         """
         Get Provider code
+        :param raw: see get_integration
         """
-        credentials = []
         filter_dict = {PROVIDER_CODE: provider_code}
         get_resource = DataAccessObject(
             collection_name=get_settings(current_app, "SANDBOX_INTEGRATION_COLLECTION")
-        ).get_resource(filter_dict=filter_dict, project_fields={"_id": 0, SALT_KEY: 0})
+        ).get_resource(
+            filter_dict=filter_dict, project_fields={"_id": 0, SALT_KEY: 0}, raw=raw
+        )
         if not get_resource:
             abort(404, PROVIDER_NOT_FOUND[1])
-        for row in get_resource.get(CREDENTIALS):
-            credentials.append({NAME: row.get(NAME), VALUE: "***********"})
-        get_resource[CREDENTIALS] = credentials
-        return get_resource, 200
+        return mask_credentials(get_resource), 200
 
     def create_sandbox_integration(self, **data):
         """
@@ -138,23 +161,6 @@ class IntegrationService:
             integration_id = str(uuid.uuid4())
             integration_model = IntegrationSchema(**data)
             integration_model[INTEGRATION_ID] = integration_id
-            credential_indexes = [
-                {
-                    "indexname": "integration_id_index",
-                    "field_name": INTEGRATION_ID,
-                    "is_unique": True,
-                },
-                {
-                    "indexname": "integration_provider_index",
-                    "field_name": PROVIDER_CODE,
-                    "is_unique": False,
-                },
-            ]
-            DataAccessObject(
-                collection_name=get_settings(
-                    current_app, "SANDBOX_INTEGRATION_COLLECTION"
-                )
-            ).create_indexes(indexes=credential_indexes)
             DataAccessObject(
                 collection_name=get_settings(
                     current_app, "SANDBOX_INTEGRATION_COLLECTION"
@@ -169,45 +175,15 @@ class IntegrationService:
 
     def update_sandbox_integration(self, provider_code, **data):
         """
-        Create integration
+        Update sandbox integration
         """
-        try:
-            filter_dict = {PROVIDER_CODE: provider_code}
-            get_resource = DataAccessObject(
-                collection_name=get_settings(
-                    current_app, "SANDBOX_INTEGRATION_COLLECTION"
-                )
-            ).get_resource(filter_dict=filter_dict)
-            if not get_resource:
-                abort(404, PROVIDER_NOT_FOUND[1])
-            integration_model = UpdateIntegrationSchema(**data)
-            DataAccessObject(
-                collection_name=get_settings(
-                    current_app, "SANDBOX_INTEGRATION_COLLECTION"
-                )
-            ).update(data=integration_model, filter_dict=filter_dict)
-
-            return "success", 200
-        except DataBaseException as exception:
-            LOGGER.exception(exception)
-            abort(500, str(exception))
+        return self.update_provider(
+            get_settings(current_app, "SANDBOX_INTEGRATION_COLLECTION"),
+            provider_code,
+            data,
+        )
 
     def delete_sandbox_integration(self, provider_code):
-        try:
-            filter_dict = {PROVIDER_CODE: provider_code}
-            get_resource = DataAccessObject(
-                collection_name=get_settings(current_app, "INTEGRATION_COLLECTION")
-            ).get_resource(filter_dict=filter_dict)
-            if not get_resource:
-                abort(404, PROVIDER_NOT_FOUND[1])
-
-            DataAccessObject(
-                collection_name=get_settings(
-                    current_app, "SANDBOX_INTEGRATION_COLLECTION"
-                )
-            ).delete(filter_dict=filter_dict)
-
-            return "success", 200
-        except DataBaseException as exception:
-            LOGGER.exception(exception)
-            abort(500, str(exception))
+        return self.delete_provider(
+            get_settings(current_app, "SANDBOX_INTEGRATION_COLLECTION"), provider_code
+        )
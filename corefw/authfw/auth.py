@@ -1,13 +1,24 @@
 import functools
-from datetime import datetime
+import time
 
 from flask import g, request
 
 from corefw.appfw.services.apikeys_services import ApiKeysService
-from corefw.constants.constants import ASSOCIATED_GROUPS, LAST_USED, NAME, X_API_KEY
+from corefw.authfw.decisions import Decision, get_decision_cache, negative_ttl
+from corefw.authfw.rate_limit import get_rate_limiter
+from corefw.authfw.signed_keys import SignedKeyError, get_signed_keys, is_signed_key
+from corefw.constants.constants import (
+    ALL_APPS,
+    ASSOCIATED_GROUPS,
+    EFFECTIVE_APPS,
+    NAME,
+    X_API_KEY,
+)
 from corefw.constants.messages import EMPTY_API_KEY, FORBIDDEN_ACCESS, INVALID_API_KEY
 from corefw.exceptionsfw.exceptions import GatewayException
 from corefw.loggerfw import logger
+from corefw.metricsfw.metrics import AUTH_PHASE_LATENCY, AUTH_RESULTS, elapsed_ms
+from corefw.mongofw.audit import claim_audit, record_call
 
 LOGGER = logger.get_logger(__name__)
 
@@ -27,7 +38,9 @@ def auth(logger, route_name):
 
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            start_time = datetime.utcnow()
+            started = time.perf_counter_ns()
+            audited = claim_audit()
+            status_code = error = None
             try:
 
                 AuthorizationUtils().is_empty_apikey()
@@ -38,15 +51,22 @@ def auth(logger, route_name):
                 return response, status_code, code
             except GatewayException as gateway_exception:
                 logger.exception(gateway_exception)
+                status_code, error = gateway_exception.status, gateway_exception
                 raise
             except Exception as exception:
                 logger.exception(exception)
+                status_code, error = 500, exception
                 raise
             finally:
-                time_taken = datetime.utcnow() - start_time
                 logger.info(
-                    "Exit function : %s Time taken : %s", func.__name__, time_taken
+                    "Exit function : %s Time taken(ms) : %.3f",
+                    func.__name__,
+                    elapsed_ms(started),
                 )
+                if audited:
+                    record_call(
+                        func.__name__, started, status_code, error, route=route_name
+                    )
 
         return wrapper
 
@@ -69,23 +89,83 @@ class AuthorizationUtils:
 
     def validate(self, route_name):
         """
-        Validate api key and group
+        Validate api key and group, then its rate limit. Signed keys are
+        verified locally, other keys go through the decision cache
         """
         api_key = request.headers.get(X_API_KEY)
+        signed_keys = get_signed_keys()
+        cache = get_decision_cache()
+        if signed_keys is not None and is_signed_key(api_key):
+            with AUTH_PHASE_LATENCY.time("signed"):
+                decision = self.resolve_signed(signed_keys, api_key, route_name)
+        else:
+            with AUTH_PHASE_LATENCY.time("cache"):
+                decision = (
+                    cache.get((api_key, route_name)) if cache is not None else None
+                )
+        if decision is None:
+            with AUTH_PHASE_LATENCY.time("resolve"):
+                decision = self.resolve(api_key, route_name)
+            if cache is not None:
+                ttl = None if decision.found else negative_ttl()
+                cache.set((api_key, route_name), decision, ttl=ttl)
+        if decision.found:
+            g.identifier = decision.identifier
+        if not decision.allowed:
+            AUTH_RESULTS.inc("forbidden" if decision.found else "invalid")
+            message, status = decision.error
+            raise GatewayException(message=message, status=status)
+        rate_limiter = get_rate_limiter()
+        if rate_limiter is not None:
+            with AUTH_PHASE_LATENCY.time("rate_limit"):
+                try:
+                    rate_limiter.enforce(api_key, route_name, decision.rate_limit)
+                except GatewayException:
+                    AUTH_RESULTS.inc("rate_limited")
+                    raise
+        AUTH_RESULTS.inc("allowed")
+        with AUTH_PHASE_LATENCY.time("last_used"):
+            ApiKeysService().touch_last_used(api_key)
+
+    def resolve_signed(self, signed_keys, api_key, route_name):
+        """
+        Authorization of a signed api key, verified locally. Signed keys
+        are throttled by RATE_LIMIT_DEFAULT
+        :return: Decision
+        """
+        try:
+            claims = signed_keys.verify(api_key)
+        except SignedKeyError as exception:
+            return Decision(False, error=(exception.message, exception.status))
+        if claims.get("all") or route_name in set(claims.get("apps") or ()):
+            return Decision(True, claims.get("sub"))
+        return Decision(True, claims.get("sub"), (FORBIDDEN_ACCESS, 403))
+
+    def resolve(self, api_key, route_name):
+        """
+        Authorization of api_key on route_name, read from mongo
+        :return: Decision
+        """
         get_api_details = ApiKeysService().get_apikey_details(api_key=api_key)
 
         if not get_api_details:
-            raise GatewayException(message=INVALID_API_KEY, status=404)
-
-        g.identifier = get_api_details.get(NAME)
-        apikey_apps = ApiKeysService(collection_name="groups").get_associated_apps(
-            get_api_details.get(ASSOCIATED_GROUPS)
-        )
-        LOGGER.info("apps list %s:", str(apikey_apps))
-        api_key_update = {LAST_USED: True}
-        if "*" in apikey_apps:
-            ApiKeysService().update_api_key(api_key=api_key, **api_key_update)
-            return
-        if route_name not in apikey_apps:
-            raise GatewayException(message=FORBIDDEN_ACCESS, status=403)
-        ApiKeysService().update_api_key(api_key=api_key, **api_key_update)
+            return Decision(False, error=(INVALID_API_KEY, 404))
+
+        identifier = get_api_details.get(NAME)
+        if ALL_APPS in get_api_details:
+            # permissions precomputed by ApiKeysService.refresh_permissions
+            allowed = get_api_details[ALL_APPS] or route_name in set(
+                get_api_details.get(EFFECTIVE_APPS) or ()
+            )
+        else:
+            apikey_apps = ApiKeysService(
+                collection_name="groups"
+            ).get_associated_apps(get_api_details.get(ASSOCIATED_GROUPS))
+            LOGGER.info("apps list %s:", str(apikey_apps))
+            allowed = "*" in apikey_apps or route_name in apikey_apps
+        if not allowed:
+            return Decision(True, identifier, (FORBIDDEN_ACCESS, 403))
+        rate_limit = None
+        if get_rate_limiter() is not None:
+            rate_limit = ApiKeysService().get_rate_limit(get_api_details)
+        return Decision(True, identifier, rate_limit=rate_limit)
@@ -0,0 +1,140 @@
+import collections.abc
+import threading
+
+from flask import current_app
+
+from corefw.constants.constants import NAME, VALUE
+from corefw.helpersfw.cache import TTLCache
+
+DEFAULT_CREDENTIAL_TTL = 60
+DEFAULT_CREDENTIAL_CACHE_SIZE = 256
+
+
+class DecryptedIntegration(object):
+    """
+    Credentials and settings of one integration, each credential decrypted
+    on first use and kept.
+
+    The cached copy of each secret is a bytearray, overwritten with zeros
+    when the entry leaves the cache (``wipe``). Only that copy is wiped: the
+    bytes returned by Fernet and the str handed to callers are immutable and
+    stay in memory until collected. A wiped entry still answers, decrypting
+    on every access without keeping the result.
+    """
+
+    __slots__ = (
+        "fernet",
+        "tokens",
+        "secrets",
+        "config_data",
+        "integration_id",
+        "lock",
+        "wiped",
+    )
+
+    def __init__(self, fernet, tokens, config_data, integration_id):
+        """
+        :param fernet: Fernet of the integration salt key
+        :param tokens: credential name -> encrypted value, in document order
+        """
+        self.fernet = fernet
+        self.tokens = tokens
+        self.secrets = {}
+        self.config_data = config_data
+        self.integration_id = integration_id
+        self.lock = threading.Lock()
+        self.wiped = False
+
+    def secret(self, name):
+        """
+        Decrypted value of a credential
+        :raises KeyError: unknown credential name
+        """
+        with self.lock:
+            value = self.secrets.get(name)
+            if value is None:
+                value = bytearray(self.fernet.decrypt(self.tokens[name]))
+                if not self.wiped:
+                    self.secrets[name] = value
+            return value.decode()
+
+    def wipe(self):
+        with self.lock:
+            self.wiped = True
+            for value in self.secrets.values():
+                value[:] = bytes(len(value))
+            self.secrets = {}
+
+
+class LazyCredentials(collections.abc.Mapping):
+    """
+    ``g.credentials``: credential name -> decrypted value. A credential is
+    decrypted on first access and kept for the rest of the request, so a
+    handler only pays for the credentials it reads.
+    """
+
+    def __init__(self, integration):
+        self.integration = integration
+        self.values = {}
+
+    def __getitem__(self, name):
+        value = self.values.get(name)
+        if value is None:
+            value = self.values[name] = self.integration.secret(name)
+        return value
+
+    def __iter__(self):
+        return iter(self.integration.tokens)
+
+    def __len__(self):
+        return len(self.integration.tokens)
+
+    def rows(self):
+        """
+        Every credential as the former list of {name, value}
+        """
+        return [{NAME: name, VALUE: self[name]} for name in self]
+
+
+def wipe_entry(key, entry):
+    entry.wipe()
+
+
+def get_credential_cache(app=None):
+    """
+    Decrypted integrations of the flask app keyed by (provider, sandbox),
+    None when CREDENTIAL_CACHE_TTL is 0.
+        CREDENTIAL_CACHE_TTL = 60
+        CREDENTIAL_CACHE_SIZE = 256
+        CREDENTIAL_CACHE_WIPE = True   # zero the cached secrets on eviction
+
+    Invalidation is per worker: other workers pick up a changed integration
+    once their entry expires.
+    """
+    app = app or current_app
+    ttl = app.config.get("CREDENTIAL_CACHE_TTL", DEFAULT_CREDENTIAL_TTL)
+    if not ttl:
+        return None
+    cache = app.extensions.get("corefw_credential_cache")
+    if cache is None:
+        cache = TTLCache(
+            maxsize=app.config.get(
+                "CREDENTIAL_CACHE_SIZE", DEFAULT_CREDENTIAL_CACHE_SIZE
+            ),
+            ttl=ttl,
+            on_evict=wipe_entry
+            if app.config.get("CREDENTIAL_CACHE_WIPE", True)
+            else None,
+        )
+        app.extensions["corefw_credential_cache"] = cache
+    return cache
+
+
+def invalidate_integration(provider_code):
+    """
+    Forget the decrypted credentials of a provider, live and sandbox
+    """
+    cache = get_credential_cache()
+    if cache is not None:
+        cache.invalidate((provider_code, False))
+        cache.invalidate((provider_code, True))
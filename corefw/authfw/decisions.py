@@ -0,0 +1,76 @@
+from flask import current_app
+
+from corefw.helpersfw.cache import TTLCache
+
+DEFAULT_DECISION_TTL = 5
+DEFAULT_NEGATIVE_TTL = 2
+DEFAULT_DECISION_CACHE_SIZE = 4096
+
+
+class Decision(object):
+    """
+    Resolved authorization of an api key on a route: whether the key
+    exists, its identifier, the error to raise, (message, status) or None
+    when allowed, and the ``rate_limit`` spec of the key
+    """
+
+    __slots__ = ("found", "identifier", "error", "rate_limit")
+
+    def __init__(self, found, identifier=None, error=None, rate_limit=None):
+        self.found = found
+        self.identifier = identifier
+        self.error = error
+        self.rate_limit = rate_limit
+
+    @property
+    def allowed(self):
+        return self.error is None
+
+
+def get_decision_cache(app=None):
+    """
+    Authorization decisions of the flask app keyed by (api_key, route_name),
+    None when AUTH_CACHE_TTL is 0.
+        AUTH_CACHE_TTL = 5            # seconds, allowed and forbidden
+        AUTH_CACHE_NEGATIVE_TTL = 2   # seconds, unknown api keys
+        AUTH_CACHE_SIZE = 4096
+
+    Invalidation is per worker: other workers see a change once their entry
+    expires, which bounds staleness to the TTL.
+    """
+    app = app or current_app
+    ttl = app.config.get("AUTH_CACHE_TTL", DEFAULT_DECISION_TTL)
+    if not ttl:
+        return None
+    cache = app.extensions.get("corefw_auth_decisions")
+    if cache is None:
+        cache = TTLCache(
+            maxsize=app.config.get("AUTH_CACHE_SIZE", DEFAULT_DECISION_CACHE_SIZE),
+            ttl=ttl,
+        )
+        app.extensions["corefw_auth_decisions"] = cache
+    return cache
+
+
+def negative_ttl(app=None):
+    app = app or current_app
+    return app.config.get("AUTH_CACHE_NEGATIVE_TTL", DEFAULT_NEGATIVE_TTL)
+
+
+def invalidate_api_key(*api_keys):
+    """
+    Forget the decisions of the given api keys, on every route
+    """
+    cache = get_decision_cache()
+    if cache is not None:
+        api_keys = set(api_keys)
+        cache.invalidate_where(lambda key: key[0] in api_keys)
+
+
+def invalidate_all():
+    """
+    Forget every decision, e.g. when groups change
+    """
+    cache = get_decision_cache()
+    if cache is not None:
+        cache.clear()
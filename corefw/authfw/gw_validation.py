@@ -1,6 +1,5 @@
 import functools
 import re
-from http import HTTPStatus
 
 from flask import request
 from src.specs.constants.constants import DATA, EMAIL, EMAIL_ID, IP_ADDRESS, USER_EMAIL
@@ -9,50 +8,64 @@ from src.specs.constants.messages import (
     INVALID_EMAIL_ADDRESS,
     INVALID_IP_ADDRESS,
 )
-from src.specs.exceptions.exceptions import GatewayException
+
+from corefw.helpersfw.validators import Rule, compile_validator, raise_for_errors
 
 EMAIL_REGEX = re.compile(r"\S+@\S+\.\S+")
 URI_REGEX = re.compile(r"(http|https|ftp)://\S+\.\S+")
 IP_REGEX = re.compile(r"^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$")
 
 
-def gw_validator(func):
+def matches(regex):
+    return lambda value: isinstance(value, str) and regex.match(value) is not None
+
+
+def not_empty(value):
+    return not isinstance(value, (dict, list, str)) or len(value) > 0
+
+
+GW_RULES = {
+    EMAIL: Rule(matches(EMAIL_REGEX), INVALID_EMAIL_ADDRESS),
+    USER_EMAIL: Rule(matches(EMAIL_REGEX), INVALID_EMAIL_ADDRESS),
+    DATA + "." + EMAIL_ID: Rule(matches(EMAIL_REGEX), INVALID_EMAIL_ADDRESS),
+    IP_ADDRESS: Rule(matches(IP_REGEX), INVALID_IP_ADDRESS),
+    DATA: Rule(not_empty, INVALID_DATA_OBJECT),
+}
+
+
+def validated(validate):
     """
-    Field validation
+    Decorator checking the request body with a compiled validator
     """
 
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        request_body = request.get_json()
-        # validate args here
-        if EMAIL in request_body and not bool(
-            EMAIL_REGEX.match(request_body.get(EMAIL))
-        ):
-            raise GatewayException(
-                message=INVALID_EMAIL_ADDRESS, status=HTTPStatus.BAD_REQUEST
-            )
-        if USER_EMAIL in request_body and not bool(
-            EMAIL_REGEX.match(request_body.get(USER_EMAIL))
-        ):
-            raise GatewayException(
-                message=INVALID_EMAIL_ADDRESS, status=HTTPStatus.BAD_REQUEST
-            )
-        if EMAIL_ID in request_body.get(DATA) and not bool(
-            EMAIL_REGEX.match(request_body.get(DATA).get(EMAIL_ID))
-        ):
-            raise GatewayException(
-                message=INVALID_EMAIL_ADDRESS, status=HTTPStatus.BAD_REQUEST
-            )
-        if IP_ADDRESS in request_body and not bool(
-            IP_REGEX.match(request_body.get(IP_ADDRESS))
-        ):
-            raise GatewayException(
-                message=INVALID_IP_ADDRESS, status=HTTPStatus.BAD_REQUEST
-            )
-        if DATA in request_body and len(request_body.get(DATA)) == 0:
-            raise GatewayException(
-                message=INVALID_DATA_OBJECT, status=HTTPStatus.BAD_REQUEST
-            )
-        return func(*args, **kwargs)
-
-    return wrapper
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            raise_for_errors(validate(request.get_json()))
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+gw_validator = validated(compile_validator(rules=GW_RULES))
+gw_validator.__doc__ = """
+Field validation
+"""
+
+
+def expect(namespace, model, *parsers):
+    """
+    ``namespace.expect(model, *parsers, validate=True)`` followed by
+    gw_validator, in a single pass over the body: model and field rules are
+    compiled once when the route is declared.
+    """
+    validate = compile_validator(model, GW_RULES)
+
+    def decorator(func):
+        return namespace.expect(model, *parsers, validate=False)(
+            validated(validate)(func)
+        )
+
+    return decorator
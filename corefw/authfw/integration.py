@@ -1,4 +1,5 @@
 import base64
+import copy
 import functools
 import http
 
@@ -6,6 +7,11 @@ from cryptography.fernet import Fernet
 from flask import current_app, g, request
 
 from corefw import get_settings
+from corefw.authfw.credential_cache import (
+    DecryptedIntegration,
+    LazyCredentials,
+    get_credential_cache,
+)
 from corefw.constants.constants import (
     CONFIG_DATA,
     CREDENTIALS,
@@ -24,42 +30,65 @@ from corefw.mongofw.data_access import DataAccessObject
 LOGGER = logger.get_logger(__name__)
 
 
+def load_integration(provider, sandbox):
+    """
+    Read an integration, its credentials are decrypted on first use
+    :return: DecryptedIntegration
+    """
+    collection_name = get_settings(current_app, "INTEGRATION_COLLECTION")
+    if sandbox:
+        collection_name = get_settings(current_app, "SANDBOX_INTEGRATION_COLLECTION")
+    filter_dict = {PROVIDER_CODE: provider}
+    integration_detail = DataAccessObject(
+        collection_name=collection_name
+    ).get_resource(filter_dict)
+    if not integration_detail:
+        raise GatewayException(
+            message=INTEGRATION_NOT_FOUND,
+            status=http.HTTPStatus.BAD_REQUEST,
+        )
+    salt_key = base64.b64decode(integration_detail.get(SALT_KEY))
+    return DecryptedIntegration(
+        Fernet(salt_key),
+        {row.get(NAME): row.get(VALUE) for row in integration_detail.get(CREDENTIALS)},
+        integration_detail.get(CONFIG_DATA, {}),
+        integration_detail.get(INTEGRATION_ID),
+    )
+
+
+def get_integration(provider, sandbox):
+    """
+    Integration of a provider, through the credential cache
+    :return: DecryptedIntegration
+    """
+    cache = get_credential_cache()
+    if cache is None:
+        return load_integration(provider, sandbox)
+    decrypted = cache.get((provider, sandbox))
+    if decrypted is None:
+        decrypted = load_integration(provider, sandbox)
+        cache.set((provider, sandbox), decrypted)
+    return decrypted
+
+
 def integration(provider):
     """
-    Integration decorator
+    Integration decorator, sets g.credentials, g.config_data and
+    g.integration_id. g.credentials is a mapping of credential name to
+    value, no longer a list of {name, value}: ``g.credentials.rows()``
+    returns that list for handlers not yet migrated.
     """
 
     def integration_func(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             try:
-                collection_name = get_settings(current_app, "INTEGRATION_COLLECTION")
-                if request.args.get(SANDBOX) == "true":
-                    collection_name = get_settings(
-                        current_app, "SANDBOX_INTEGRATION_COLLECTION"
-                    )
-                filter_dict = {PROVIDER_CODE: provider}
-                integration_detail = DataAccessObject(
-                    collection_name=collection_name
-                ).get_resource(filter_dict)
-                if not integration_detail:
-                    raise GatewayException(
-                        message=INTEGRATION_NOT_FOUND,
-                        status=http.HTTPStatus.BAD_REQUEST,
-                    )
-                credentials = []
-                salt_key = base64.b64decode(integration_detail.get(SALT_KEY))
-                fernet = Fernet(salt_key)
-                for row in integration_detail.get(CREDENTIALS):
-                    credentials.append(
-                        {
-                            NAME: row.get(NAME),
-                            VALUE: fernet.decrypt(row.get(VALUE)).decode(),
-                        }
-                    )
-                g.credentials = credentials
-                g.config_data = integration_detail.get(CONFIG_DATA, {})
-                g.integration_id = integration_detail.get(INTEGRATION_ID)
+                decrypted = get_integration(
+                    provider, request.args.get(SANDBOX) == "true"
+                )
+                g.credentials = LazyCredentials(decrypted)
+                g.config_data = copy.deepcopy(decrypted.config_data)
+                g.integration_id = decrypted.integration_id
                 return func(*args, **kwargs)
             except Exception as exception:
                 LOGGER.exception(exception)
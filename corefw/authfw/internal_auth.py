@@ -1,11 +1,12 @@
 import base64
-from datetime import datetime
+import time
 
 from flask import current_app, request
 from flask_restx import abort
 
 from corefw.constants.constants import X_API_KEY
 from corefw.loggerfw import logger
+from corefw.metricsfw.metrics import AUTH_PHASE_LATENCY, elapsed_ms
 
 LOGGER = logger.get_logger(__name__)
 
@@ -18,9 +19,10 @@ def internal_auth(func):
     """
 
     def wrapper(*args, **kwargs):
-        start_time = datetime.utcnow().timestamp()
+        started = time.perf_counter_ns()
         try:
-            InternalAuthUtils().validate()
+            with AUTH_PHASE_LATENCY.time("internal"):
+                InternalAuthUtils().validate()
             # logger.info("Calling function from authorize")
 
             return func(*args, **kwargs)
@@ -28,9 +30,10 @@ def internal_auth(func):
             LOGGER.exception(exception)
             raise
         finally:
-            time_taken = datetime.utcnow().timestamp() - start_time
             LOGGER.info(
-                "Exit function : %s, Time taken(s) : %d", func.__name__, time_taken
+                "Exit function : %s, Time taken(ms) : %.3f",
+                func.__name__,
+                elapsed_ms(started),
             )
 
     return wrapper
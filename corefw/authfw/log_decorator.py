@@ -1,29 +1,39 @@
-from datetime import datetime
+import time
 
 from corefw.loggerfw import logger
+from corefw.metricsfw.metrics import elapsed_ms
+from corefw.mongofw.audit import claim_audit, record_call
 
 LOGGER = logger.get_logger(__name__)
 
 
 def log(func):
     """
-    Decorator to log entry, exit and exception of an API
+    Decorator to log entry, exit and exception of an API with its timing.
+    Inside a request it also audits the call, unless an outer @auth or @log
+    already does, see corefw.mongofw.audit.claim_audit
     :param func:
     :return:
     """
 
     def wrapper(*args, **kwargs):
-        start_time = datetime.utcnow().timestamp()
+        started = time.perf_counter_ns()
+        audited = claim_audit()
+        error = None
         try:
             LOGGER.info("Entered function : %s", func.__name__)
             return func(*args, **kwargs)
         except Exception as exception:
             LOGGER.exception(exception)
+            error = exception
             raise
         finally:
-            time_taken = datetime.utcnow().timestamp() - start_time
             LOGGER.info(
-                "Exit function : %s, Time taken(s) : %d", func.__name__, time_taken
+                "Exit function : %s, Time taken(ms) : %.3f",
+                func.__name__,
+                elapsed_ms(started),
             )
+            if audited:
+                record_call(func.__name__, started, error=error)
 
     return wrapper
@@ -0,0 +1,308 @@
+import datetime
+import hashlib
+import math
+import time
+
+from flask import after_this_request, current_app
+from pymongo.errors import PyMongoError
+
+from corefw.constants.messages import RATE_LIMIT_EXCEEDED
+from corefw.exceptionsfw.exceptions import GatewayException
+from corefw.loggerfw.logger import get_logger
+from corefw.mongofw.mongo_client import MongoClient
+
+LOGGER = get_logger(__name__)
+
+DEFAULT_MAX_BUCKETS = 100000
+DEFAULT_RATE_LIMIT_COLLECTION = "rate_limits"
+
+
+class RateLimit(object):
+    """
+    A token bucket: rate tokens per second, up to burst at once. scope is
+    None for the limit of a key over all routes, else the route name.
+    """
+
+    __slots__ = ("scope", "rate", "burst")
+
+    def __init__(self, scope, rate, burst=None):
+        self.scope = scope
+        self.rate = float(rate)
+        self.burst = int(burst or max(1, math.ceil(self.rate)))
+
+
+def parse_limits(spec, route_name):
+    """
+    Limits of a route from a ``rate_limit`` spec stored on an api key or a
+    group, or set in RATE_LIMIT_DEFAULT:
+        {"rate": 50, "burst": 100,                       # whole key
+         "routes": {"<route_name>": {"rate": 5, "burst": 10}}}
+    :return: list of RateLimit
+    """
+    limits = []
+    if not spec:
+        return limits
+    if spec.get("rate"):
+        limits.append(RateLimit(None, spec["rate"], spec.get("burst")))
+    route_spec = (spec.get("routes") or {}).get(route_name)
+    if route_spec and route_spec.get("rate"):
+        limits.append(
+            RateLimit(route_name, route_spec["rate"], route_spec.get("burst"))
+        )
+    return limits
+
+
+def most_permissive(specs):
+    """
+    Spec with the highest key wide rate, for keys limited by several groups
+    """
+    specs = [spec for spec in specs if spec]
+    if not specs:
+        return None
+    return max(specs, key=lambda spec: spec.get("rate") or 0)
+
+
+class TokenBucket(object):
+    """
+    Token bucket kept as its theoretical arrival time (GCRA): one float read
+    and written per request, no lock. Concurrent requests may race on the
+    update and let a request or two through above the limit, which is the
+    price of never blocking.
+    """
+
+    __slots__ = ("tat",)
+
+    def __init__(self):
+        self.tat = 0.0
+
+    def check(self, limit, now):
+        """
+        Take a token without consuming it
+        :return: (allowed, remaining tokens, seconds until the bucket is full,
+        or until the next request is let through when refused, the
+        theoretical arrival time to store to consume it)
+        """
+        interval = 1.0 / limit.rate
+        capacity = limit.burst * interval
+        tat = max(self.tat, now) + interval
+        if tat - now > capacity:
+            return False, 0, tat - now - capacity, self.tat
+        # the epsilon keeps float error from rounding a whole token away
+        remaining = int((capacity - (tat - now)) / interval + 1e-9)
+        return True, remaining, tat - now, tat
+
+    def take(self, limit, now):
+        """
+        :return: (allowed, remaining tokens, seconds until the bucket is full,
+        or until the next request is let through when refused)
+        """
+        allowed, remaining, reset, self.tat = self.check(limit, now)
+        return allowed, remaining, reset
+
+
+class LocalRateLimitBackend(object):
+    """
+    Buckets in this worker. Every worker enforces the limit on its own, so
+    a key can get up to workers x limit cluster wide.
+    """
+
+    name = "local"
+
+    def __init__(self, max_buckets=DEFAULT_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self.buckets = {}
+
+    def bucket(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_buckets:
+                self.prune()
+            bucket = self.buckets.setdefault(key, TokenBucket())
+        return bucket
+
+    def acquire(self, key, limit):
+        return self.acquire_all([(key, limit)])[0]
+
+    def acquire_all(self, buckets):
+        """
+        Take a token from every (key, limit) bucket, or from none of them
+        :return: (allowed, remaining, reset) per bucket checked, up to the
+        first refusal
+        """
+        now = time.monotonic()
+        results, taken = [], []
+        for key, limit in buckets:
+            bucket = self.bucket(key)
+            allowed, remaining, reset, tat = bucket.check(limit, now)
+            results.append((allowed, remaining, reset))
+            if not allowed:
+                return results
+            taken.append((bucket, tat))
+        for bucket, tat in taken:
+            bucket.tat = tat
+        return results
+
+    def prune(self):
+        """
+        Drop the buckets that are full again, they hold no state
+        """
+        now = time.monotonic()
+        for key, bucket in list(self.buckets.items()):
+            if bucket.tat <= now:
+                self.buckets.pop(key, None)
+
+
+class MongoRateLimitBackend(object):
+    """
+    Cluster wide quotas: a fixed window counter per key in mongo, burst
+    requests per burst / rate seconds, one upsert per request and bucket.
+    A refused request gives its counts back, so it consumes nothing.
+    Counters are removed by a TTL index. Run on STORAGE_BACKEND = "memory"
+    it is the in-process stand-in for tests.
+    """
+
+    name = "mongo"
+
+    def __init__(self, mongo_conn, collection_name=DEFAULT_RATE_LIMIT_COLLECTION):
+        self.mongo_conn = mongo_conn
+        self.collection_name = collection_name
+        self.indexes_ready = False
+
+    def ensure_indexes(self):
+        if not self.indexes_ready:
+            self.mongo_conn.create_index(
+                self.collection_name,
+                "expire",
+                "rate_limit_expire_ttl_index",
+                False,
+                expireAfterSeconds=0,
+            )
+            self.indexes_ready = True
+
+    def increment(self, counter_id, expire, count=1):
+        counter = self.mongo_conn.find_one_and_update(
+            self.collection_name,
+            {"_id": counter_id},
+            {"$inc": {"count": count}, "$setOnInsert": {"expire": expire}},
+            project_fields={"count": 1},
+            upsert=True,
+        )
+        return counter["count"]
+
+    def acquire(self, key, limit):
+        return self.acquire_all([(key, limit)])[0]
+
+    def acquire_all(self, buckets):
+        """
+        Count the request in every (key, limit) bucket, or in none of them
+        :return: (allowed, remaining, reset) per bucket checked, up to the
+        first refusal
+        """
+        self.ensure_indexes()
+        now = time.time()
+        results, counted = [], []
+        for key, limit in buckets:
+            window = max(1.0, limit.burst / limit.rate)
+            window_start = math.floor(now / window) * window
+            counter_id = "%s:%d" % (key, window_start)
+            expire = datetime.datetime.utcfromtimestamp(window_start + window)
+            count = self.increment(counter_id, expire)
+            counted.append((counter_id, expire))
+            allowed = count <= limit.burst
+            results.append(
+                (allowed, max(limit.burst - count, 0), window_start + window - now)
+            )
+            if not allowed:
+                for counter_id, expire in counted:
+                    self.increment(counter_id, expire, -1)
+                break
+        return results
+
+
+RATE_LIMIT_BACKENDS = {
+    LocalRateLimitBackend.name: lambda app: LocalRateLimitBackend(
+        app.config.get("RATE_LIMIT_MAX_BUCKETS", DEFAULT_MAX_BUCKETS)
+    ),
+    MongoRateLimitBackend.name: lambda app: MongoRateLimitBackend(
+        MongoClient.from_config(app.config),
+        app.config.get("RATE_LIMIT_COLLECTION", DEFAULT_RATE_LIMIT_COLLECTION),
+    ),
+}
+
+
+class RateLimiter(object):
+    """
+    Enforces the limits of an api key on a route and sets the RateLimit-*
+    headers of the response
+    """
+
+    def __init__(self, backend, default_spec=None):
+        self.backend = backend
+        self.default_spec = default_spec
+
+    @staticmethod
+    def bucket_key(api_key, limit):
+        # api keys are secrets, buckets only keep a digest
+        digest = hashlib.sha256(api_key.encode()).hexdigest()[:24]
+        if limit.scope is None:
+            return digest
+        return "%s:%s" % (digest, limit.scope)
+
+    def enforce(self, api_key, route_name, spec=None):
+        """
+        :param spec: ``rate_limit`` of the key or its groups, None for
+        RATE_LIMIT_DEFAULT
+        :raises GatewayException: 429 once a limit is exhausted
+        """
+        limits = parse_limits(spec or self.default_spec, route_name)
+        if not limits:
+            return
+        try:
+            # a token is only taken when every limit allows the request
+            results = self.backend.acquire_all(
+                [(self.bucket_key(api_key, limit), limit) for limit in limits]
+            )
+        except PyMongoError as exception:
+            # fail open: an unreachable quota store must not stop traffic
+            LOGGER.error(exception)
+            return
+        limit, (allowed, remaining, reset) = min(
+            zip(limits, results), key=lambda row: (row[1][0], row[1][1])
+        )
+        headers = {
+            "RateLimit-Limit": str(limit.burst),
+            "RateLimit-Remaining": str(remaining),
+            "RateLimit-Reset": str(max(math.ceil(reset), 0)),
+        }
+        if not allowed:
+            headers["Retry-After"] = headers["RateLimit-Reset"]
+
+        @after_this_request
+        def set_rate_limit_headers(response):
+            response.headers.update(headers)
+            return response
+
+        if not allowed:
+            raise GatewayException(message=RATE_LIMIT_EXCEEDED, status=429)
+
+
+def get_rate_limiter(app=None):
+    """
+    Rate limiter of the flask app, None unless RATE_LIMIT_ENABLED:
+        RATE_LIMIT_ENABLED = True
+        RATE_LIMIT_BACKEND = "local"     # or "mongo" for cluster wide quotas
+        RATE_LIMIT_DEFAULT = {"rate": 50, "burst": 100}  # keys without limits
+    """
+    app = app or current_app
+    if not app.config.get("RATE_LIMIT_ENABLED"):
+        return None
+    limiter = app.extensions.get("corefw_rate_limiter")
+    if limiter is None:
+        name = app.config.get("RATE_LIMIT_BACKEND") or LocalRateLimitBackend.name
+        if name not in RATE_LIMIT_BACKENDS:
+            raise ValueError("Unknown rate limit backend: %s" % name)
+        limiter = RateLimiter(
+            RATE_LIMIT_BACKENDS[name](app), app.config.get("RATE_LIMIT_DEFAULT")
+        )
+        app.extensions["corefw_rate_limiter"] = limiter
+    return limiter
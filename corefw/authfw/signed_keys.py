@@ -0,0 +1,231 @@
+import threading
+import time
+import uuid
+
+import jwt
+from flask import current_app
+
+from corefw import get_settings
+from corefw.constants.constants import (
+    ACTIVE,
+    ALL_APPS,
+    EFFECTIVE_APPS,
+    EXPIRES_AT,
+    KEY_ID,
+    STATUS,
+)
+from corefw.constants.messages import (
+    INVALID_API_KEY,
+    INVALID_JWT_TOKEN_EXPIRED,
+    JWT_TOKEN_EXPIRED,
+    REVOCATIONS_UNAVAILABLE,
+)
+from corefw.loggerfw.logger import get_logger
+from corefw.mongofw.mongo_client import MongoClient
+
+LOGGER = get_logger(__name__)
+
+DEFAULT_ALGORITHM = "HS256"
+DEFAULT_SIGNED_KEY_TTL = 30 * 24 * 3600
+DEFAULT_REVOCATION_REFRESH_SECONDS = 30
+
+
+class SignedKeyError(Exception):
+    """
+    A signed api key that must be refused, carries the GatewayException
+    message and status
+    """
+
+    def __init__(self, message, status=401):
+        super(SignedKeyError, self).__init__(message[1])
+        self.message = message
+        self.status = status
+
+
+def is_signed_key(api_key):
+    """
+    Signed keys are JWTs, plain api keys are hex strings without dots
+    """
+    return bool(api_key) and api_key.count(".") == 2
+
+
+class Keyring(object):
+    """
+    Secrets signing api keys, by key id (the JWT ``kid`` header). New keys
+    are signed with active_kid; every secret still in the keyring verifies.
+    To rotate, add a secret and make it active, and drop the old one once
+    the keys it signed have expired or been reissued.
+    """
+
+    def __init__(self, secrets, active_kid, algorithm=DEFAULT_ALGORITHM):
+        if active_kid not in secrets:
+            raise ValueError("Active signing key %s is not in the keyring" % active_kid)
+        self.secrets = dict(secrets)
+        self.active_kid = active_kid
+        self.algorithm = algorithm
+
+    def sign(self, claims):
+        return jwt.encode(
+            claims,
+            self.secrets[self.active_kid],
+            algorithm=self.algorithm,
+            headers={"kid": self.active_kid},
+        )
+
+    def verify(self, token):
+        """
+        :return: claims
+        :raises SignedKeyError: bad signature, unknown kid or expired
+        """
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+            secret = self.secrets.get(kid)
+            if secret is None:
+                raise SignedKeyError(INVALID_JWT_TOKEN_EXPIRED)
+            return jwt.decode(
+                token,
+                secret,
+                algorithms=[self.algorithm],
+                options={"require": ["exp", "jti"]},
+            )
+        except jwt.ExpiredSignatureError:
+            raise SignedKeyError(JWT_TOKEN_EXPIRED)
+        except jwt.InvalidTokenError:
+            raise SignedKeyError(INVALID_JWT_TOKEN_EXPIRED)
+
+
+class RevocationList(object):
+    """
+    Ids of the signed keys revoked before they expire: the key_id of
+    unexpired api key documents that are no longer ACTIVE, read through
+    apikey_expires_at_index. Reloaded every refresh_seconds by the first
+    request that finds it stale, other requests keep using the previous list
+    meanwhile. Until a first load succeeds signed keys are refused with 503.
+    """
+
+    def __init__(
+        self,
+        mongo_conn,
+        collection_name,
+        refresh_seconds=DEFAULT_REVOCATION_REFRESH_SECONDS,
+    ):
+        self.mongo_conn = mongo_conn
+        self.collection_name = collection_name
+        self.refresh_seconds = refresh_seconds
+        self.revoked = frozenset()
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def is_revoked(self, key_id):
+        if self.stale() and self.lock.acquire(blocking=self.loaded_at is None):
+            try:
+                if self.stale():
+                    self.load()
+            finally:
+                self.lock.release()
+        return key_id in self.revoked
+
+    def stale(self):
+        return (
+            self.loaded_at is None
+            or time.monotonic() - self.loaded_at >= self.refresh_seconds
+        )
+
+    def load(self):
+        try:
+            self.revoked = frozenset(
+                self.mongo_conn.distinct(
+                    self.mongo_conn.db_name,
+                    self.collection_name,
+                    KEY_ID,
+                    {EXPIRES_AT: {"$gt": int(time.time())}, STATUS: {"$ne": ACTIVE}},
+                )
+            )
+        except Exception as exception:  # keep serving with the previous list
+            LOGGER.error(exception)
+            if self.loaded_at is not None:
+                self.loaded_at = time.monotonic()
+                return
+            # fail closed, nothing tells which keys are revoked
+            raise SignedKeyError(REVOCATIONS_UNAVAILABLE, status=503)
+        self.loaded_at = time.monotonic()
+
+
+class SignedKeys(object):
+    """
+    Stateless api keys: a JWT carrying the key id, the precomputed
+    permissions of the key and an expiry, verified without a database read.
+
+    Claims: jti (key id), sub (key name), apps (effective apps), all (the
+    ``"*"`` wildcard), iat, exp. Permission changes of the key's groups
+    apply once the key is reissued; revoke a key by setting its document
+    status to INACTIVE.
+    """
+
+    def __init__(self, keyring, revocations, ttl=DEFAULT_SIGNED_KEY_TTL):
+        self.keyring = keyring
+        self.revocations = revocations
+        self.ttl = ttl
+
+    def issue(self, name, permissions, expires_in=None):
+        """
+        :return: (token, key id, expiry as a unix timestamp)
+        """
+        key_id = uuid.uuid4().hex
+        issued_at = int(time.time())
+        expires_at = issued_at + int(expires_in or self.ttl)
+        token = self.keyring.sign(
+            {
+                "jti": key_id,
+                "sub": name,
+                "apps": permissions[EFFECTIVE_APPS],
+                "all": permissions[ALL_APPS],
+                "iat": issued_at,
+                "exp": expires_at,
+            }
+        )
+        return token, key_id, expires_at
+
+    def verify(self, token):
+        """
+        :return: claims of a valid, unrevoked key
+        :raises SignedKeyError: also when revocations were never loaded
+        """
+        claims = self.keyring.verify(token)
+        if self.revocations.is_revoked(claims["jti"]):
+            raise SignedKeyError(INVALID_API_KEY, status=404)
+        return claims
+
+
+def get_signed_keys(app=None):
+    """
+    Signed api keys of the flask app, None unless configured:
+        SIGNED_KEY_SECRETS = {"2024-06": "...", "2024-01": "..."}
+        SIGNED_KEY_ACTIVE_KID = "2024-06"
+        SIGNED_KEY_ALGORITHM = "HS256"
+        SIGNED_KEY_TTL = 2592000               # seconds
+        SIGNED_KEY_REVOCATION_REFRESH = 30     # seconds
+    """
+    app = app or current_app
+    secrets = app.config.get("SIGNED_KEY_SECRETS")
+    if not secrets:
+        return None
+    signed_keys = app.extensions.get("corefw_signed_keys")
+    if signed_keys is None:
+        signed_keys = SignedKeys(
+            Keyring(
+                secrets,
+                app.config["SIGNED_KEY_ACTIVE_KID"],
+                app.config.get("SIGNED_KEY_ALGORITHM", DEFAULT_ALGORITHM),
+            ),
+            RevocationList(
+                MongoClient.from_config(app.config),
+                get_settings(app, "APIKEY_COLLECTION"),
+                app.config.get(
+                    "SIGNED_KEY_REVOCATION_REFRESH", DEFAULT_REVOCATION_REFRESH_SECONDS
+                ),
+            ),
+            ttl=app.config.get("SIGNED_KEY_TTL", DEFAULT_SIGNED_KEY_TTL),
+        )
+        app.extensions["corefw_signed_keys"] = signed_keys
+    return signed_keys
@@ -12,6 +12,10 @@ MESSAGE = "message"
 CODE = "code"
 LIMIT = "limit"
 PAGE_NO = "pageno"
+PAGE_TOKEN = "page_token"
+BATCH_SIZE = "batch_size"
+NEXT_PAGE_TOKEN_HEADER = "X-Next-Page-Token"
+TOTAL_COUNT_HEADER = "X-Total-Count"
 LISTING_GID = "listingid"
 SORT = "sort"
 CREATED_DATE = "createdDate"
@@ -37,6 +41,16 @@ REQUEST_BODY = "request_body"
 NAME = "name"
 ASSOCIATED_GROUPS = "associated_groups"
 ASSOCIATED_APPS = "associated_apps"
+# precomputed on api keys from their groups, see ApiKeysService.refresh_permissions
+EFFECTIVE_APPS = "effective_apps"
+ALL_APPS = "all_apps"
+# signed api keys, see corefw.authfw.signed_keys
+KEY_ID = "key_id"
+EXPIRES_AT = "expires_at"
+SIGNED = "signed"
+EXPIRES_IN = "expires_in"
+# api key or group throttling, see corefw.authfw.rate_limit
+RATE_LIMIT = "rate_limit"
 API_KEY = "api_key"
 RESPONSE_BODY = "response_body"
 APPLICATION_JSON = "application/json"
@@ -38,6 +38,21 @@ FAILED_TO_CREATE_ITEMID_REQUEST = (
 )
 FAILED_TO_CREATE_GET_REQUEST = ("E0000035", "Failed to create Get request")
 FAILED_TO_PUSH_DATA = ("E000003", "Failed to push data to Kafka")
+INVALID_PAGE_TOKEN = ("E0000036", "Invalid page token")
+EXPORT_INTERRUPTED = ("E0000037", "Export interrupted, the rows sent are incomplete")
+SIGNED_KEYS_NOT_CONFIGURED = ("E0000038", "Signed api keys are not configured")
+RATE_LIMIT_EXCEEDED = ("E0000039", "Rate limit exceeded")
+GROUP_NOT_FOUND = ("E0000040", "Group not found")
+FAILED_TO_UPDATE_GROUP = ("E0000041", "Failed to update group")
+FAILED_TO_REFRESH_PERMISSIONS = (
+    "E0000042",
+    "Group saved, refreshing the permissions of its api keys failed; "
+    "run flask refresh-permissions",
+)
+REVOCATIONS_UNAVAILABLE = (
+    "E0000043",
+    "Signed api key revocations could not be loaded, try again later",
+)
 
 SUCCESS = "Success"
 
@@ -4,9 +4,13 @@ GATEWAY_SOAP_URL = "v1/soap-access"
 APIKEYS_URL = "v1/apikeys"
 VLS_APIKEYS_URL = "v1/vls-apikeys"
 APIK_GROUP_URL = "v1/api-group"
+APIKEYS_EXPORT_URL = "v1/apikeys/export"
+APIK_GROUP_EXPORT_URL = "v1/api-group/export"
 SANDBOX_INTEGRATION_DETAILS_URL = "v1/sandbox-integration/<string:provider_code>"
 SANDBOX_INTEGRATION_URL = "v1/sandbox-integration"
 INTEGRATION_DETAIL_URL = "v1/integration/<string:provider_code>"
 
 INTEGRATION_URL = "v1/integration"
 INTEGRATION_DETAILS_URL = "v1/integration/<string:provider_code>"
+INTEGRATION_EXPORT_URL = "v1/integration/export"
+SANDBOX_INTEGRATION_EXPORT_URL = "v1/sandbox-integration/export"
@@ -57,3 +57,13 @@ class DataBaseException(Exception):
         self.error = message if message else DATABASE_ERROR
         self.status = status
         super(DataBaseException, self).__init__(self.error)
+
+
+class LockNotAcquiredException(DataBaseException):
+    """Raised when a distributed lock could not be acquired in time"""
+
+    def __init__(self, lock_id, status=HTTPStatus.CONFLICT):
+        self.lock_id = lock_id
+        super(LockNotAcquiredException, self).__init__(
+            message="Lock not acquired: %s" % lock_id, status=status
+        )
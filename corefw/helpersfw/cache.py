@@ -0,0 +1,102 @@
+import collections
+import threading
+import time
+
+MISSING = object()
+
+
+class TTLCache(object):
+    """
+    Thread safe in-process cache with LRU eviction and per entry TTL.
+
+    :param maxsize: maximum number of entries, least recently used evicted first
+    :param ttl: default time to live in seconds
+    :param on_evict: optional callback(key, value) run when an entry is
+    evicted, expired, replaced, invalidated or cleared
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """
+        Cached value or default when missing or expired
+        """
+        now = time.monotonic()
+        evicted = MISSING
+        with self.lock:
+            entry = self.entries.get(key, MISSING)
+            if entry is not MISSING and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not MISSING:
+                evicted = self.entries.pop(key)[1]
+            self.misses += 1
+        if evicted is not MISSING:
+            self.evicted(key, evicted)
+        return default
+
+    def set(self, key, value, ttl=None):
+        """
+        Cache value for ttl seconds, defaults to the cache ttl
+        """
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        evicted = []
+        with self.lock:
+            previous = self.entries.pop(key, MISSING)
+            if previous is not MISSING and previous[1] is not value:
+                evicted.append((key, previous[1]))
+            self.entries[key] = (expires, value)
+            while len(self.entries) > self.maxsize:
+                old_key, (_, old_value) = self.entries.popitem(last=False)
+                evicted.append((old_key, old_value))
+        for old_key, old_value in evicted:
+            self.evicted(old_key, old_value)
+
+    def invalidate(self, key):
+        """
+        Drop a cached value
+        :return: True when the key was cached
+        """
+        with self.lock:
+            entry = self.entries.pop(key, MISSING)
+        if entry is MISSING:
+            return False
+        self.evicted(key, entry[1])
+        return True
+
+    def invalidate_where(self, predicate):
+        """
+        Drop the cached values whose key matches predicate(key)
+        :return: number of keys dropped
+        """
+        with self.lock:
+            keys = [key for key in self.entries if predicate(key)]
+            entries = [(key, self.entries.pop(key)) for key in keys]
+        for key, (_, value) in entries:
+            self.evicted(key, value)
+        return len(entries)
+
+    def clear(self):
+        with self.lock:
+            entries = list(self.entries.items())
+            self.entries.clear()
+        for key, (_, value) in entries:
+            self.evicted(key, value)
+
+    def evicted(self, key, value):
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,78 @@
+import json
+
+from bson import json_util
+from bson.raw_bson import RawBSONDocument
+from flask import Response, stream_with_context
+
+from corefw.constants.messages import EXPORT_INTERRUPTED
+from corefw.loggerfw.logger import get_logger
+
+try:
+    import bsonjs
+except ImportError:  # optional, pip install corefw[raw]
+    bsonjs = None
+
+LOGGER = get_logger(__name__)
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+JSON_MIMETYPE = "application/json"
+
+
+def ndjson_response(rows, filename=None):
+    """
+    Stream rows as newline delimited JSON without building the full body.
+    The status is sent before the first row, so an error while streaming is
+    logged and ends the body with a trailer line instead:
+        {"error": {"code": "E0000037", "message": "Export interrupted, ..."}}
+    Clients must treat a body ending with an "error" line as incomplete.
+    :param rows: iterable of json serializable dicts, typically a generator
+    :param filename: optional attachment file name
+    :return: flask streaming Response
+    """
+
+    def generate():
+        try:
+            for row in rows:
+                yield json.dumps(row, default=str) + "\n"
+        except Exception as exception:  # NOSONAR, headers are already sent
+            LOGGER.exception(exception)
+            code, message = EXPORT_INTERRUPTED
+            yield json.dumps({"error": {"code": code, "message": message}}) + "\n"
+
+    headers = {}
+    if filename:
+        headers["Content-Disposition"] = "attachment; filename=%s" % filename
+    return Response(
+        stream_with_context(generate()), mimetype=NDJSON_MIMETYPE, headers=headers
+    )
+
+
+def raw_json_dumps(value):
+    """
+    JSON text for documents read with raw=True. RawBSONDocuments are
+    converted from their bson bytes (in C when python-bsonjs is installed)
+    without building a dict tree; dicts and lists around them, e.g. a
+    service overriding a field, are encoded as usual.
+    """
+    if isinstance(value, RawBSONDocument):
+        if bsonjs is not None:
+            return bsonjs.dumps(value.raw)
+        return json_util.dumps(value, json_options=json_util.RELAXED_JSON_OPTIONS)
+    if isinstance(value, dict):
+        return "{%s}" % ", ".join(
+            "%s: %s" % (json.dumps(str(key)), raw_json_dumps(val))
+            for key, val in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return "[%s]" % ", ".join(raw_json_dumps(val) for val in value)
+    return json.dumps(value, default=str)
+
+
+def raw_json_response(value, status=200, headers=None):
+    """
+    Response for documents read with raw=True, bypassing flask-restx
+    serialization
+    """
+    return Response(
+        raw_json_dumps(value), status=status, mimetype=JSON_MIMETYPE, headers=headers
+    )
@@ -0,0 +1,358 @@
+import collections
+import operator
+import re
+from http import HTTPStatus
+
+from flask_restx import fields
+from jsonschema import Draft4Validator
+
+from corefw.constants.messages import INVALID_PAYLOAD
+from corefw.exceptionsfw.exceptions import GatewayException
+
+FieldError = collections.namedtuple("FieldError", "field detail message")
+FieldError.__doc__ = """
+A failed check: dotted path of the field ("" for the body), detail text
+and the GatewayException message
+"""
+
+Rule = collections.namedtuple("Rule", "check message")
+Rule.__doc__ = """
+Extra check of a field by dotted path, applied after its model field:
+check(value) -> bool and the GatewayException message when it fails
+"""
+
+
+def join(path, name):
+    return "%s.%s" % (path, name) if path else str(name)
+
+
+def fail(errors, path, detail, message=INVALID_PAYLOAD):
+    errors.append(FieldError(path, detail, message))
+
+
+def type_check(types, type_name, exclude_bool=False):
+    detail = "%r is not of type " + repr(type_name)
+
+    def check(value, path, errors):
+        if not isinstance(value, types) or exclude_bool and isinstance(value, bool):
+            fail(errors, path, detail % (value,))
+            return False
+        return True
+
+    return check
+
+
+def bounds(field):
+    """
+    (compare, limit, detail) of fields.Integer / fields.Float min and max
+    """
+    checks = []
+    minimum = getattr(field, "minimum", None)
+    if minimum is not None:
+        if getattr(field, "exclusiveMinimum", None):
+            checks.append((operator.gt, minimum, "less than or equal to the minimum"))
+        else:
+            checks.append((operator.ge, minimum, "less than the minimum"))
+    maximum = getattr(field, "maximum", None)
+    if maximum is not None:
+        if getattr(field, "exclusiveMaximum", None):
+            checks.append(
+                (operator.lt, maximum, "greater than or equal to the maximum")
+            )
+        else:
+            checks.append((operator.le, maximum, "greater than the maximum"))
+    return checks
+
+
+def compile_number(field, types, type_name):
+    is_type = type_check(types, type_name, exclude_bool=True)
+    checks = bounds(field)
+    if not checks:
+        return is_type
+
+    def check(value, path, errors):
+        if is_type(value, path, errors):
+            for compare, limit, detail in checks:
+                if not compare(value, limit):
+                    fail(errors, path, "%r is %s of %r" % (value, detail, limit))
+
+    return check
+
+
+def compile_string(field):
+    is_type = type_check(str, "string")
+    min_length = getattr(field, "min_length", None)
+    max_length = getattr(field, "max_length", None)
+    pattern = getattr(field, "pattern", None)
+    pattern = re.compile(pattern) if pattern else None
+    enum = getattr(field, "enum", None)
+    enum = frozenset(enum) if enum else None
+    if min_length is None and max_length is None and not pattern and not enum:
+        return is_type
+
+    def check(value, path, errors):
+        if not is_type(value, path, errors):
+            return
+        if min_length is not None and len(value) < min_length:
+            fail(errors, path, "%r is too short" % value)
+        if max_length is not None and len(value) > max_length:
+            fail(errors, path, "%r is too long" % value)
+        if pattern is not None and not pattern.search(value):
+            fail(errors, path, "%r does not match %r" % (value, pattern.pattern))
+        if enum is not None and value not in enum:
+            fail(errors, path, "%r is not one of %r" % (value, sorted(enum)))
+
+    return check
+
+
+def all_unique(values):
+    try:
+        return len(set(values)) == len(values)
+    except TypeError:  # objects or lists
+        seen = []
+        for value in values:
+            if value in seen:
+                return False
+            seen.append(value)
+        return True
+
+
+def compile_list(field, item_check):
+    is_type = type_check(list, "array")
+    min_items = field.min_items
+    max_items = field.max_items
+    unique = field.unique
+
+    def check(value, path, errors):
+        if not is_type(value, path, errors):
+            return
+        if min_items is not None and len(value) < min_items:
+            fail(errors, path, "%r is too short" % (value,))
+        if max_items is not None and len(value) > max_items:
+            fail(errors, path, "%r is too long" % (value,))
+        if unique and not all_unique(value):
+            fail(errors, path, "%r has non-unique elements" % (value,))
+        if item_check is not None:
+            for index, item in enumerate(value):
+                item_check(item, join(path, index), errors)
+
+    return check
+
+
+def compile_wildcard(field, item_check):
+    """
+    fields.Wildcard: an object whose every value is checked by item_check
+    """
+    is_type = type_check(dict, "object")
+
+    def check(value, path, errors):
+        if is_type(value, path, errors) and item_check is not None:
+            for name, item in value.items():
+                item_check(item, join(path, name), errors)
+
+    return check
+
+
+def compile_schema(field):
+    """
+    Fallback for the fields without a compiled check (Raw, DateTime, Url,
+    ...): validate with jsonschema against the field schema, as restx does
+    """
+    schema = field.__schema__
+    if "$ref" in str(schema):
+        raise TypeError("Cannot compile field %s" % type(field).__name__)
+    validator = Draft4Validator(schema)
+
+    def check(value, path, errors):
+        for error in validator.iter_errors(value):
+            field_path = path
+            for name in error.path:
+                field_path = join(field_path, name)
+            fail(errors, field_path, error.message)
+
+    return check
+
+
+def compile_field(field, rules=None):
+    """
+    Check function of a flask-restx field, check(value, path, errors)
+    """
+    if isinstance(field, type):
+        field = field()
+    if isinstance(field, fields.Nested):
+        check = compile_object(field.nested, rules)
+        if field.as_list:
+            check = compile_list(fields.List(fields.Raw), check)
+        if field.allow_null:
+            not_null = check
+
+            def check(value, path, errors):
+                if value is not None:
+                    not_null(value, path, errors)
+
+        return check
+    if isinstance(field, fields.List):
+        return compile_list(field, compile_field(field.container, rules))
+    if isinstance(field, fields.Wildcard):
+        return compile_wildcard(field, compile_field(field.container, rules))
+    if isinstance(field, fields.Boolean):
+        return type_check(bool, "boolean")
+    if isinstance(field, fields.Integer):
+        return compile_number(field, int, "integer")
+    if isinstance(field, (fields.Float, fields.Arbitrary, fields.Fixed)):
+        return compile_number(field, (int, float), "number")
+    if isinstance(field, fields.String):
+        return compile_string(field)
+    check = compile_schema(field)
+    if rules:
+        check = chain_checks(check, compile_rules_object(rules))
+    return check
+
+
+def chain_checks(first, then):
+    def check(value, path, errors):
+        failed = len(errors)
+        first(value, path, errors)
+        if len(errors) == failed:
+            then(value, path, errors)
+
+    return check
+
+
+def with_rules(check, rules):
+    """
+    Run the rules of a field once its model check passed
+    """
+    if not rules:
+        return check
+
+    def checked(value, path, errors):
+        if check is not None:
+            failed = len(errors)
+            check(value, path, errors)
+            if len(errors) > failed:
+                return
+        for rule in rules:
+            if not rule.check(value):
+                fail(errors, path, "%r is not valid" % (value,), rule.message)
+
+    return checked
+
+
+def split_rules(rules):
+    """
+    {"data.EmailId": rule} -> {"data": ([rules of data], {"EmailId": ...})}
+    """
+    tree = {}
+    for field_path, rule in (rules or {}).items():
+        name, _, rest = field_path.partition(".")
+        own, nested = tree.setdefault(name, ([], {}))
+        if rest:
+            nested[rest] = rule
+        else:
+            own.append(rule)
+    return tree
+
+
+def compile_properties(model, rules):
+    """
+    (name, required, check) of every field of model and every ruled field
+    """
+    tree = split_rules(rules)
+    properties = []
+    for name, field in (model.resolved if model is not None else {}).items():
+        own, nested = tree.pop(name, ([], {}))
+        required = getattr(field, "required", False)
+        check = with_rules(compile_field(field, nested), own)
+        properties.append((name, bool(required), check))
+    for name, (own, nested) in tree.items():
+        check = with_rules(compile_rules_object(nested) if nested else None, own)
+        properties.append((name, False, check))
+    return tuple(
+        (name, required, check)
+        for name, required, check in properties
+        if required or check is not None
+    )
+
+
+def compile_rules_object(rules):
+    """
+    Check of an untyped field that only carries rules on its keys
+    """
+    properties = compile_properties(None, rules)
+
+    def check(value, path, errors):
+        if isinstance(value, dict):
+            for name, _, property_check in properties:
+                if name in value:
+                    property_check(value[name], join(path, name), errors)
+
+    return check
+
+
+def compile_object(model, rules=None):
+    """
+    Check of a flask-restx model: an object with its fields
+    """
+    properties = compile_properties(model, rules)
+    strict = getattr(model, "__strict__", False)
+    names = frozenset(model.resolved) if strict else None
+    is_type = type_check(dict, "object")
+
+    def check(value, path, errors):
+        if not is_type(value, path, errors):
+            return
+        for name, required, property_check in properties:
+            if name in value:
+                if property_check is not None:
+                    property_check(value[name], join(path, name), errors)
+            elif required:
+                fail(errors, join(path, name), "%r is a required property" % name)
+        if strict:
+            for name in value.keys() - names:
+                fail(errors, join(path, name), "Additional property not allowed")
+
+    return check
+
+
+def compile_validator(model=None, rules=None):
+    """
+    Compile a flask-restx model and field rules into one function walking
+    the request body once, called at import time so requests only pay for
+    the checks. Replaces the generic jsonschema validation of
+    ``ns.expect(..., validate=True)``.
+
+    :param model: flask-restx model, None to only apply rules
+    :param rules: {"dotted.field.path": Rule}
+    :return: validate(body) -> list of FieldError
+    """
+    if model is None:
+        check = compile_rules_object(rules)
+    else:
+        check = compile_object(model, rules)
+
+    def validate(body):
+        errors = []
+        check(body, "", errors)
+        return errors
+
+    validate.model = model
+    return validate
+
+
+def raise_for_errors(errors):
+    """
+    :raises GatewayException: 400 with the message of the first error and
+    every error as "field: detail" in its response params
+    """
+    if not errors:
+        return
+    raise GatewayException(
+        message=errors[0].message,
+        response_params=[
+            "; ".join(
+                "%s: %s" % (error.field or "body", error.detail) for error in errors
+            )
+        ],
+        status=HTTPStatus.BAD_REQUEST,
+    )
@@ -1,9 +1,11 @@
 import json
+import time
 
 from flask import current_app
 from kafka import KafkaConsumer, KafkaProducer
 
 from corefw import get_settings
+from corefw.metricsfw.metrics import KAFKA_SEND_ERRORS, KAFKA_SEND_LATENCY
 
 
 class KafkaClient(object):
@@ -25,9 +27,22 @@ class KafkaClient(object):
 
     def send_json(self, data):
         """
-        Producer - This will send json data to kafka
+        Producer - This will send json data to kafka. The send is timed until
+        the broker acknowledges it
         """
-        self.kafka_producer.send(self.topic_name, data)
+        topic_name = self.topic_name
+        started = time.perf_counter_ns()
+        try:
+            future = self.kafka_producer.send(topic_name, data)
+        except Exception:
+            KAFKA_SEND_ERRORS.inc(topic_name)
+            raise
+        future.add_callback(
+            lambda metadata: KAFKA_SEND_LATENCY.observe(
+                time.perf_counter_ns() - started, topic_name
+            )
+        )
+        future.add_errback(lambda exception: KAFKA_SEND_ERRORS.inc(topic_name))
 
     def get_data_from_consumer(self, topic_name):
         """
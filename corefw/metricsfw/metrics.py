@@ -0,0 +1,596 @@
+import functools
+import glob
+import inspect
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from flask import Response, g, request
+
+from corefw.loggerfw.logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+# mmap layout: bytes used, then entries of key length, utf-8 key padded to
+# 8 bytes and an int64 value, so every value is aligned
+HEADER = struct.Struct("Q")
+KEY_LENGTH = struct.Struct("I")
+VALUE = struct.Struct("q")
+INITIAL_SIZE = 64 * 1024
+FILE_PATTERN = "metrics_%d.db"
+SEPARATOR = "\0"
+
+# HDR style latency buckets: 4 linear sub buckets per power of two of
+# ~1 µs units, which keeps every bucket within 25% of its values
+UNIT_SHIFT = 10
+SUB_BUCKET_BITS = 2
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_EXPONENT = 26
+OVERFLOW_BUCKET = SUB_BUCKETS + (MAX_EXPONENT - SUB_BUCKET_BITS + 1) * SUB_BUCKETS
+# buckets exposed to Prometheus, every 4x from ~4 µs to ~69 s
+EXPOSED_BOUNDS = [
+    4**power << UNIT_SHIFT for power in range(1, MAX_EXPONENT // 2 + 1)
+]
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def bucket_index(nanos):
+    units = nanos >> UNIT_SHIFT
+    if units < SUB_BUCKETS:
+        return max(units, 0)
+    exponent = units.bit_length() - 1
+    if exponent > MAX_EXPONENT:
+        return OVERFLOW_BUCKET
+    sub_bucket = (units >> (exponent - SUB_BUCKET_BITS)) & (SUB_BUCKETS - 1)
+    return SUB_BUCKETS + (exponent - SUB_BUCKET_BITS) * SUB_BUCKETS + sub_bucket
+
+
+def bucket_upper_bound(index):
+    """
+    Exclusive upper bound of a bucket in nanoseconds
+    """
+    if index >= OVERFLOW_BUCKET:
+        return math.inf
+    if index < SUB_BUCKETS:
+        return (index + 1) << UNIT_SHIFT
+    exponent, sub_bucket = divmod(index - SUB_BUCKETS, SUB_BUCKETS)
+    return (SUB_BUCKETS + sub_bucket + 1) << exponent << UNIT_SHIFT
+
+
+def encode_key(key):
+    name, labels, suffix = key
+    return SEPARATOR.join((name,) + labels + (str(suffix),)).encode()
+
+
+def decode_key(encoded):
+    parts = encoded.decode().split(SEPARATOR)
+    suffix = parts[-1]
+    return parts[0], tuple(parts[1:-1]), int(suffix) if suffix.isdigit() else suffix
+
+
+def iter_entries(buffer):
+    """
+    (key, value offset) of every complete entry of a metrics file
+    """
+    used = min(HEADER.unpack_from(buffer, 0)[0], len(buffer))
+    position = HEADER.size
+    while position + KEY_LENGTH.size <= used:
+        entry_size = KEY_LENGTH.size + KEY_LENGTH.unpack_from(buffer, position)[0]
+        offset = position + entry_size + (-entry_size % 8)
+        if offset + VALUE.size > used:
+            break
+        key = bytes(buffer[position + KEY_LENGTH.size : position + entry_size])
+        yield decode_key(key), offset
+        position = offset + VALUE.size
+
+
+def read_entries(buffer):
+    return [
+        (key, VALUE.unpack_from(buffer, offset)[0])
+        for key, offset in iter_entries(buffer)
+    ]
+
+
+class MmapValues(object):
+    """
+    int64 values by key in a memory mapped file owned by one process,
+    anonymous memory when path is None. Other processes only read the file:
+    an entry is complete before the used size in the header covers it.
+    Not thread safe, MetricsRegistry serializes writes.
+    """
+
+    def __init__(self, path=None, size=INITIAL_SIZE):
+        self.path = path
+        self.offsets = {}
+        self.fd = None
+        if path is None:
+            self.map = mmap.mmap(-1, size)
+            self.used = HEADER.size
+        else:
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            size = max(os.fstat(self.fd).st_size, size)
+            os.ftruncate(self.fd, size)
+            self.map = mmap.mmap(self.fd, size)
+            # a reused pid keeps counting where the previous worker stopped
+            self.used = HEADER.unpack_from(self.map, 0)[0] or HEADER.size
+            self.offsets = {
+                key: offset // VALUE.size for key, offset in iter_entries(self.map)
+            }
+        HEADER.pack_into(self.map, 0, self.used)
+        # values as an int64 array, indexed by offset / 8
+        self.cells = memoryview(self.map).cast("q")
+
+    def add(self, key, amount):
+        index = self.offsets.get(key)
+        if index is None:
+            index = self.offsets[key] = self.append(key) // VALUE.size
+        self.cells[index] += amount
+
+    def append(self, key):
+        encoded = encode_key(key)
+        entry_size = KEY_LENGTH.size + len(encoded)
+        offset = self.used + entry_size + (-entry_size % 8)
+        if offset + VALUE.size > len(self.map):
+            self.grow(offset + VALUE.size)
+        KEY_LENGTH.pack_into(self.map, self.used, len(encoded))
+        self.map[self.used + KEY_LENGTH.size : self.used + entry_size] = encoded
+        VALUE.pack_into(self.map, offset, 0)
+        self.used = offset + VALUE.size
+        HEADER.pack_into(self.map, 0, self.used)
+        return offset
+
+    def grow(self, needed):
+        size = len(self.map)
+        while size < needed:
+            size *= 2
+        if self.fd is None:
+            grown = mmap.mmap(-1, size)
+            grown[: self.used] = self.map[: self.used]
+        else:
+            os.ftruncate(self.fd, size)
+            grown = mmap.mmap(self.fd, size)
+        self.cells.release()
+        self.map.close()
+        self.map = grown
+        self.cells = memoryview(self.map).cast("q")
+
+    def items(self):
+        return read_entries(self.map)
+
+    def close(self):
+        self.cells.release()
+        self.map.close()
+        if self.fd is not None:
+            os.close(self.fd)
+
+
+class MetricsRegistry(object):
+    """
+    Metric families and the values of this process.
+
+    With METRICS_DIR set every worker writes its own file there and a scrape
+    of any worker sums the files of all workers, the way prefork servers
+    (gunicorn, uwsgi) need. Files of exited workers keep counting in the
+    totals; empty the directory when the server starts, see clear_directory.
+    Without METRICS_DIR values stay in this worker.
+    """
+
+    def __init__(self):
+        self.families = {}
+        self.directory = None
+        self.enabled = True
+        self.values = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def register(self, family):
+        self.families[family.name] = family
+        return family
+
+    def configure(self, directory=None, enabled=True):
+        with self.lock:
+            self.enabled = enabled
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if directory != self.directory:
+                self.directory = directory
+                self.close()
+
+    def store(self):
+        """
+        Values of this process, reset after a fork by register_at_fork
+        """
+        if self.values is None:
+            path = None
+            if self.directory:
+                path = os.path.join(self.directory, FILE_PATTERN % os.getpid())
+            self.values = MmapValues(path)
+            self.pid = os.getpid()
+        return self.values
+
+    def add(self, key, amount=1):
+        if self.enabled:
+            with self.lock:
+                self.store().add(key, amount)
+
+    def add_many(self, items):
+        if self.enabled:
+            with self.lock:
+                store = self.store()
+                for key, amount in items:
+                    store.add(key, amount)
+
+    def collect(self):
+        """
+        Values summed over every worker: {(name, labels, suffix): value}
+        """
+        totals = {}
+        if self.directory:
+            rows = []
+            for path in glob.glob(os.path.join(self.directory, "metrics_*.db")):
+                try:
+                    with open(path, "rb") as metrics_file:
+                        rows.extend(read_entries(metrics_file.read()))
+                except (OSError, struct.error) as exception:
+                    LOGGER.error("Skipping metrics file %s: %s", path, exception)
+        else:
+            with self.lock:
+                rows = self.store().items()
+        for key, value in rows:
+            totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def series(self):
+        """
+        {family name: {labels: {suffix: value}}} of the collected values
+        """
+        grouped = {}
+        for (name, labels, suffix), value in self.collect().items():
+            grouped.setdefault(name, {}).setdefault(labels, {})[suffix] = value
+        return grouped
+
+    def render(self):
+        """
+        Prometheus text exposition format
+        """
+        grouped = self.series()
+        lines = []
+        for name in sorted(grouped):
+            family = self.families.get(name)
+            if family is None:
+                continue
+            lines.append("# HELP %s %s" % (name, family.documentation))
+            lines.append("# TYPE %s %s" % (name, family.type))
+            for labels in sorted(grouped[name]):
+                lines.extend(family.render(labels, grouped[name][labels]))
+        lines.append("")
+        return "\n".join(lines)
+
+    def snapshot(self):
+        """
+        Counter values and latency percentiles, as json
+        """
+        grouped = self.series()
+        snapshot = {}
+        for name in sorted(grouped):
+            family = self.families.get(name)
+            if family is not None:
+                snapshot[name] = [
+                    dict(zip(family.labelnames, labels), **family.summary(values))
+                    for labels, values in sorted(grouped[name].items())
+                ]
+        return snapshot
+
+    def close(self):
+        if self.values is not None and self.pid == os.getpid():
+            self.values.close()
+        self.values = None
+
+    def reset(self):
+        """
+        Forget the state inherited from the parent process
+        """
+        self.lock = threading.Lock()
+        self.values = None
+        self.pid = None
+
+
+registry = MetricsRegistry()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=registry.reset)
+
+
+def clear_directory(directory):
+    """
+    Remove the metrics files of previous workers, e.g. from the gunicorn
+    on_starting hook
+    """
+    for path in glob.glob(os.path.join(directory, "metrics_*.db")):
+        os.remove(path)
+
+
+def format_labels(labelnames, labels, extra=None):
+    pairs = list(zip(labelnames, labels))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"'
+        % (
+            name,
+            value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in pairs
+    )
+
+
+def format_seconds(nanos):
+    return repr(nanos / 1e9)
+
+
+class Counter(object):
+    """
+    Monotonic count by label values, e.g. COUNTER.inc("allowed")
+    """
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def inc(self, *labels, amount=1):
+        registry.add((self.name, tuple(map(str, labels)), ""), amount)
+
+    def render(self, labels, values):
+        return [
+            "%s%s %d"
+            % (self.name, format_labels(self.labelnames, labels), values.get("", 0))
+        ]
+
+    def summary(self, values):
+        return {"value": values.get("", 0)}
+
+
+class Histogram(object):
+    """
+    Latency distribution in nanoseconds by label values, HDR style buckets,
+    exposed in seconds, e.g. HISTOGRAM.observe(elapsed_ns, "GET", route)
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def observe(self, nanos, *labels):
+        labels = tuple(map(str, labels))
+        registry.add_many(
+            (
+                ((self.name, labels, bucket_index(nanos)), 1),
+                ((self.name, labels, "sum"), nanos),
+                ((self.name, labels, "count"), 1),
+            )
+        )
+
+    def time(self, *labels):
+        return Timer(self, labels)
+
+    @staticmethod
+    def buckets(values):
+        return sorted(
+            (suffix, value)
+            for suffix, value in values.items()
+            if isinstance(suffix, int)
+        )
+
+    def render(self, labels, values):
+        lines = []
+        buckets = self.buckets(values)
+        cumulative = position = 0
+        for bound in EXPOSED_BOUNDS:
+            while position < len(buckets) and (
+                bucket_upper_bound(buckets[position][0]) <= bound
+            ):
+                cumulative += buckets[position][1]
+                position += 1
+            lines.append(
+                "%s_bucket%s %d"
+                % (
+                    self.name,
+                    format_labels(
+                        self.labelnames, labels, ("le", format_seconds(bound))
+                    ),
+                    cumulative,
+                )
+            )
+        count = values.get("count", 0)
+        lines.append(
+            "%s_bucket%s %d"
+            % (self.name, format_labels(self.labelnames, labels, ("le", "+Inf")), count)
+        )
+        label_text = format_labels(self.labelnames, labels)
+        lines.append(
+            "%s_sum%s %s"
+            % (self.name, label_text, format_seconds(values.get("sum", 0)))
+        )
+        lines.append("%s_count%s %d" % (self.name, label_text, count))
+        return lines
+
+    def percentile(self, values, percent):
+        """
+        Upper bound, in ns, of the bucket holding the percentile
+        """
+        count = values.get("count", 0)
+        if not count:
+            return 0
+        threshold = count * percent / 100.0
+        seen = 0
+        for index, bucket_count in self.buckets(values):
+            seen += bucket_count
+            if seen >= threshold:
+                break
+        # overflowing values are reported at the largest tracked latency
+        return bucket_upper_bound(min(index, OVERFLOW_BUCKET - 1))
+
+    def summary(self, values):
+        count = values.get("count", 0)
+        total_ms = values.get("sum", 0) / 1e6
+        return {
+            "count": count,
+            "mean_ms": total_ms / count if count else 0,
+            "p50_ms": self.percentile(values, 50) / 1e6,
+            "p95_ms": self.percentile(values, 95) / 1e6,
+            "p99_ms": self.percentile(values, 99) / 1e6,
+        }
+
+
+class Timer(object):
+    """
+    Context manager observing its perf_counter_ns duration into a histogram
+    """
+
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels=()):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter_ns() - self.started, *self.labels)
+
+
+def elapsed_ms(started):
+    """
+    Milliseconds since a time.perf_counter_ns() start, for timing logs
+    """
+    return (time.perf_counter_ns() - started) / 1e6
+
+
+def timed(histogram, errors=None):
+    """
+    Method decorator observing every call, or await of a coroutine method,
+    into histogram labelled by the method name, and counting the calls that
+    raise into errors
+    """
+
+    def decorator(func):
+        name = func.__name__
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter_ns()
+                try:
+                    return await func(*args, **kwargs)
+                except BaseException:
+                    if errors is not None:
+                        errors.inc(name)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter_ns() - started, name)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                if errors is not None:
+                    errors.inc(name)
+                raise
+            finally:
+                histogram.observe(time.perf_counter_ns() - started, name)
+
+        return wrapper
+
+    return decorator
+
+
+REQUEST_LATENCY = Histogram(
+    "corefw_http_request_duration_seconds",
+    "HTTP request latency by route",
+    ("method", "route", "status"),
+)
+AUTH_PHASE_LATENCY = Histogram(
+    "corefw_auth_phase_duration_seconds",
+    "Api key authorization latency by phase",
+    ("phase",),
+)
+AUTH_RESULTS = Counter(
+    "corefw_auth_results_total", "Api key authorizations by result", ("result",)
+)
+DAO_LATENCY = Histogram(
+    "corefw_dao_call_duration_seconds",
+    "DataAccessObject call latency by method",
+    ("method",),
+)
+DAO_ERRORS = Counter(
+    "corefw_dao_call_errors_total", "DataAccessObject calls raising", ("method",)
+)
+KAFKA_SEND_LATENCY = Histogram(
+    "corefw_kafka_send_duration_seconds",
+    "Kafka produce latency until the broker acknowledged",
+    ("topic",),
+)
+KAFKA_SEND_ERRORS = Counter(
+    "corefw_kafka_send_errors_total", "Kafka messages not produced", ("topic",)
+)
+
+
+def start_request_timer():
+    g.metrics_started = time.perf_counter_ns()
+
+
+def record_request(response):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_LATENCY.observe(
+            time.perf_counter_ns() - started,
+            request.method,
+            route,
+            response.status_code,
+        )
+    return response
+
+
+def metrics_view():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+def install_metrics(app):
+    """
+    Time every request of the flask app and serve the Prometheus metrics:
+        METRICS_ENABLED = True
+        METRICS_DIR = "/dev/shm/corefw-metrics"   # shared by prefork workers
+        METRICS_PATH = "/metrics"
+    :return: the registry or None when disabled
+    """
+    enabled = app.config.get("METRICS_ENABLED", True)
+    registry.configure(app.config.get("METRICS_DIR"), enabled=enabled)
+    if not enabled:
+        return None
+    app.before_request(start_request_timer)
+    app.after_request(record_request)
+    app.add_url_rule(
+        app.config.get("METRICS_PATH", "/metrics"), "metrics", metrics_view
+    )
+    return registry
@@ -18,8 +18,32 @@ from src.specs.enums.status import Status
 from src.specs.helpers.common import get_routes_list
 
 from corefw.appfw.routes import apikeys_ns, integration_ns
+from corefw.constants.constants import EXPIRES_IN, RATE_LIMIT, SIGNED
 from corefw.enums.provider import Providers
 
+RATE_LIMIT_ROUTE_MODEL = apikeys_ns.model(
+    "rate_limit_route_model",
+    {
+        "rate": fields.Float(
+            required=True, min=0, exclusiveMin=True, description="Requests/s"
+        ),
+        "burst": fields.Integer(min=1, description="Requests at once"),
+    },
+)
+
+RATE_LIMIT_MODEL = apikeys_ns.model(
+    "rate_limit_model",
+    {
+        "rate": fields.Float(min=0, exclusiveMin=True, description="Requests/s"),
+        "burst": fields.Integer(min=1, description="Requests at once"),
+        "routes": fields.Wildcard(
+            fields.Nested(RATE_LIMIT_ROUTE_MODEL),
+            description="Route name -> {rate, burst}",
+            example={"route": {"rate": 5}},
+        ),
+    },
+)
+
 CREATE_APIKEY_MODEL = apikeys_ns.model(
     "apikeys_model",
     {
@@ -27,9 +51,20 @@ CREATE_APIKEY_MODEL = apikeys_ns.model(
         ASSOCIATED_GROUPS: fields.List(
             fields.String(), min_items=1, required=True, unique=True
         ),
+        SIGNED: fields.Boolean(
+            default=False, description="Issue a signed, self-verifying key"
+        ),
+        EXPIRES_IN: fields.Integer(min=1, description="Signed key lifetime (s)"),
+        RATE_LIMIT: fields.Nested(RATE_LIMIT_MODEL),
+    },
+)
+UPDATE_APIKEY_MODEL = apikeys_ns.model(
+    "update_apikey",
+    {
+        STATUS: fields.String(),
+        RATE_LIMIT: fields.Nested(RATE_LIMIT_MODEL),
     },
 )
-UPDATE_APIKEY_MODEL = apikeys_ns.model("update_apikey", {STATUS: fields.String()})
 
 CREATE_GROUP_MODEL = apikeys_ns.model(
     "create_api_group",
@@ -42,6 +77,7 @@ CREATE_GROUP_MODEL = apikeys_ns.model(
             unique=True,
             example=get_routes_list(),
         ),
+        RATE_LIMIT: fields.Nested(RATE_LIMIT_MODEL),
     },
 )
 
@@ -20,6 +20,8 @@ from src.specs.constants.constants import (
 )
 from src.specs.enums.status import Status
 
+from corefw.constants.constants import RATE_LIMIT
+
 
 class ApiKeySchema(dict):
     __setattr__ = dict.__setitem__
@@ -32,6 +34,8 @@ class ApiKeySchema(dict):
         self.created_at = datetime.utcnow().timestamp()
         self.status = ACTIVE
         self.last_used = ""
+        if kwargs.get(RATE_LIMIT):
+            self.rate_limit = kwargs.get(RATE_LIMIT)
         dict.__init__(self)
 
 
@@ -60,6 +64,8 @@ class ApiKeyUpdateSchema(dict):
             self.associated_groups = kwargs.get(ASSOCIATED_GROUPS)
         if kwargs.get(STATUS):
             self.status = kwargs.get(STATUS)
+        if kwargs.get(RATE_LIMIT):
+            self.rate_limit = kwargs.get(RATE_LIMIT)
         if kwargs.get(LAST_USED):
             self.last_used = str(datetime.utcnow())
         dict.__init__(self)
@@ -74,6 +80,22 @@ class APIGroupSchema(dict):
         self.associated_apps = kwargs.get(ASSOCIATED_APPS)
         self.created_at = int(datetime.utcnow().timestamp())
         self.status = Status.ACTIVE.value
+        if kwargs.get(RATE_LIMIT):
+            self.rate_limit = kwargs.get(RATE_LIMIT)
+        dict.__init__(self)
+
+
+class APIGroupUpdateSchema(dict):
+    __setattr__ = dict.__setitem__
+    __getattr__ = dict.__getitem__
+
+    def __init__(self, **kwargs):
+        if kwargs.get(ASSOCIATED_APPS) is not None:
+            self.associated_apps = kwargs.get(ASSOCIATED_APPS)
+        if kwargs.get(STATUS):
+            self.status = kwargs.get(STATUS)
+        if kwargs.get(RATE_LIMIT):
+            self.rate_limit = kwargs.get(RATE_LIMIT)
         dict.__init__(self)
 
 
@@ -0,0 +1,404 @@
+import asyncio
+import itertools
+import os
+import threading
+import weakref
+
+from flask import current_app
+from pymongo.collection import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from corefw.exceptionsfw.exceptions import DataBaseException
+from corefw.loggerfw.logger import get_logger
+from corefw.metricsfw.metrics import DAO_ERRORS, DAO_LATENCY, timed
+from corefw.mongofw.bulk import (
+    MAX_BATCH_BYTES,
+    MAX_BATCH_OPERATIONS,
+    chunk_operations,
+    mark_failed,
+    merge_bulk_api_result,
+    new_bulk_result,
+)
+from corefw.mongofw.client_registry import DEFAULT_CLIENT_OPTIONS, ClientRegistry
+from corefw.mongofw.data_access import DEFAULT_BATCH_SIZE, DataAccessObject
+from corefw.mongofw.pagination import DEFAULT_PAGE_LIMIT
+from corefw.storagefw.backends import MongoBackend
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:  # motor is optional, see setup.py extras
+    AsyncIOMotorClient = None
+
+LOGGER = get_logger(__name__)
+
+MOTOR_DRIVER = "motor"
+THREAD_DRIVER = "thread"
+
+
+def close_clients(clients):
+    for client in clients.values():
+        client.close()
+    clients.clear()
+
+
+class AsyncClientRegistry(object):
+    """
+    Pooled motor clients per (event loop, url, options). Motor clients are
+    bound to the loop they first run on, so each loop gets its own client.
+
+    Clients are closed with their loop: entries of closed loops are evicted
+    on the next lookup, and loops that are garbage collected close theirs
+    through a finalizer, so servers running a loop per request (asgiref)
+    only hold the clients of the loops still open.
+    """
+
+    def __init__(self):
+        self._clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def get_client(self, mongo_url, **options):
+        """
+        Get the motor client of the running loop, creating it on first use
+        """
+        if self._pid != os.getpid():
+            self._lock = threading.Lock()
+            self._clients = weakref.WeakKeyDictionary()
+            self._pid = os.getpid()
+        loop = asyncio.get_running_loop()
+        key = ClientRegistry.make_key(mongo_url, options)
+        with self._lock:
+            self.evict_closed()
+            clients = self._clients.get(loop)
+            if clients is None:
+                clients = self._clients[loop] = {}
+                weakref.finalize(loop, close_clients, clients)
+            client = clients.get(key)
+            if client is None:
+                client_options = dict(DEFAULT_CLIENT_OPTIONS)
+                client_options.update(options)
+                client = clients[key] = AsyncIOMotorClient(mongo_url, **client_options)
+        return client
+
+    def evict_closed(self):
+        """
+        Close the clients of closed loops, under the lock
+        """
+        for loop, clients in list(self._clients.items()):
+            if loop.is_closed():
+                del self._clients[loop]
+                close_clients(clients)
+
+    def client_count(self):
+        """
+        Number of live clients, over every open loop
+        """
+        with self._lock:
+            return sum(len(clients) for clients in self._clients.values())
+
+
+async_client_registry = AsyncClientRegistry()
+
+
+class AsyncDataAccessObject:
+    """
+    Asyncio data access layer with the DataAccessObject surface.
+
+    Uses motor when it is installed and MONGO_ASYNC_DRIVER is "motor" (the
+    default); otherwise every call runs the synchronous DataAccessObject in a
+    worker thread. Settings, defaults and errors follow DataAccessObject.
+    """
+
+    def __init__(self, db_name=None, mongo_url=None, collection_name=None):
+        self.sync_dao = DataAccessObject(
+            db_name=db_name, mongo_url=mongo_url, collection_name=collection_name
+        )
+        self.db_name = self.sync_dao.db_name
+        self.collection_name = self.sync_dao.collection_name
+        driver = current_app.config.get("MONGO_ASYNC_DRIVER", MOTOR_DRIVER)
+        self.use_motor = (
+            AsyncIOMotorClient is not None
+            and driver == MOTOR_DRIVER
+            and self.sync_dao.backend.name == MongoBackend.name
+        )
+
+    def get_collection(self, collection_name=None):
+        """
+        Motor collection of the running loop
+        """
+        client = async_client_registry.get_client(
+            self.sync_dao.mongo_conn.mongo_url,
+            **self.sync_dao.mongo_conn.client_options,
+        )
+        return client[self.db_name][collection_name or self.collection_name]
+
+    def get_read_collection(self, collection_name=None, read_preference=None):
+        """
+        Motor collection routed like DataAccessObject reads
+        """
+        collection_name = collection_name or self.collection_name
+        read_options = self.sync_dao.get_read_options(collection_name, read_preference)
+        collection = self.get_collection(collection_name)
+        if any(value is not None for value in read_options.values()):
+            collection = collection.with_options(**read_options)
+        return collection
+
+    @timed(DAO_LATENCY, DAO_ERRORS)
+    async def count(self, filter_dict, collection_name=None):
+        """
+        Get count
+        """
+        if not self.use_motor:
+            return await asyncio.to_thread(
+                self.sync_dao.count, filter_dict, collection_name
+            )
+        try:
+            return await self.get_read_collection(collection_name).count_documents(
+                filter_dict or {}
+            )
+        except Exception as ex:  # NOSONAR, CancelledError must propagate
+            LOGGER.error(ex)
+            raise DataBaseException(message=ex)
+
+    @timed(DAO_LATENCY, DAO_ERRORS)
+    async def get_resource(
+        self,
+        filter_dict,
+        collection_name=None,
+        project_fields=None,
+        read_preference=None,
+    ):
+        """
+        Get Resource using filter
+        """
+        if not self.use_motor:
+            return await asyncio.to_thread(
+                self.sync_dao.get_resource,
+                filter_dict,
+                collection_name,
+                project_fields,
+                read_preference,
+            )
+        try:
+            if not project_fields:
+                project_fields = {"_id": 0}
+            collection = self.get_read_collection(collection_name, read_preference)
+            return await collection.find_one(filter_dict, project_fields)
+        except Exception as ex:  # NOSONAR
+            LOGGER.error(ex)
+            raise DataBaseException(message=ex)
+
+    @timed(DAO_LATENCY, DAO_ERRORS)
+    async def find_all_with_collation(
+        self, filter_dict, sort_by, collection_name=None, **kwargs
+    ):
+        """
+        Get list here
+        """
+        if not self.use_motor:
+            return await asyncio.to_thread(
+                self.sync_dao.find_all_with_collation,
+                filter_dict,
+                sort_by,
+                collection_name,
+                **kwargs,
+            )
+        try:
+            limit = kwargs.get("limit", DEFAULT_PAGE_LIMIT)
+            cursor = (
+                self.get_read_collection(collection_name, kwargs.get("read_preference"))
+                .find(filter_dict, kwargs.get("project_fields", {"_id": 0}))
+                .collation(kwargs.get("collation", {"locale": "en"}))
+                .sort([(sort_by, kwargs.get("direction", 1))])
+                .skip(kwargs.get("offset", 0))
+                .limit(limit)
+            )
+            return await cursor.to_list(length=limit or None)
+        except Exception as ex:  # NOSONAR
+            LOGGER.error(ex)
+            raise DataBaseException(message=str(ex))
+
+    async def iter_all(
+        self,
+        filter_dict,
+        sort_by=None,
+        collection_name=None,
+        batch_size=DEFAULT_BATCH_SIZE,
+        **kwargs,
+    ):
+        """
+        Async generator counterpart of DataAccessObject.iter_all
+        """
+        if not self.use_motor:
+            rows = self.iter_all_in_thread(
+                filter_dict, sort_by, collection_name, batch_size, **kwargs
+            )
+            async for row in rows:
+                yield row
+            return
+        try:
+            collection = self.get_read_collection(
+                collection_name, kwargs.get("read_preference")
+            )
+            cursor = collection.find(
+                filter_dict,
+                kwargs.get("project_fields", {"_id": 0}),
+                batch_size=batch_size,
+            )
+            if sort_by:
+                cursor = cursor.collation(
+                    kwargs.get("collation", {"locale": "en"})
+                ).sort([(sort_by, kwargs.get("direction", 1))])
+            if kwargs.get("offset"):
+                cursor = cursor.skip(kwargs.get("offset"))
+            if kwargs.get("limit"):
+                cursor = cursor.limit(kwargs.get("limit"))
+            async for row in cursor:
+                yield row
+        except Exception as ex:  # NOSONAR
+            LOGGER.error(ex)
+            raise DataBaseException(message=str(ex))
+
+    async def iter_all_in_thread(
+        self, filter_dict, sort_by, collection_name, batch_size, **kwargs
+    ):
+        """
+        Thread offload fallback of iter_all, one batch per worker thread call
+        """
+        rows = self.sync_dao.iter_all(
+            filter_dict,
+            sort_by=sort_by,
+            collection_name=collection_name,
+            batch_size=batch_size,
+            **kwargs,
+        )
+        try:
+            while True:
+                batch = await asyncio.to_thread(
+                    list, itertools.islice(rows, batch_size)
+                )
+                if not batch:
+                    return
+                for row in batch:
+                    yield row
+        finally:
+            rows.close()
+
+    @timed(DAO_LATENCY, DAO_ERRORS)
+    async def create(self, data, db_name=None):
+        """
+        Create a new resource
+        @return:
+        """
+        if not self.use_motor:
+            return await asyncio.to_thread(self.sync_dao.create, data, db_name)
+        try:
+            result = await self.get_collection().insert_one(data)
+            return result.inserted_id
+        except DuplicateKeyError as dup_err:
+            LOGGER.error(dup_err)
+            raise DataBaseException(message=dup_err.details["errmsg"])
+        except Exception as error_string:  # NOSONAR
+            LOGGER.error(error_string)
+            raise DataBaseException(message=error_string)
+
+    @timed(DAO_LATENCY, DAO_ERRORS)
+    async def update(
+        self, data, filter_dict: dict, update_content_type="$set", collection_name=None
+    ):
+        """
+        @param data:
+        @param filter_dict:
+        @param update_content_type
+        @return:
+        """
+        if not self.use_motor:
+            return await asyncio.to_thread(
+                self.sync_dao.update,
+                data,
+                filter_dict,
+                update_content_type,
+                collection_name,
+            )
+        try:
+            await self.get_collection(collection_name).find_one_and_update(
+                filter_dict,
+                {update_content_type: data},
+                return_document=ReturnDocument.AFTER,
+                projection={"_id": 0},
+            )
+        except DuplicateKeyError as ex:
+            LOGGER.error(ex)
+            raise DataBaseException(message="Duplicate key")
+        except Exception as error_string:  # NOSONAR
+            LOGGER.error(error_string)
+            raise DataBaseException(message=error_string)
+
+    @timed(DAO_LATENCY, DAO_ERRORS)
+    async def delete(self, filter_dict: dict, collection_name=None):
+        """
+        Delete a resource
+        @param filter_dict:
+        @param collection_name:
+        @return:
+        """
+        if not self.use_motor:
+            return await asyncio.to_thread(
+                self.sync_dao.delete, filter_dict, collection_name
+            )
+        try:
+            await self.get_collection(collection_name).delete_one(filter_dict)
+        except Exception as exception:  # NOSONAR
+            LOGGER.error(exception)
+            raise DataBaseException(message=exception)
+
+    @timed(DAO_LATENCY, DAO_ERRORS)
+    async def bulk_write(
+        self,
+        operations,
+        collection_name=None,
+        update_content_type="$set",
+        max_batch_operations=MAX_BATCH_OPERATIONS,
+        max_batch_bytes=MAX_BATCH_BYTES,
+    ):
+        """
+        Async counterpart of DataAccessObject.bulk_write
+        """
+        if not self.use_motor:
+            return await asyncio.to_thread(
+                self.sync_dao.bulk_write,
+                operations,
+                collection_name,
+                update_content_type,
+                max_batch_operations,
+                max_batch_bytes,
+            )
+        operations = list(operations)
+        result = new_bulk_result(operations)
+        try:
+            collection = self.get_collection(collection_name)
+            batches = chunk_operations(
+                operations,
+                max_batch_operations=max_batch_operations,
+                max_batch_bytes=max_batch_bytes,
+                update_content_type=update_content_type,
+            )
+            for offset, batch in batches:
+                try:
+                    write_result = await collection.bulk_write(batch, ordered=False)
+                    api_result = write_result.bulk_api_result
+                except BulkWriteError as bulk_error:
+                    LOGGER.error(bulk_error)
+                    api_result = bulk_error.details
+                except Exception as batch_error:  # NOSONAR
+                    LOGGER.error(batch_error)
+                    for index in range(offset, offset + len(batch)):
+                        mark_failed(result, index, batch_error)
+                    continue
+                merge_bulk_api_result(
+                    result, operations, offset, len(batch), api_result
+                )
+            return result
+        except Exception as error_string:  # NOSONAR
+            LOGGER.error(error_string)
+            raise DataBaseException(message=error_string)
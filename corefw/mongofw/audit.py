@@ -0,0 +1,251 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
+
+from corefw import get_settings
+from corefw.loggerfw.logger import get_logger
+from corefw.mongofw.mongo_client import MongoClient
+
+LOGGER = get_logger(__name__)
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_SECONDS = 1
+# acknowledged by the primary only, the audit trail is not worth a majority
+AUDIT_WRITE_CONCERN = WriteConcern(w=1)
+
+
+class AuditLogWriter(object):
+    """
+    Asynchronous audit log. ``record`` only puts the entry on a bounded
+    queue; a background thread writes the queue in insert_many batches of
+    up to batch_size entries, at least every flush_seconds.
+
+    When the queue is full the request thread waits up to block_seconds
+    (backpressure, 0 by default) and then drops the entry, so a slow or
+    unreachable mongo never stalls requests. Drops, waits and write errors
+    are counted in ``status``.
+    """
+
+    def __init__(
+        self,
+        mongo_conn,
+        db_name,
+        collection_name,
+        queue_size=DEFAULT_QUEUE_SIZE,
+        batch_size=DEFAULT_BATCH_SIZE,
+        flush_seconds=DEFAULT_FLUSH_SECONDS,
+        block_seconds=0,
+    ):
+        self.mongo_conn = mongo_conn
+        self.db_name = db_name
+        self.collection_name = collection_name
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.block_seconds = block_seconds
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.pid = None
+        self.stats = dict.fromkeys(
+            ("recorded", "dropped", "blocked", "written", "batches", "errors"), 0
+        )
+        atexit.register(self.stop)
+
+    def record(self, entry):
+        """
+        Queue an audit entry
+        :return: False when the entry was dropped
+        """
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            if not self.block_seconds:
+                self.stats["dropped"] += 1
+                return False
+            self.stats["blocked"] += 1
+            try:
+                self.queue.put(entry, timeout=self.block_seconds)
+            except queue.Full:
+                self.stats["dropped"] += 1
+                return False
+        self.stats["recorded"] += 1
+        return True
+
+    def start(self):
+        """
+        Start the writer of this process. A forked worker gets a new queue,
+        the entries inherited from its parent are written by the parent.
+        """
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(maxsize=self.queue_size)
+            self.stopped.clear()
+            self.thread = threading.Thread(
+                target=self.run, name="audit-log", daemon=True
+            )
+            self.thread.start()
+            self.pid = os.getpid()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.write(self.next_batch())
+            except Exception as exception:  # the writer must outlive any batch
+                LOGGER.exception(exception)
+                self.stats["errors"] += 1
+        self.flush()
+
+    def next_batch(self):
+        """
+        Wait up to flush_seconds for a first entry, then take what is queued
+        """
+        try:
+            batch = [self.queue.get(timeout=self.flush_seconds)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self):
+        """
+        Write everything queued so far
+        """
+        while not self.queue.empty():
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.write(batch)
+
+    def write(self, batch):
+        if not batch:
+            return
+        try:
+            self.mongo_conn.create_many(
+                self.db_name,
+                self.collection_name,
+                batch,
+                ordered=False,
+                write_concern=AUDIT_WRITE_CONCERN,
+            )
+            self.stats["written"] += len(batch)
+        except BulkWriteError as exception:
+            LOGGER.error(exception.details)
+            inserted = exception.details.get("nInserted", 0)
+            self.stats["errors"] += 1
+            self.stats["written"] += inserted
+            self.stats["dropped"] += len(batch) - inserted
+        except Exception as exception:
+            # mongo errors and unencodable entries (bson InvalidDocument) alike:
+            # entries are dropped, retrying would only grow the backlog
+            LOGGER.error(exception)
+            self.stats["errors"] += 1
+            self.stats["dropped"] += len(batch)
+        self.stats["batches"] += 1
+
+    def stop(self):
+        """
+        Stop the writer and write what is queued
+        """
+        if self.pid != os.getpid():
+            return
+        self.stopped.set()
+        self.thread.join(timeout=self.flush_seconds * 2)
+        self.flush()
+
+    def status(self):
+        return dict(self.stats, queued=self.queue.qsize(), capacity=self.queue_size)
+
+
+def get_audit_writer(app=None):
+    """
+    Audit log writer of the flask app, writing to LOG_DATABASE_NAME /
+    LOG_COLLECTION_NAME. None when AUDIT_LOG_ENABLED is false.
+        AUDIT_LOG_QUEUE_SIZE = 10000
+        AUDIT_LOG_BATCH_SIZE = 500
+        AUDIT_LOG_FLUSH_SECONDS = 1
+        AUDIT_LOG_BLOCK_SECONDS = 0
+    """
+    app = app or current_app
+    if not app.config.get("AUDIT_LOG_ENABLED", True):
+        return None
+    writer = app.extensions.get("corefw_audit_writer")
+    if writer is None:
+        writer = AuditLogWriter(
+            MongoClient.from_config(app.config),
+            db_name=get_settings(app, "LOG_DATABASE_NAME"),
+            collection_name=get_settings(app, "LOG_COLLECTION_NAME"),
+            queue_size=app.config.get("AUDIT_LOG_QUEUE_SIZE", DEFAULT_QUEUE_SIZE),
+            batch_size=app.config.get("AUDIT_LOG_BATCH_SIZE", DEFAULT_BATCH_SIZE),
+            flush_seconds=app.config.get(
+                "AUDIT_LOG_FLUSH_SECONDS", DEFAULT_FLUSH_SECONDS
+            ),
+            block_seconds=app.config.get("AUDIT_LOG_BLOCK_SECONDS", 0),
+        )
+        app.extensions["corefw_audit_writer"] = writer
+    return writer
+
+
+def claim_audit():
+    """
+    Claim the audit entry of the current request, so nested @auth / @log
+    calls record one entry per request: the outermost call, which sees the
+    whole request, claims it on entry.
+    :return: True for the first caller of the request, False for later ones
+    and outside a request
+    """
+    if not has_request_context() or g.get("audit_claimed"):
+        return False
+    g.audit_claimed = True
+    return True
+
+
+def record_call(name, started, status=None, error=None, **fields):
+    """
+    Audit a finished call: timing, outcome and the request it served.
+    Only queues the entry, see AuditLogWriter. Decorators call it when
+    claim_audit granted them the request.
+    :param name: function name
+    :param started: time.perf_counter_ns() at the start of the call
+    :param status: http status of the response
+    :param error: exception raised by the call
+    """
+    if not has_app_context():
+        return
+    writer = get_audit_writer()
+    if writer is None:
+        return
+    entry = {
+        "function": name,
+        "timestamp": datetime.utcnow(),
+        "duration_ms": (time.perf_counter_ns() - started) / 1e6,
+        "status": int(status) if status is not None else None,
+    }
+    if error is not None:
+        entry["error"] = "%s: %s" % (type(error).__name__, error)
+    if has_request_context():
+        entry["method"] = request.method
+        entry["path"] = request.path
+        entry["remote_addr"] = request.remote_addr
+        entry["identifier"] = g.get("identifier")
+    entry.update(fields)
+    writer.record(entry)
@@ -0,0 +1,135 @@
+import bson
+from pymongo import DeleteOne, InsertOne, ReplaceOne, UpdateOne
+
+INSERT = "insert"
+UPDATE = "update"
+UPSERT = "upsert"
+REPLACE = "replace"
+DELETE = "delete"
+
+# mongod rejects a single command above 16MB; keep headroom for the envelope
+MAX_BATCH_BYTES = 16 * 1024 * 1024 - 16 * 1024
+MAX_BATCH_OPERATIONS = 1000
+
+
+def build_write_model(operation, update_content_type="$set"):
+    """
+    Convert an operation dict into a pymongo write model
+    :param operation: {"op": insert|update|upsert|replace|delete, "filter": {},
+    "data": {}}. ``data`` is the document for insert/replace and the fields to
+    set for update/upsert.
+    :param update_content_type: update operator used for update/upsert
+    :return: (write model, approximate BSON size in bytes)
+    """
+    op_type = operation.get("op")
+    filter_dict = operation.get("filter") or {}
+    data = operation.get("data")
+
+    if op_type == INSERT:
+        return InsertOne(data), len(bson.encode(data))
+    if op_type == DELETE:
+        return DeleteOne(filter_dict), len(bson.encode(filter_dict))
+
+    size = len(bson.encode(filter_dict)) + len(bson.encode(data))
+    if op_type in (UPDATE, UPSERT):
+        upsert = op_type == UPSERT or bool(operation.get("upsert"))
+        return (
+            UpdateOne(filter_dict, {update_content_type: data}, upsert=upsert),
+            size,
+        )
+    if op_type == REPLACE:
+        upsert = bool(operation.get("upsert"))
+        return ReplaceOne(filter_dict, data, upsert=upsert), size
+    raise ValueError("Unsupported bulk operation: %s" % op_type)
+
+
+def chunk_operations(
+    operations,
+    max_batch_operations=MAX_BATCH_OPERATIONS,
+    max_batch_bytes=MAX_BATCH_BYTES,
+    update_content_type="$set",
+):
+    """
+    Split operations into batches bounded by operation count and BSON size
+    :return: generator of (offset of first operation, list of write models)
+    """
+    batch, batch_bytes, offset = [], 0, 0
+    for index, operation in enumerate(operations):
+        model, size = build_write_model(operation, update_content_type)
+        if batch and (
+            len(batch) >= max_batch_operations or batch_bytes + size > max_batch_bytes
+        ):
+            yield offset, batch
+            batch, batch_bytes, offset = [], 0, index
+        batch.append(model)
+        batch_bytes += size
+    if batch:
+        yield offset, batch
+
+
+def new_bulk_result(operations):
+    """
+    Empty aggregated result, one ``results`` entry per requested operation
+    """
+    return {
+        "inserted_count": 0,
+        "matched_count": 0,
+        "modified_count": 0,
+        "deleted_count": 0,
+        "upserted_count": 0,
+        "results": [
+            {"index": index, "op": operation.get("op"), "ok": True}
+            for index, operation in enumerate(operations)
+        ],
+        "errors": [],
+    }
+
+
+def merge_bulk_api_result(result, operations, offset, batch_size, api_result):
+    """
+    Merge a batch ``bulk_api_result`` (or ``BulkWriteError.details``) into the
+    aggregated result, mapping batch indexes back to operation indexes
+    """
+    result["inserted_count"] += api_result.get("nInserted", 0)
+    result["matched_count"] += api_result.get("nMatched", 0)
+    result["modified_count"] += api_result.get("nModified", 0)
+    result["deleted_count"] += api_result.get("nRemoved", 0)
+    result["upserted_count"] += api_result.get("nUpserted", 0)
+
+    for upserted in api_result.get("upserted", []):
+        result["results"][offset + upserted["index"]]["upserted_id"] = upserted["_id"]
+    for index in range(offset, offset + batch_size):
+        operation = operations[index]
+        if operation.get("op") == INSERT:
+            # pymongo sets _id on the inserted document before sending it
+            result["results"][index]["inserted_id"] = operation["data"].get("_id")
+    for write_error in api_result.get("writeErrors", []):
+        mark_failed(
+            result,
+            offset + write_error["index"],
+            write_error.get("errmsg"),
+            write_error.get("code"),
+        )
+
+
+def mark_failed(result, index, message, code=None):
+    """
+    Record an error against a single operation
+    """
+    item = result["results"][index]
+    item["ok"] = False
+    item["error"] = str(message)
+    item.pop("inserted_id", None)
+    result["errors"].append({"index": index, "error": str(message), "code": code})
+
+
+def mark_skipped(result, start):
+    """
+    Record the operations from start on as never sent, after an ordered
+    bulk write stopped at a failure
+    """
+    for item in result["results"][start:]:
+        if item["ok"]:
+            item["ok"] = False
+            item["skipped"] = True
+            item.pop("inserted_id", None)
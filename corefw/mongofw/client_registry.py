@@ -0,0 +1,106 @@
+import logging
+import os
+import threading
+
+import pymongo
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CLIENT_OPTIONS = {"serverSelectionTimeoutMS": 2000}
+
+# app config key -> pymongo.MongoClient keyword
+CONFIG_CLIENT_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": "maxPoolSize",
+    "MONGO_MIN_POOL_SIZE": "minPoolSize",
+    "MONGO_MAX_IDLE_TIME_MS": "maxIdleTimeMS",
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": "waitQueueTimeoutMS",
+    "MONGO_CONNECT_TIMEOUT_MS": "connectTimeoutMS",
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": "serverSelectionTimeoutMS",
+}
+
+
+def get_client_options(config):
+    """
+    Build pymongo client options from app config
+    :param config: flask app config (or any mapping)
+    :return: dict of pymongo.MongoClient keyword arguments
+    """
+    options = {}
+    for config_key, option_name in CONFIG_CLIENT_OPTIONS.items():
+        value = config.get(config_key)
+        if value is not None:
+            options[option_name] = value
+    return options
+
+
+class ClientRegistry(object):
+    """
+    Process wide registry of pooled pymongo clients keyed by url and options.
+
+    pymongo clients are thread safe and hold their own connection pool, so one
+    client per (url, options) is shared by every DataAccessObject in a worker.
+    Clients are not fork safe: the registry is emptied in the child after a
+    prefork (uWSGI / waitress) so each worker builds its own pool.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    @staticmethod
+    def make_key(mongo_url, options):
+        """
+        Hashable registry key for url and client options
+        """
+        options_key = tuple(sorted((key, repr(val)) for key, val in options.items()))
+        return mongo_url, options_key
+
+    def get_client(self, mongo_url, **options):
+        """Get the pooled client for mongo_url, creating it on first use
+
+        :param mongo_url: mongo connection string
+        :param options: pymongo.MongoClient keyword arguments
+        :return: pymongo.MongoClient
+        """
+        if self._pid != os.getpid():
+            self.reset()
+        key = self.make_key(mongo_url, options)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client_options = dict(DEFAULT_CLIENT_OPTIONS)
+                client_options.update(options)
+                client = pymongo.MongoClient(mongo_url, **client_options)
+                self._clients[key] = client
+                LOGGER.info("Created mongo client pool, pid %s", self._pid)
+        return client
+
+    def reset(self):
+        """
+        Forget every client without closing it. Used in a forked child, where
+        the sockets still belong to the parent process. The lock is replaced
+        rather than acquired as it may have been held by a thread at fork time.
+        """
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._pid = os.getpid()
+
+    def close_all(self):
+        """
+        Close every pooled client, e.g. at worker shutdown
+        """
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients = {}
+        for client in clients:
+            client.close()
+
+
+client_registry = ClientRegistry()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=client_registry.reset)
@@ -1,13 +1,35 @@
 from flask import current_app
-from pymongo.errors import DuplicateKeyError
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 from corefw import get_settings
 from corefw.exceptionsfw.exceptions import DataBaseException
+from corefw.helpersfw.cache import TTLCache
 from corefw.loggerfw.logger import get_logger
+from corefw.metricsfw.metrics import DAO_ERRORS, DAO_LATENCY, timed
+from corefw.mongofw.bulk import (
+    MAX_BATCH_BYTES,
+    MAX_BATCH_OPERATIONS,
+    chunk_operations,
+    mark_failed,
+    mark_skipped,
+    merge_bulk_api_result,
+    new_bulk_result,
+)
+from corefw.mongofw.client_registry import get_client_options
+from corefw.mongofw.mirror import get_mirror
 from corefw.mongofw.mongo_client import MongoClient
+from corefw.mongofw.pagination import DEFAULT_PAGE_LIMIT, InvalidPageToken
+from corefw.mongofw.read_routing import get_read_routing
+from corefw.storagefw.backends import get_backend
 
 LOGGER = get_logger(__name__)
 
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_ESTIMATED_COUNT_TTL = 5
+
+# (mongo url, db, collection) -> estimated_document_count, shared per worker
+ESTIMATED_COUNTS = TTLCache(maxsize=256, ttl=DEFAULT_ESTIMATED_COUNT_TTL)
+
 
 class DataAccessObject:
     """
@@ -18,11 +40,27 @@ class DataAccessObject:
         mongo_url = mongo_url if mongo_url else self.get_mongo_url()
         db_name = db_name if db_name else self.get_db_name()
         self.db_name = db_name
-        self.mongo_conn = MongoClient(mongo_url=mongo_url, db_name=db_name)
+        self.backend = get_backend(current_app.config)
+        self.mongo_conn = MongoClient(
+            mongo_url=mongo_url,
+            db_name=db_name,
+            backend=self.backend,
+            **get_client_options(current_app.config),
+        )
         self.collection_name = collection_name
         if not collection_name:
             self.collection_name = get_settings(current_app, "APIKEY_COLLECTION")
+        self.read_routing = get_read_routing(current_app)
 
+    def get_read_options(self, collection_name, read_preference=None, session=None):
+        """
+        Read preference and read concern of a read, see ReadRouting.resolve
+        :return: dict of MongoClient read keyword arguments
+        """
+        read_preference, read_concern = self.read_routing.resolve(
+            collection_name, read_preference=read_preference, session=session
+        )
+        return {"read_preference": read_preference, "read_concern": read_concern}
 
     def get_db_name(self):
         """
@@ -30,7 +68,7 @@ class DataAccessObject:
         :return:
         """
         db_name = "veefin_gateway"
-        if current_app.config["DB_NAME"]:
+        if current_app.config.get("DB_NAME"):
             db_name = current_app.config["DB_NAME"]
         return db_name
 
@@ -40,7 +78,7 @@ class DataAccessObject:
         :return:
         """
         mongo_url = "localhost:27017"
-        if current_app.config["MONGO_URL"]:
+        if current_app.config.get("MONGO_URL"):
             mongo_url = current_app.config["MONGO_URL"]
         return mongo_url
 
@@ -52,69 +90,232 @@ class DataAccessObject:
             return True
         return False
 
-    def count(self, filter_dict, collection_name=None):
+    @timed(DAO_LATENCY, DAO_ERRORS)
+    def count(
+        self, filter_dict, collection_name=None, read_preference=None, session=None
+    ):
         """
-        Get count
+        Get exact count of documents matching filter_dict
         """
         collection_name = collection_name if collection_name else self.collection_name
         try:
             count = self.mongo_conn.count(
-                collection_name=collection_name, query_filter=filter_dict
+                collection_name=collection_name,
+                query_filter=filter_dict,
+                session=session,
+                **self.get_read_options(collection_name, read_preference, session),
             )
             return count
         except BaseException as ex:  # NOSONAR
             LOGGER.error(ex)
             raise DataBaseException(message=ex)
 
-    def get_resource(self, filter_dict, collection_name=None, project_fields=None):
+    @timed(DAO_LATENCY, DAO_ERRORS)
+    def estimated_count(self, collection_name=None, ttl=None):
+        """
+        Get approximate collection size from metadata, cached for a few seconds
+        (MONGO_ESTIMATED_COUNT_TTL) since it is meant for totals in list views
+        :param collection_name:
+        :param ttl: cache seconds, 0 to bypass the cache
+        """
+        collection_name = collection_name if collection_name else self.collection_name
+        if ttl is None:
+            ttl = current_app.config.get(
+                "MONGO_ESTIMATED_COUNT_TTL", DEFAULT_ESTIMATED_COUNT_TTL
+            )
+        key = (self.mongo_conn.mongo_url, self.db_name, collection_name)
+        if ttl:
+            count = ESTIMATED_COUNTS.get(key)
+            if count is not None:
+                return count
+        try:
+            count = self.mongo_conn.estimated_count(
+                collection_name=collection_name,
+                **self.get_read_options(collection_name),
+            )
+        except BaseException as ex:  # NOSONAR
+            LOGGER.error(ex)
+            raise DataBaseException(message=ex)
+        if ttl:
+            ESTIMATED_COUNTS.set(key, count, ttl=ttl)
+        return count
+
+    @timed(DAO_LATENCY, DAO_ERRORS)
+    def find_with_total(self, filter_dict, sort_by, collection_name=None, **kwargs):
+        """
+        Get one page and the total number of matches in a single aggregation
+        :key project_fields, collation, direction, offset, limit,
+        read_preference, session
+        :return: (records, total)
+        """
+        collection_name = collection_name if collection_name else self.collection_name
+        try:
+            session = kwargs.get("session")
+            return self.mongo_conn.find_with_total(
+                collection_name=collection_name,
+                sort_by=sort_by,
+                filter=filter_dict,
+                project_fields=kwargs.get("project_fields", {"_id": 0}),
+                skip=kwargs.get("offset", 0),
+                limit=kwargs.get("limit") or DEFAULT_PAGE_LIMIT,
+                direction=kwargs.get("direction", 1),
+                collation=kwargs.get("collation", {"locale": "en"}),
+                session=session,
+                **self.get_read_options(
+                    collection_name, kwargs.get("read_preference"), session
+                ),
+            )
+        except BaseException as ex:  # NOSONAR
+            LOGGER.error(ex)
+            raise DataBaseException(message=str(ex))
+
+    @timed(DAO_LATENCY, DAO_ERRORS)
+    def get_resource(
+        self,
+        filter_dict,
+        collection_name=None,
+        project_fields=None,
+        read_preference=None,
+        session=None,
+        raw=False,
+    ):
         """
         Get Resource using filter
+        :param read_preference: per call read preference, e.g. "nearest"
+        :param session: reads in a session always go to the primary
+        :param raw: return a bson.raw_bson.RawBSONDocument for responses that
+        pass the stored document through, see response_helpers.raw_json_response
+        Served from the in-memory mirror when the collection is mirrored
+        (see MONGO_MIRROR_COLLECTIONS) and the filter is a plain equality one.
         """
+        collection_name = collection_name if collection_name else self.collection_name
         try:
             if not project_fields:
                 project_fields = {"_id": 0}
+            mirror = None
+            if session is None and not raw:
+                mirror = get_mirror(self.db_name, collection_name)
+            if mirror is not None:
+                served, record = mirror.find_one(filter_dict, project_fields)
+                if served:
+                    return record
             record = self.mongo_conn.find_one(
                 filter=filter_dict,
-                collection_name=collection_name
-                if collection_name
-                else self.collection_name,
+                collection_name=collection_name,
                 project_fields=project_fields,
+                session=session,
+                raw=raw,
+                **self.get_read_options(collection_name, read_preference, session),
             )
             return record
         except BaseException as ex:  # NOSONAR
             LOGGER.error(ex)
             raise DataBaseException(message=ex)
 
+    @timed(DAO_LATENCY, DAO_ERRORS)
     def find_all_with_collation(
         self, filter_dict, sort_by, collection_name=None, **kwargs
     ):
         """
         Get list here
+        :key see iter_all, raw=True returns RawBSONDocument rows
         """
+        kwargs.setdefault("collation", {"locale": "en"})
+        kwargs.setdefault("limit", DEFAULT_PAGE_LIMIT)
+        return list(
+            self.iter_all(
+                filter_dict, sort_by=sort_by, collection_name=collection_name, **kwargs
+            )
+        )
 
+    def iter_all(
+        self,
+        filter_dict,
+        sort_by=None,
+        collection_name=None,
+        batch_size=DEFAULT_BATCH_SIZE,
+        **kwargs
+    ):
+        """
+        Stream documents one by one, fetching batch_size rows per round trip.
+        Only one batch is held in memory at a time.
+        :param filter_dict:
+        :param sort_by: optional sort field, sorted with collation when given
+        :param collection_name:
+        :param batch_size: documents per getMore
+        :key project_fields, collation, direction, offset, limit,
+        read_preference, session, raw (RawBSONDocument rows)
+        :return: generator of documents
+        """
+        collection_name = collection_name if collection_name else self.collection_name
+        try:
+            session = kwargs.get("session")
+            collection = self.mongo_conn.get_collection(
+                collection_name,
+                raw=kwargs.get("raw", False),
+                **self.get_read_options(
+                    collection_name, kwargs.get("read_preference"), session
+                ),
+            )
+            cursor = collection.find(
+                filter_dict,
+                kwargs.get("project_fields", {"_id": 0}),
+                batch_size=batch_size,
+                session=session,
+            )
+            if sort_by:
+                cursor = cursor.collation(
+                    kwargs.get("collation", {"locale": "en"})
+                ).sort([(sort_by, kwargs.get("direction", 1))])
+            if kwargs.get("offset"):
+                cursor = cursor.skip(kwargs.get("offset"))
+            if kwargs.get("limit"):
+                cursor = cursor.limit(kwargs.get("limit"))
+            with cursor:
+                for row in cursor:
+                    yield row
+        except GeneratorExit:
+            # consumer stopped early, the cursor is closed by the with block
+            raise
+        except BaseException as ex:  # NOSONAR
+            LOGGER.error(ex)
+            raise DataBaseException(message=str(ex))
+
+    @timed(DAO_LATENCY, DAO_ERRORS)
+    def find_page_with_collation(
+        self, filter_dict, sort_by, page_token=None, collection_name=None, **kwargs
+    ):
+        """
+        Get one page using keyset pagination, see MongoClient.find_page
+        :return: (records, next page token or None)
+        """
         try:
-            records = []
             collection_name = (
                 collection_name if collection_name else self.collection_name
             )
-            mongo_conn = self.mongo_conn.get_connection()
-            cursor = (
-                mongo_conn[self.db_name][collection_name]
-                .find(filter_dict, kwargs.get("project_fields", {"_id": 0}))
-                .collation(kwargs.get("collation", {"locale": "en"}))
-                .sort([(sort_by, kwargs.get("direction", 1))])
-                .skip(kwargs.get("offset", 0))
-                .limit(kwargs.get("limit", 500))
+            session = kwargs.get("session")
+            return self.mongo_conn.find_page(
+                collection_name=collection_name,
+                sort_by=sort_by,
+                filter=filter_dict,
+                project_fields=kwargs.get("project_fields", {"_id": 0}),
+                page_token=page_token,
+                limit=kwargs.get("limit") or DEFAULT_PAGE_LIMIT,
+                direction=kwargs.get("direction", 1),
+                collation=kwargs.get("collation", {"locale": "en"}),
+                session=session,
+                **self.get_read_options(
+                    collection_name, kwargs.get("read_preference"), session
+                ),
             )
-
-            for row in cursor:
-                records.append(row)
-            return records
+        except InvalidPageToken:
+            raise
         except BaseException as ex:  # NOSONAR
             LOGGER.error(ex)
             raise DataBaseException(message=str(ex))
 
     # @log
+    @timed(DAO_LATENCY, DAO_ERRORS)
     def create(self, data, db_name=None):
         """
         Create a new resource
@@ -135,6 +336,7 @@ class DataAccessObject:
             LOGGER.error(error_string)
             raise DataBaseException(message=error_string)
 
+    @timed(DAO_LATENCY, DAO_ERRORS)
     def update(
         self, data, filter_dict: dict, update_content_type="$set", collection_name=None
     ):
@@ -158,6 +360,104 @@ class DataAccessObject:
             LOGGER.error(error_string)
             raise DataBaseException(message=error_string)
 
+    @timed(DAO_LATENCY, DAO_ERRORS)
+    def update_existing(
+        self,
+        data,
+        filter_dict: dict,
+        update_content_type="$set",
+        collection_name=None,
+        session=None,
+    ):
+        """
+        Update a resource in one round trip, instead of get_resource + update
+        @param data:
+        @param filter_dict:
+        @param update_content_type
+        @return: False when no resource matches filter_dict
+        """
+        collection_name = collection_name if collection_name else self.collection_name
+        try:
+            result = self.mongo_conn.update_one(
+                collection_name=collection_name,
+                filter=filter_dict,
+                update_content={update_content_type: data},
+                session=session,
+            )
+            return result.matched_count > 0
+        except DuplicateKeyError as ex:
+            LOGGER.error(ex)
+            raise DataBaseException(message="Duplicate key")
+        except BaseException as error_string:  # NOSONAR
+            LOGGER.error(error_string)
+            raise DataBaseException(message=error_string)
+
+    @timed(DAO_LATENCY, DAO_ERRORS)
+    def bulk_write(
+        self,
+        operations,
+        collection_name=None,
+        update_content_type="$set",
+        max_batch_operations=MAX_BATCH_OPERATIONS,
+        max_batch_bytes=MAX_BATCH_BYTES,
+        ordered=False,
+        session=None,
+    ):
+        """
+        Apply insert/update/upsert/replace/delete operations with bulk writes,
+        split into batches by operation count and BSON size
+        @param operations: list of {"op": ..., "filter": {...}, "data": {...}}
+        @param collection_name:
+        @param update_content_type: update operator for update/upsert
+        @param max_batch_operations: operations per bulk_write command
+        @param max_batch_bytes: approximate BSON bytes per bulk_write command
+        @param ordered: stop at the first failed operation, unordered by default;
+        the operations after it are reported ``"skipped": True``
+        @param session: session or transaction of a UnitOfWork
+        @return: dict with counts, per operation ``results`` and ``errors``
+        """
+        collection_name = collection_name if collection_name else self.collection_name
+        operations = list(operations)
+        result = new_bulk_result(operations)
+        try:
+            batches = chunk_operations(
+                operations,
+                max_batch_operations=max_batch_operations,
+                max_batch_bytes=max_batch_bytes,
+                update_content_type=update_content_type,
+            )
+            for offset, batch in batches:
+                try:
+                    write_result = self.mongo_conn.bulk_write(
+                        collection_name=collection_name,
+                        requests=batch,
+                        ordered=ordered,
+                        session=session,
+                    )
+                    api_result = write_result.bulk_api_result
+                except BulkWriteError as bulk_error:
+                    LOGGER.error(bulk_error)
+                    api_result = bulk_error.details
+                except BaseException as batch_error:  # NOSONAR
+                    # the whole batch failed, later batches are still attempted
+                    LOGGER.error(batch_error)
+                    for index in range(offset, offset + len(batch)):
+                        mark_failed(result, index, batch_error)
+                    if ordered:
+                        break
+                    continue
+                merge_bulk_api_result(
+                    result, operations, offset, len(batch), api_result
+                )
+                if ordered and result["errors"]:
+                    break
+            if ordered and result["errors"]:
+                mark_skipped(result, result["errors"][0]["index"] + 1)
+            return result
+        except BaseException as error_string:  # NOSONAR
+            LOGGER.error(error_string)
+            raise DataBaseException(message=error_string)
+
     def create_indexes(self, indexes, collection_name=None):
         """
         Creating Index on indexes fields individually as uniqueness True
@@ -176,6 +476,40 @@ class DataAccessObject:
                 LOGGER.error(base_exception)
                 raise DataBaseException(message=base_exception)
 
+    def create_index(self, keys, indexname, collection_name=None, **options):
+        """
+        Create a single, possibly compound, index
+        :param keys: list of (field, direction) pairs
+        :param indexname:
+        :param collection_name:
+        :param options: is_unique, sparse, expireAfterSeconds, collation
+        :return: index name
+        """
+        collection_name = collection_name if collection_name else self.collection_name
+        try:
+            return self.mongo_conn.create_index(
+                collection_name=collection_name,
+                keys=keys,
+                indexname=indexname,
+                uniqueness=options.pop("is_unique", False),
+                **options,
+            )
+        except BaseException as base_exception:  # NOSONAR
+            LOGGER.error(base_exception)
+            raise DataBaseException(message=base_exception)
+
+    def get_index_information(self, collection_name=None):
+        """
+        Get existing indexes of the collection
+        :return: dict of index name to index details
+        """
+        collection_name = collection_name if collection_name else self.collection_name
+        try:
+            return self.mongo_conn.index_information(collection_name=collection_name)
+        except BaseException as base_exception:  # NOSONAR
+            LOGGER.error(base_exception)
+            raise DataBaseException(message=base_exception)
+
     def create_indexes_raw(self, indexes, unique=False, collection_name=None):
         """
         Creating Index on indexes fields individually as uniqueness True
@@ -191,6 +525,7 @@ class DataAccessObject:
             LOGGER.error(base_exception)
             raise DataBaseException(message=base_exception)
 
+    @timed(DAO_LATENCY, DAO_ERRORS)
     def delete(self, filter_dict: dict, collection_name=None):
         """
         Delete a resource
@@ -206,3 +541,21 @@ class DataAccessObject:
         except BaseException as exception:  # NOSONAR
             LOGGER.error(exception)
             raise DataBaseException(message=exception)
+
+    @timed(DAO_LATENCY, DAO_ERRORS)
+    def delete_existing(self, filter_dict: dict, collection_name=None, session=None):
+        """
+        Delete a resource in one round trip, instead of get_resource + delete
+        @param filter_dict:
+        @param collection_name:
+        @return: False when no resource matches filter_dict
+        """
+        collection_name = collection_name if collection_name else self.collection_name
+        try:
+            deleted_count = self.mongo_conn.delete_one(
+                collection_name=collection_name, filter=filter_dict, session=session
+            )
+            return deleted_count > 0
+        except BaseException as exception:  # NOSONAR
+            LOGGER.error(exception)
+            raise DataBaseException(message=exception)
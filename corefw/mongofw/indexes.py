@@ -0,0 +1,210 @@
+from flask import current_app
+
+from corefw import get_settings
+from corefw.constants.constants import (
+    API_KEY,
+    ASSOCIATED_GROUPS,
+    EXPIRES_AT,
+    INTEGRATION_ID,
+    NAME,
+    PROVIDER_CODE,
+)
+from corefw.exceptionsfw.exceptions import DataBaseException
+from corefw.loggerfw.logger import get_logger
+from corefw.mongofw.data_access import DataAccessObject
+
+LOGGER = get_logger(__name__)
+
+
+def index_spec(
+    indexname,
+    keys,
+    is_unique=False,
+    sparse=True,
+    expire_after_seconds=None,
+    collation=None,
+):
+    """
+    Declarative index definition
+    :param indexname: name of the index
+    :param keys: field name or list of (field, direction) pairs for compound keys
+    :param is_unique: True/False
+    :param sparse: True/False
+    :param expire_after_seconds: TTL in seconds, None for a regular index
+    :param collation: e.g. {"locale": "en"}
+    :return: dict
+    """
+    if isinstance(keys, str):
+        keys = [(keys, 1)]
+    return {
+        "indexname": indexname,
+        "keys": list(keys),
+        "is_unique": is_unique,
+        "sparse": sparse,
+        "expire_after_seconds": expire_after_seconds,
+        "collation": collation,
+    }
+
+
+# get_settings collection key -> index specs. Collection names are resolved
+# with get_settings at reconcile time so DB_PREFIX is honoured.
+INDEX_REGISTRY = {
+    "APIKEY_COLLECTION": [
+        index_spec("apikey_name_index", NAME, is_unique=True),
+        index_spec("apikey_api_keys_index", API_KEY, is_unique=True),
+        # group -> keys, to refresh the permissions of the keys of a group
+        index_spec("apikey_groups_index", ASSOCIATED_GROUPS),
+        # unexpired signed keys only, for the signed key revocation list
+        index_spec("apikey_expires_at_index", EXPIRES_AT),
+    ],
+    "GROUPS_COLLECTION": [
+        index_spec("group_name_index", NAME, is_unique=True),
+        # keyset pagination of the group list, see find_page_with_collation
+        index_spec(
+            "group_name_keyset_index",
+            [(NAME, 1), ("_id", 1)],
+            sparse=False,
+            collation={"locale": "en"},
+        ),
+    ],
+    "INTEGRATION_COLLECTION": [
+        index_spec("integration_id_index", INTEGRATION_ID, is_unique=True),
+        index_spec("integration_provider_index", PROVIDER_CODE, is_unique=True),
+    ],
+    "SANDBOX_INTEGRATION_COLLECTION": [
+        index_spec("integration_id_index", INTEGRATION_ID, is_unique=True),
+        index_spec("integration_provider_index", PROVIDER_CODE, is_unique=False),
+    ],
+}
+
+
+def register_index(settings_key, spec):
+    """
+    Add an index to the registry, replacing any spec with the same name
+    :param settings_key: get_settings key of the collection, or a collection name
+    :param spec: dict built with index_spec
+    """
+    specs = INDEX_REGISTRY.setdefault(settings_key, [])
+    specs[:] = [row for row in specs if row["indexname"] != spec["indexname"]]
+    specs.append(spec)
+
+
+def resolve_collection_name(settings_key):
+    """
+    Collection name for a registry key
+    """
+    try:
+        return get_settings(current_app, settings_key)
+    except KeyError:
+        return settings_key
+
+
+def index_drift(spec, actual):
+    """
+    Differences between a registered spec and index_information() details
+    :return: dict of option -> (expected, actual), empty when in sync
+    """
+    expected = {
+        "keys": [tuple(key) for key in spec["keys"]],
+        "unique": bool(spec["is_unique"]),
+        "sparse": bool(spec["sparse"]),
+        "expireAfterSeconds": spec["expire_after_seconds"],
+        "locale": (spec["collation"] or {}).get("locale"),
+    }
+    current = {
+        "keys": [(key, int(direction)) for key, direction in actual.get("key", [])],
+        "unique": bool(actual.get("unique", False)),
+        "sparse": bool(actual.get("sparse", False)),
+        "expireAfterSeconds": actual.get("expireAfterSeconds"),
+        "locale": (actual.get("collation") or {}).get("locale"),
+    }
+    return {
+        option: (value, current[option])
+        for option, value in expected.items()
+        if current[option] != value
+    }
+
+
+def create_options(spec):
+    """
+    pymongo create_index options for a spec
+    """
+    options = {"is_unique": spec["is_unique"], "sparse": spec["sparse"]}
+    if spec["expire_after_seconds"] is not None:
+        options["expireAfterSeconds"] = spec["expire_after_seconds"]
+    if spec["collation"]:
+        options["collation"] = spec["collation"]
+    return options
+
+
+def reconcile_collection(dao, collection_name, specs, dry_run=False):
+    """
+    Create missing indexes of one collection and report drift
+    :return: report dict
+    """
+    report = {
+        "collection": collection_name,
+        "created": [],
+        "missing": [],
+        "unchanged": [],
+        "drifted": [],
+        "unmanaged": [],
+        "errors": [],
+    }
+    try:
+        existing = dao.get_index_information(collection_name=collection_name)
+    except DataBaseException as db_ex:
+        report["errors"].append({"indexname": None, "error": str(db_ex)})
+        return report
+
+    for spec in specs:
+        indexname = spec["indexname"]
+        if indexname in existing:
+            drift = index_drift(spec, existing[indexname])
+            if drift:
+                report["drifted"].append({"indexname": indexname, "drift": drift})
+            else:
+                report["unchanged"].append(indexname)
+            continue
+        if dry_run:
+            report["missing"].append(indexname)
+            continue
+        try:
+            dao.create_index(
+                keys=spec["keys"],
+                indexname=indexname,
+                collection_name=collection_name,
+                **create_options(spec),
+            )
+            report["created"].append(indexname)
+        except DataBaseException as db_ex:
+            report["errors"].append({"indexname": indexname, "error": str(db_ex)})
+
+    managed = {spec["indexname"] for spec in specs}
+    report["unmanaged"] = sorted(
+        name for name in existing if name != "_id_" and name not in managed
+    )
+    return report
+
+
+def reconcile_indexes(dry_run=False, registry=None):
+    """
+    Reconcile every registered index once, e.g. at app init or from the
+    ``flask reconcile-indexes`` command. Must run inside an app context.
+    Drifted indexes are reported, never dropped.
+    :param dry_run: only report, do not create missing indexes
+    :param registry: defaults to INDEX_REGISTRY
+    :return: list of per collection reports
+    """
+    registry = registry if registry is not None else INDEX_REGISTRY
+    dao = DataAccessObject()
+    reports = []
+    for settings_key, specs in registry.items():
+        collection_name = resolve_collection_name(settings_key)
+        report = reconcile_collection(dao, collection_name, specs, dry_run=dry_run)
+        if report["drifted"] or report["errors"] or report["missing"]:
+            LOGGER.warning("Index drift on %s: %s", collection_name, report)
+        else:
+            LOGGER.info("Indexes reconciled on %s: %s", collection_name, report)
+        reports.append(report)
+    return reports
@@ -0,0 +1,230 @@
+import collections
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import current_app
+
+from corefw.exceptionsfw.exceptions import LockNotAcquiredException
+from corefw.loggerfw.logger import get_logger
+from corefw.mongofw.mongo_client import MongoClient
+
+LOGGER = get_logger(__name__)
+
+DEFAULT_LOCK_TTL = 30
+DEFAULT_RETRY_INTERVAL = 0.2
+
+
+class LockMetrics(object):
+    """
+    Per lock contention counters
+    """
+
+    FIELDS = ("acquired", "contended", "timeouts", "released", "lost", "errors")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = collections.defaultdict(
+            lambda: dict.fromkeys(self.FIELDS + ("wait_seconds",), 0)
+        )
+
+    def incr(self, lock_id, field, value=1):
+        with self.lock:
+            self.counters[lock_id][field] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {lock_id: dict(row) for lock_id, row in self.counters.items()}
+
+
+lock_metrics = LockMetrics()
+
+
+class Lease(object):
+    """
+    A held lock. Renewed in a background thread every ttl / 3 seconds until
+    released; ``lost`` is set when a renewal finds the lock taken over.
+    Pass ``token`` to downstream writes so stale holders can be fenced off.
+    """
+
+    def __init__(self, manager, lock_id, owner, token, ttl):
+        self.manager = manager
+        self.lock_id = lock_id
+        self.owner = owner
+        self.token = token
+        self.ttl = ttl
+        self.lost = threading.Event()
+        self.stopped = threading.Event()
+        self.renewer = threading.Thread(
+            target=self.renew_forever, name="lock-renew-%s" % lock_id, daemon=True
+        )
+
+    def start_renewal(self):
+        self.renewer.start()
+
+    def renew_forever(self):
+        while not self.stopped.wait(self.ttl / 3.0):
+            try:
+                renewed = self.manager.mongo_conn.touch_lock(
+                    self.lock_id, self.ttl, owner=self.owner, **self.manager.options
+                )
+            except Exception as exception:  # keep renewing on transient errors
+                LOGGER.error(exception)
+                lock_metrics.incr(self.lock_id, "errors")
+                continue
+            if not renewed:
+                LOGGER.warning("Lock %s lost by %s", self.lock_id, self.owner)
+                lock_metrics.incr(self.lock_id, "lost")
+                self.lost.set()
+                return
+
+    def release(self):
+        """
+        Stop renewing and release the lock if still held
+        :return: True when the lock was released by this call
+        """
+        self.stopped.set()
+        if self.renewer.is_alive() and self.renewer is not threading.current_thread():
+            self.renewer.join()
+        if self.lost.is_set():
+            return False
+        released = self.manager.mongo_conn.release_lock(
+            self.lock_id, owner=self.owner, **self.manager.options
+        )
+        lock_metrics.incr(self.lock_id, "released")
+        return released
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class LockManager(object):
+    """
+    Distributed locks stored in mongo.
+
+    Usage:
+        with get_lock_manager().lock("reconcile-indexes", ttl=30) as lease:
+            ...  # lease.token is the fencing token
+    """
+
+    def __init__(self, mongo_conn, db_name=None, collection_name=None):
+        self.mongo_conn = mongo_conn
+        self.options = {}
+        if db_name:
+            self.options["db_name"] = db_name
+        if collection_name:
+            self.options["collection_name"] = collection_name
+        self.indexes_ready = False
+
+    @staticmethod
+    def new_owner():
+        return "%s:%s:%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+
+    def ensure_indexes(self):
+        if not self.indexes_ready:
+            self.mongo_conn.ensure_lock_indexes(**self.options)
+            self.indexes_ready = True
+
+    def held_by_other(self, lock_id, owner):
+        """
+        True when the lock is held, unexpired, by another owner
+        """
+        held = self.mongo_conn.find_lock(lock_id, **self.options)
+        return (
+            held is not None
+            and held.get("owner") != owner
+            and held.get("expire") is not None
+            and held["expire"] >= datetime.utcnow()
+        )
+
+    def try_acquire(self, lock_id, ttl=DEFAULT_LOCK_TTL, owner=None):
+        """
+        Single acquire attempt
+        :return: Lease or None when the lock is held by someone else
+        """
+        self.ensure_indexes()
+        owner = owner or self.new_owner()
+        if self.held_by_other(lock_id, owner):
+            # don't draw a fencing token for an attempt bound to fail
+            lock_metrics.incr(lock_id, "contended")
+            return None
+        token = self.mongo_conn.next_fencing_token(lock_id, **self.options)
+        if not self.mongo_conn.acquire_lock(
+            lock_id, owner, token, expires_in=ttl, **self.options
+        ):
+            lock_metrics.incr(lock_id, "contended")
+            return None
+        lock_metrics.incr(lock_id, "acquired")
+        return Lease(self, lock_id, owner, token, ttl)
+
+    def acquire(
+        self,
+        lock_id,
+        ttl=DEFAULT_LOCK_TTL,
+        blocking=True,
+        timeout=None,
+        retry_interval=DEFAULT_RETRY_INTERVAL,
+        renew=True,
+    ):
+        """
+        Acquire a lock, waiting up to timeout seconds when blocking
+        :param lock_id: a string indentifying the lock
+        :param ttl: lease seconds, renewed automatically when renew is True
+        :param blocking: retry until acquired or timeout
+        :param timeout: None to wait forever
+        :param retry_interval: seconds between attempts
+        :param renew: renew the lease in a background thread
+        :return: Lease
+        :raises LockNotAcquiredException:
+        """
+        started = time.monotonic()
+        owner = self.new_owner()
+        while True:
+            lease = self.try_acquire(lock_id, ttl=ttl, owner=owner)
+            if lease is not None:
+                lock_metrics.incr(lock_id, "wait_seconds", time.monotonic() - started)
+                if renew:
+                    lease.start_renewal()
+                return lease
+            waited = time.monotonic() - started
+            if not blocking or (timeout is not None and waited >= timeout):
+                lock_metrics.incr(lock_id, "timeouts")
+                lock_metrics.incr(lock_id, "wait_seconds", waited)
+                raise LockNotAcquiredException(lock_id)
+            time.sleep(retry_interval)
+
+    def lock(self, lock_id, **kwargs):
+        """
+        Context manager form of acquire, see acquire for arguments
+        """
+        return self.acquire(lock_id, **kwargs)
+
+
+def get_lock_manager(app=None):
+    """
+    Lock manager of the flask app, built once from its config
+    (LOCKS_DB_NAME, LOCKS_COLLECTION_NAME)
+    """
+    app = app or current_app
+    manager = app.extensions.get("corefw_lock_manager")
+    if manager is None:
+        manager = LockManager(
+            MongoClient.from_config(app.config),
+            db_name=app.config.get("LOCKS_DB_NAME"),
+            collection_name=app.config.get("LOCKS_COLLECTION_NAME"),
+        )
+        app.extensions["corefw_lock_manager"] = manager
+    return manager
+
+
+def lock(lock_id, **kwargs):
+    """
+    ``with lock("key-rotation", ttl=60, timeout=5) as lease:``
+    """
+    return get_lock_manager().lock(lock_id, **kwargs)
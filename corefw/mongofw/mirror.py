@@ -0,0 +1,372 @@
+import datetime
+import os
+import threading
+import time
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+from corefw import get_settings
+from corefw.loggerfw.logger import get_logger
+from corefw.mongofw.mongo_client import MongoClient, find_one_projection
+from corefw.storagefw.backends import get_backend
+
+LOGGER = get_logger(__name__)
+
+DEFAULT_RESYNC_SECONDS = 300
+DEFAULT_RETRY_SECONDS = 2
+MAX_AWAIT_TIME_MS = 1000
+
+# change stream events after which the stream is closed for good
+TERMINAL_EVENTS = ("drop", "rename", "dropDatabase", "invalidate")
+SCALAR_TYPES = (str, int, float, bool, type(None), ObjectId, datetime.datetime)
+
+# find_one result when the mirror cannot answer the filter
+MISS = (False, None)
+
+
+class ResyncRequired(Exception):
+    """
+    The change stream cannot be resumed, the mirror must be reloaded
+    """
+
+
+def is_plain_filter(filter_dict):
+    """
+    True for {field: scalar, ...} filters the mirror can answer. Operators,
+    dotted paths and array / document values go to mongo.
+    """
+    if not filter_dict:
+        return False
+    for field, value in filter_dict.items():
+        if field.startswith("$") or "." in field:
+            return False
+        if not isinstance(value, SCALAR_TYPES):
+            return False
+    return True
+
+
+def apply_projection(document, project_fields):
+    """
+    Inclusion or exclusion projection of a top level document, with the _id
+    rule of MongoClient.find_one
+    """
+    project_fields = find_one_projection(project_fields)
+    included = [
+        field for field, value in project_fields.items() if value and field != "_id"
+    ]
+    if included:
+        return {field: document[field] for field in included if field in document}
+    return {
+        field: value
+        for field, value in document.items()
+        if project_fields.get(field, 1)
+    }
+
+
+class CollectionMirror(object):
+    """
+    In-memory copy of one collection kept current by a change stream.
+
+    A daemon thread opens the change stream first, then loads the collection,
+    so no write between the two is missed. Events are applied as they arrive
+    and the resume token is kept so a dropped connection resumes where it
+    stopped. When the stream cannot be resumed (history lost, drop, rename)
+    or every resync_seconds, the collection is reloaded in full.
+
+    Lookups are answered for plain equality filters only, through equality
+    indexes built on first use of a field. Anything else is a miss and the
+    caller goes to mongo. Change streams need a replica set; a local single
+    node one (``mongod --replSet rs0`` + ``rs.initiate()``) is enough.
+
+    Returned documents are shallow copies; nested values are shared with the
+    mirror and must not be mutated.
+    """
+
+    def __init__(self, mongo_conn, collection_name, resync_seconds=None):
+        self.mongo_conn = mongo_conn
+        self.collection_name = collection_name
+        self.resync_seconds = resync_seconds or DEFAULT_RESYNC_SECONDS
+        self.documents = {}
+        # field -> value -> set of _id, only for fields seen in lookups
+        self.indexes = {}
+        # fields holding arrays or documents, which equality lookups can't serve
+        self.unindexable = set()
+        self.lock = threading.RLock()
+        self.ready = threading.Event()
+        self.stopped = threading.Event()
+        self.resume_token = None
+        self.loaded_at = None
+        self.stats = {"hits": 0, "misses": 0, "events": 0, "resyncs": 0, "errors": 0}
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.run, name="mirror-%s" % self.collection_name, daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.ready.clear()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.sync_and_tail()
+            except ResyncRequired as exception:
+                LOGGER.info("Mirror %s resync: %s", self.collection_name, exception)
+                self.resume_token = None
+            except OperationFailure as exception:
+                # most often the resume token fell off the oplog
+                LOGGER.warning(
+                    "Mirror %s stream failed: %s", self.collection_name, exception
+                )
+                self.stats["errors"] += 1
+                self.resume_token = None
+                self.ready.clear()
+                self.stopped.wait(DEFAULT_RETRY_SECONDS)
+            except PyMongoError as exception:
+                LOGGER.warning(
+                    "Mirror %s disconnected: %s", self.collection_name, exception
+                )
+                self.stats["errors"] += 1
+                self.ready.clear()
+                self.stopped.wait(DEFAULT_RETRY_SECONDS)
+            except Exception as exception:  # keep the mirror thread alive
+                LOGGER.exception(exception)
+                self.stats["errors"] += 1
+                self.ready.clear()
+                self.stopped.wait(DEFAULT_RETRY_SECONDS)
+
+    def sync_and_tail(self):
+        collection = self.mongo_conn.get_collection(self.collection_name)
+        with collection.watch(
+            full_document="updateLookup",
+            resume_after=self.resume_token,
+            max_await_time_ms=MAX_AWAIT_TIME_MS,
+        ) as stream:
+            if self.resume_token is None or self.resync_due():
+                self.load(collection)
+            self.ready.set()
+            while not self.stopped.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is not None:
+                    self.apply(change)
+                self.resume_token = stream.resume_token
+                if self.resync_due():
+                    self.load(collection)
+
+    def resync_due(self):
+        return (
+            self.loaded_at is None
+            or time.monotonic() - self.loaded_at >= self.resync_seconds
+        )
+
+    def load(self, collection):
+        """
+        Replace the mirror with a full read of the collection
+        """
+        documents = {document["_id"]: document for document in collection.find({})}
+        with self.lock:
+            self.documents = documents
+            self.unindexable = set()
+            indexes = {}
+            for field in self.indexes:
+                index = self.build_index(field)
+                if index is not None:
+                    indexes[field] = index
+            self.indexes = indexes
+        self.loaded_at = time.monotonic()
+        self.stats["resyncs"] += 1
+        LOGGER.info(
+            "Mirror %s loaded %s documents", self.collection_name, len(documents)
+        )
+
+    def apply(self, change):
+        operation = change["operationType"]
+        self.stats["events"] += 1
+        if operation in TERMINAL_EVENTS:
+            raise ResyncRequired(operation)
+        if operation in ("insert", "replace", "update"):
+            document = change.get("fullDocument")
+            if document is not None:
+                self.put(document)
+                return
+        if "documentKey" in change:
+            # deleted, or updated then deleted before the lookup
+            self.remove(change["documentKey"]["_id"])
+
+    def put(self, document):
+        with self.lock:
+            self.remove(document["_id"])
+            self.documents[document["_id"]] = document
+            for field, index in list(self.indexes.items()):
+                value = document.get(field)
+                if not isinstance(value, SCALAR_TYPES):
+                    del self.indexes[field]
+                    self.unindexable.add(field)
+                    continue
+                index.setdefault(value, set()).add(document["_id"])
+
+    def remove(self, document_id):
+        with self.lock:
+            document = self.documents.pop(document_id, None)
+            if document is None:
+                return
+            for field, index in self.indexes.items():
+                ids = index.get(document.get(field))
+                if ids:
+                    ids.discard(document_id)
+                    if not ids:
+                        del index[document.get(field)]
+
+    def build_index(self, field):
+        """
+        value -> set of _id for one field, None when some document holds an
+        array or a document there. Caller holds the lock.
+        """
+        index = {}
+        for document_id, document in self.documents.items():
+            value = document.get(field)
+            if not isinstance(value, SCALAR_TYPES):
+                self.unindexable.add(field)
+                return None
+            index.setdefault(value, set()).add(document_id)
+        return index
+
+    def get_index(self, field):
+        index = self.indexes.get(field)
+        if index is None and field not in self.unindexable:
+            index = self.build_index(field)
+            if index is not None:
+                self.indexes[field] = index
+        return index
+
+    def find_one(self, filter_dict, project_fields=None):
+        """
+        :return: (served, document). served is False when the caller must
+        query mongo; document is None when nothing matches.
+        """
+        if not self.ready.is_set() or not is_plain_filter(filter_dict):
+            self.stats["misses"] += 1
+            return MISS
+        fields = list(filter_dict.items())
+        with self.lock:
+            candidates = None
+            for field, value in fields:
+                index = self.get_index(field)
+                if index is None:
+                    self.stats["misses"] += 1
+                    return MISS
+                ids = index.get(value, ())
+                if candidates is None or len(ids) < len(candidates):
+                    candidates = ids
+            for document_id in candidates:
+                document = self.documents[document_id]
+                if all(document.get(field) == value for field, value in fields):
+                    self.stats["hits"] += 1
+                    return True, apply_projection(document, project_fields)
+        self.stats["hits"] += 1
+        return True, None
+
+    def status(self):
+        return dict(
+            self.stats,
+            ready=self.ready.is_set(),
+            documents=len(self.documents),
+            indexes=sorted(self.indexes),
+            seconds_since_load=time.monotonic() - self.loaded_at
+            if self.loaded_at is not None
+            else None,
+        )
+
+
+class MirrorRegistry(object):
+    """
+    Mirrors of this worker, keyed by (db name, collection name): a data
+    access object on another database is never served from them. Mirror
+    threads don't survive a fork: a forked worker restarts its mirrors on
+    first use.
+    """
+
+    def __init__(self):
+        self.mirrors = {}
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.mongo_conn = None
+        self.resync_seconds = None
+
+    def configure(self, mongo_conn, collection_names, resync_seconds=None):
+        """
+        Start a mirror for each collection, stopping any previous ones
+        """
+        with self.lock:
+            self.stop_all()
+            self.mongo_conn = mongo_conn
+            self.resync_seconds = resync_seconds
+            self.start_all(collection_names)
+
+    def start_all(self, collection_names):
+        self.pid = os.getpid()
+        self.mirrors = {}
+        for collection_name in collection_names:
+            mirror = CollectionMirror(
+                self.mongo_conn, collection_name, self.resync_seconds
+            )
+            mirror.start()
+            self.mirrors[(self.mongo_conn.db_name, collection_name)] = mirror
+
+    def stop_all(self):
+        for mirror in self.mirrors.values():
+            mirror.stop()
+
+    def get(self, db_name, collection_name):
+        """
+        Mirror of a collection or None when not mirrored
+        """
+        if not self.mirrors:
+            return None
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.start_all([name for _, name in self.mirrors])
+        return self.mirrors.get((db_name, collection_name))
+
+    def status(self):
+        return {
+            "%s.%s" % key: mirror.status() for key, mirror in self.mirrors.items()
+        }
+
+
+mirror_registry = MirrorRegistry()
+
+
+def start_mirrors(app):
+    """
+    Start the mirrors configured in MONGO_MIRROR_COLLECTIONS, a list of
+    get_settings collection keys or plain collection names, e.g.
+        MONGO_MIRROR_COLLECTIONS = ["APIKEY_COLLECTION", "GROUPS_COLLECTION",
+                                    "INTEGRATION_COLLECTION"]
+        MONGO_MIRROR_RESYNC_SECONDS = 300
+    """
+    collection_names = []
+    for key in app.config.get("MONGO_MIRROR_COLLECTIONS") or []:
+        try:
+            collection_names.append(get_settings(app, key))
+        except KeyError:
+            collection_names.append(key)
+    if not collection_names:
+        return
+    if not get_backend(app.config).supports_change_streams:
+        LOGGER.warning("Storage backend has no change streams, mirrors disabled")
+        return
+    mirror_registry.configure(
+        MongoClient.from_config(app.config),
+        collection_names,
+        resync_seconds=app.config.get("MONGO_MIRROR_RESYNC_SECONDS"),
+    )
+
+
+def get_mirror(db_name, collection_name):
+    return mirror_registry.get(db_name, collection_name)
@@ -2,32 +2,117 @@ import logging
 from datetime import datetime, timedelta
 
 import pymongo
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 from pymongo.collection import ReturnDocument
 
+from corefw.mongofw.client_registry import get_client_options
+from corefw.mongofw.pagination import (
+    DEFAULT_PAGE_LIMIT,
+    encode_page_token,
+    get_sort_value,
+    keyset_filter,
+    keyset_sort,
+)
+from corefw.storagefw.backends import get_backend
+
 LOGGER = logging.getLogger(__name__)
 
+# documents are returned as undecoded bson, decoded lazily on field access
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+
+def find_one_projection(project_fields):
+    """
+    Projection of MongoClient.find_one: the requested fields, never _id
+    """
+    project_fields = dict(project_fields or {})
+    project_fields["_id"] = 0
+    return project_fields
+
 
 class MongoClient(object):
-    def __init__(self, mongo_url, db_name):
+    def __init__(self, mongo_url, db_name, backend=None, **client_options):
         self.mongo_connection = None
         self.tenant_info = None
         self.mongo_url = mongo_url
         self.db_name = db_name
+        self.backend = backend or get_backend()
+        self.client_options = client_options
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build a client from flask app config (MONGO_URL, DB_NAME,
+        STORAGE_BACKEND and the pool options of get_client_options) for code
+        running outside a request
+        """
+        return cls(
+            mongo_url=config.get("MONGO_URL") or "localhost:27017",
+            db_name=config.get("DB_NAME") or "veefin_gateway",
+            backend=get_backend(config),
+            **get_client_options(config),
+        )
 
     def get_connection(self):
         """Get the connection to mongo db
 
+        The client comes from the storage backend, by default the pooled
+        pymongo client shared process wide, see ``client_registry``.
+        It is looked up on every call, so long lived instances pick up the
+        new pool after a fork.
+
         :return: the client to connect to mongodb
         """
         try:
-            self.mongo_connection = pymongo.MongoClient(
-                self.mongo_url, serverSelectionTimeoutMS=2000
+            self.mongo_connection = self.backend.get_client(
+                self.mongo_url, **self.client_options
             )
             return self.mongo_connection
         except pymongo.errors.ServerSelectionTimeoutError as timeoutEx:
             print(timeoutEx)
             return False
 
+    def start_session(self, causal_consistency=True, **kwargs):
+        """Start a client session, for causally consistent reads and writes
+        or transactions. Use it as a context manager or call end_session.
+
+        :param causal_consistency: reads see the session's earlier writes
+        :return: pymongo ClientSession
+        """
+        return self.get_connection().start_session(
+            causal_consistency=causal_consistency, **kwargs
+        )
+
+    def get_collection(
+        self,
+        collection_name,
+        db_name=None,
+        read_preference=None,
+        read_concern=None,
+        raw=False,
+    ):
+        """Get a collection, optionally routed to a read preference.
+
+        :param collection_name: Collection name
+        :param db_name: Database name, defaults to the client database
+        :param read_preference: pymongo read preference for reads, None for
+        the client default (primary)
+        :param read_concern: pymongo ReadConcern, None for the server default
+        :param raw: return documents as bson.raw_bson.RawBSONDocument
+        :return: pymongo Collection
+        """
+        if not db_name:
+            db_name = self.db_name
+        collection = self.get_connection()[db_name][collection_name]
+        if read_preference is not None or read_concern is not None or raw:
+            collection = collection.with_options(
+                read_preference=read_preference,
+                read_concern=read_concern,
+                codec_options=RAW_CODEC_OPTIONS if raw else None,
+            )
+        return collection
+
     def create(self, collection_name, content, db_name=None, session=None):
         """Insert a single document.
 
@@ -48,20 +133,54 @@ class MongoClient(object):
         )
         return result.inserted_id
 
-    def create_many(self, db_name, collection_name, content, session=None):
-        """Insert a single document.
+    def create_many(
+        self,
+        db_name,
+        collection_name,
+        content,
+        session=None,
+        ordered=True,
+        write_concern=None,
+    ):
+        """Insert many documents.
         :param db_name: Database name to be inserted, if not exist, will be added automatically
         :param collection_name: Collection name to be inserted, if not exist,
         will be added automatically
         :param content: an array of the document content in json to be inserted.
         Ex: [{'x': 1}, {y:2}]
         :param session: for database transactions
-        :return: The inserted document id. Ex:'doc id'
+        :param ordered: stop at the first error when ``True``
+        :param write_concern: pymongo WriteConcern, None for the client default
+        :return: An instance of :class:`~pymongo.results.InsertManyResult`
         """
+        if not db_name:
+            db_name = self.db_name
+        mongo_conn = self.get_connection()
+        collection = mongo_conn[db_name][collection_name]
+        if write_concern is not None:
+            collection = collection.with_options(write_concern=write_concern)
+        return collection.insert_many(content, ordered=ordered, session=session)
+
+    def bulk_write(
+        self, collection_name, requests, ordered=False, db_name=None, session=None
+    ):
+        """Send a batch of write operations in one command.
 
+        :param db_name: Database name to be inserted, if not exist, will be
+        added automatically
+        :param collection_name: Collection name to be inserted, if not exist,
+        will be added automatically
+        :param requests: list of pymongo write models (InsertOne, UpdateOne,
+        ReplaceOne, DeleteOne)
+        :param ordered: stop at the first error when ``True``
+        :param session: for database transactions
+        :return: An instance of :class:`~pymongo.results.BulkWriteResult`
+        """
+        if not db_name:
+            db_name = self.db_name
         mongo_conn = self.get_connection()
-        return mongo_conn[self.get_tenant_db(db_name)][collection_name].insert_many(
-            content, session=session
+        return mongo_conn[db_name][collection_name].bulk_write(
+            requests, ordered=ordered, session=session
         )
 
     def find_one_and_update(
@@ -115,6 +234,41 @@ class MongoClient(object):
             session=session,
         )
 
+    def update_one(
+        self,
+        collection_name,
+        filter,
+        update_content,
+        upsert=False,
+        array_filters=None,
+        db_name=None,
+        session=None,
+    ):
+        """Updates a single document without reading it back
+
+        :param collection_name:Collection name to be updated
+        :param filter: json to filter the document. Ex: {'userid': '123'}
+        :param update_content: json format for update content.
+        Ex: {'$set': {'done': True}}
+        :param upsert: When ``True``, inserts a new document if no
+        document matches the query
+        :param array_filters: A list of filters specifying which
+        array elements an update should apply.
+        :param db_name: defaults to the client database
+        :param session: for database transactions
+        :return: An instance of :class:`~pymongo.results.UpdateResult`
+        """
+        if not db_name:
+            db_name = self.db_name
+        mongo_conn = self.get_connection()
+        return mongo_conn[db_name][collection_name].update_one(
+            filter,
+            update_content,
+            upsert=upsert,
+            array_filters=array_filters,
+            session=session,
+        )
+
     def update_many(
         self,
         db_name,
@@ -141,9 +295,10 @@ class MongoClient(object):
         :param session: for database transactions
         :return: An instance of :class:`~pymongo.results.UpdateResult`
         """
-
+        if not db_name:
+            db_name = self.db_name
         mongo_conn = self.get_connection()
-        return mongo_conn[self.get_tenant_db(db_name)][collection_name].update_many(
+        return mongo_conn[db_name][collection_name].update_many(
             query_filter,
             update_content,
             upsert=upsert,
@@ -151,7 +306,17 @@ class MongoClient(object):
             session=session,
         )
 
-    def find_one(self, collection_name, filter, db_name=None, project_fields=None):
+    def find_one(
+        self,
+        collection_name,
+        filter,
+        db_name=None,
+        project_fields=None,
+        read_preference=None,
+        read_concern=None,
+        session=None,
+        raw=False,
+    ):
         """Get a single document from the database.
 
         :param db_name: Database name to be inserted, if not exist, will be
@@ -161,15 +326,18 @@ class MongoClient(object):
         :param filter: json to filter the document. Ex: {'userid': '123'}
         :param project_fields: a dict of field names that should be returned in
         the result set or a dict
+        :param read_preference: pymongo read preference, see get_collection
+        :param read_concern: pymongo ReadConcern, see get_collection
+        :param session: for causally consistent reads
+        :param raw: return a RawBSONDocument, see get_collection
         :return: found document
         """
-        if not db_name:
-            db_name = self.db_name
-        if project_fields is None:
-            project_fields = {}
-        project_fields["_id"] = 0
-        mongo_conn = self.get_connection()
-        return mongo_conn[db_name][collection_name].find_one(filter, project_fields)
+        collection = self.get_collection(
+            collection_name, db_name, read_preference, read_concern, raw=raw
+        )
+        return collection.find_one(
+            filter, find_one_projection(project_fields), session=session
+        )
 
     def find_all(
         self,
@@ -177,11 +345,12 @@ class MongoClient(object):
         filter=None,
         project_fields=None,
         skip=0,
-        limit=500,
+        limit=DEFAULT_PAGE_LIMIT,
         sort_by=None,
         direction=None,
         db_name=None,
         get_mongo_doc_id=False,
+        read_preference=None,
     ):
         """Query the documents list in database.
 
@@ -197,30 +366,96 @@ class MongoClient(object):
         :param limit: the number of document to be return. Ex10, default=500
         :param sort_by: offset to start retrieve document. Ex:100 , default=0
         :param direction: Sort order. ASCENDING = 1 and DESCENDING = -1
+        :param read_preference: pymongo read preference, see get_collection
         :return: list of documents
         """
-        if not db_name:
-            db_name = self.db_name
-        mongo_conn = self.get_connection()
+        collection = self.get_collection(
+            collection_name, db_name, read_preference=read_preference
+        )
         if project_fields is None:
             project_fields = {}
         project_fields["_id"] = 0
 
         if sort_by and direction:
             return (
-                mongo_conn[db_name][collection_name]
-                .find(filter, project_fields)
+                collection.find(filter, project_fields)
                 .sort([(sort_by, direction)])
                 .skip(skip)
                 .limit(limit)
             )
 
-        return (
-            mongo_conn[db_name][collection_name]
-            .find(filter, project_fields)
-            .skip(skip)
-            .limit(limit)
+        return collection.find(filter, project_fields).skip(skip).limit(limit)
+
+    def find_page(
+        self,
+        collection_name,
+        sort_by,
+        filter=None,
+        project_fields=None,
+        page_token=None,
+        limit=DEFAULT_PAGE_LIMIT,
+        direction=1,
+        collation=None,
+        db_name=None,
+        read_preference=None,
+        read_concern=None,
+        session=None,
+    ):
+        """Query one page of documents using keyset pagination.
+
+        Pages are addressed by an opaque token holding the last (sort_by, _id)
+        pair, so every page is a range scan on a (sort_by, _id) index instead
+        of a skip over all previous rows.
+
+        :param db_name:Database name to be inserted, if not exist, will be
+        added automatically
+        :param collection_name: Collection name to be inserted, if not exist,
+        will be added automatically
+        :param sort_by: field to page on, should be present in every document
+        :param filter: json to filter the document. Ex: {'userid': '123'}
+        :param project_fields: a dict of field names that should be returned in
+        the result set. Ex: {'_id': 0,'name':1}
+        :param page_token: token returned with the previous page, None for
+        the first page
+        :param limit: the number of document to be return. default=500
+        :param direction: Sort order. ASCENDING = 1 and DESCENDING = -1
+        :param collation: collation used for both the range query and sort
+        :param read_preference: pymongo read preference, see get_collection
+        :param read_concern: pymongo ReadConcern, see get_collection
+        :param session: for causally consistent reads
+        :return: (list of documents, token of the next page or None)
+        """
+        project_fields = dict(project_fields or {})
+        hide_id = project_fields.pop("_id", 1) == 0
+        hide_sort_key = False
+        if project_fields and 1 in project_fields.values():
+            hide_sort_key = sort_by not in project_fields
+            project_fields[sort_by] = 1
+
+        collection = self.get_collection(
+            collection_name, db_name, read_preference, read_concern
         )
+        cursor = collection.find(
+            keyset_filter(filter or {}, sort_by, direction, page_token),
+            project_fields or None,
+            session=session,
+        )
+        if collation:
+            cursor = cursor.collation(collation)
+        cursor = cursor.sort(keyset_sort(sort_by, direction)).limit(limit + 1)
+
+        records = list(cursor)
+        next_token = None
+        if len(records) > limit:
+            records = records[:limit]
+            last = records[-1]
+            next_token = encode_page_token(get_sort_value(last, sort_by), last["_id"])
+        for row in records:
+            if hide_id:
+                row.pop("_id", None)
+            if hide_sort_key:
+                row.pop(sort_by, None)
+        return records, next_token
 
     def delete_one(self, collection_name, filter, db_name=None, session=None):
         """Delete a single document matching the filter.
@@ -233,7 +468,8 @@ class MongoClient(object):
         :param session: for database transactions
         :return: Number of deleted document. Ex:1
         """
-
+        if not db_name:
+            db_name = self.db_name
         mongo_conn = self.get_connection()
         result = mongo_conn[db_name][collection_name].delete_one(
             filter, session=session
@@ -332,7 +568,9 @@ class MongoClient(object):
             query_fitler, allowDiskUse=allow_disk_use
         )
 
-    def create_index(self, collection_name, keys, indexname, uniqueness, db_name=None):
+    def create_index(
+        self, collection_name, keys, indexname, uniqueness, db_name=None, **options
+    ):
         """
 
         :param db_name:Database name to be inserted, if not exist, will be
@@ -343,15 +581,30 @@ class MongoClient(object):
         eg:[('context.contexttagtype', 'text')]
         :param indexname: name of the index
         :param uniqueness: True/False
+        :param options: extra create_index options, e.g. sparse,
+        expireAfterSeconds, collation
         :return: result of inserted document
         """
         if not db_name:
             db_name = self.db_name
         mongo_conn = self.get_connection()
         return mongo_conn[db_name][collection_name].create_index(
-            keys, name=indexname, unique=uniqueness, background=True
+            keys, name=indexname, unique=uniqueness, background=True, **options
         )
 
+    def index_information(self, collection_name, db_name=None):
+        """
+        Get the indexes of a collection
+
+        :param db_name: Database name
+        :param collection_name: Collection name
+        :return: dict of index name to index details
+        """
+        if not db_name:
+            db_name = self.db_name
+        mongo_conn = self.get_connection()
+        return mongo_conn[db_name][collection_name].index_information()
+
     def create_index_raw(self, collection_name, keys, uniqueness, db_name=None):
         if not db_name:
             db_name = self.db_name
@@ -397,24 +650,99 @@ class MongoClient(object):
 
         return indexname
 
-    def count(self, collection_name, query_filter=None, db_name=None):
+    def count(
+        self,
+        collection_name,
+        query_filter=None,
+        db_name=None,
+        read_preference=None,
+        read_concern=None,
+        session=None,
+    ):
         """
-        Gets record's count
+        Gets the exact count of documents matching the filter
 
         :param db_name:Database name to be inserted, if not exist, will be
         added automatically
         :param collection_name:Collection name to be inserted, if not exist,
         will be added automatically
         :param query_filter: json to filter the document. Ex: {'userid': '123'}
-        :return: result of inserted document
+        :param read_preference: pymongo read preference, see get_collection
+        :param read_concern: pymongo ReadConcern, see get_collection
+        :param session: for causally consistent reads
+        :return: number of documents
         """
-        db_name = db_name if db_name else self.db_name
-        client = self.get_connection()
+        collection = self.get_collection(
+            collection_name, db_name, read_preference, read_concern
+        )
+        return collection.count_documents(query_filter or {}, session=session)
+
+    def estimated_count(self, collection_name, db_name=None, read_preference=None):
+        """
+        Gets the collection size from metadata, without scanning
+
+        :param db_name: Database name
+        :param collection_name: Collection name
+        :param read_preference: pymongo read preference, see get_collection
+        :return: approximate number of documents in the collection
+        """
+        collection = self.get_collection(
+            collection_name, db_name, read_preference=read_preference
+        )
+        return collection.estimated_document_count()
+
+    def find_with_total(
+        self,
+        collection_name,
+        sort_by,
+        filter=None,
+        project_fields=None,
+        skip=0,
+        limit=DEFAULT_PAGE_LIMIT,
+        direction=1,
+        collation=None,
+        db_name=None,
+        read_preference=None,
+        read_concern=None,
+        session=None,
+    ):
+        """Query one page and the total match count in one round trip.
 
-        if query_filter:
-            return client[db_name][collection_name].count(query_filter)
+        A single aggregation matches once and splits the result with $facet
+        into the requested page and a $count of all matches.
 
-        return client[db_name][collection_name].count()
+        :param db_name:Database name
+        :param collection_name: Collection name
+        :param sort_by: field to sort the page on
+        :param filter: json to filter the document. Ex: {'userid': '123'}
+        :param project_fields: a dict of field names that should be returned in
+        the result set. Ex: {'_id': 0,'name':1}
+        :param skip: offset to start retrieve document. default=0
+        :param limit: the number of document to be return. default=500
+        :param direction: Sort order. ASCENDING = 1 and DESCENDING = -1
+        :param collation: collation of the match and sort
+        :param read_preference: pymongo read preference, see get_collection
+        :param read_concern: pymongo ReadConcern, see get_collection
+        :param session: for causally consistent reads
+        :return: (list of documents, total number of matching documents)
+        """
+        page = [{"$sort": {sort_by: direction}}]
+        if skip:
+            page.append({"$skip": skip})
+        page.append({"$limit": limit})
+        if project_fields:
+            page.append({"$project": project_fields})
+        pipeline = [
+            {"$match": filter or {}},
+            {"$facet": {"data": page, "total": [{"$count": "count"}]}},
+        ]
+        options = {"collation": collation} if collation else {}
+        collection = self.get_collection(
+            collection_name, db_name, read_preference, read_concern
+        )
+        result = next(collection.aggregate(pipeline, session=session, **options), {})
+        total = result.get("total") or [{"count": 0}]
+        return result.get("data", []), total[0]["count"]
 
     def distinct(self, db_name, collection_name, field, query_filter=None):
         """
@@ -442,40 +770,141 @@ class MongoClient(object):
         mongo_conn = self.get_connection()
         return mongo_conn.drop_database(self.get_tenant_db(db_name))
 
-    def release_lock(self, lock_id, **kwargs):
+    def get_lock_collection(self, **kwargs):
         """
-        Release a lock.
+        Locks collection
 
-        :param lock_id: a string indentifying the lock
         :key db_name: name of the locks database
         :key collection_name: name of the locks collection
-        :return: True if release was successful, False otherwise
         """
+        db_name = kwargs.get("db_name", "locks")
+        collection_name = kwargs.get("collection_name", "active_locks")
+        return self.get_connection()[db_name][collection_name]
 
+    def get_fence_collection(self, **kwargs):
+        """
+        Fencing counters of the locks collection, ``<collection>_fences``.
+        Kept apart from the locks so no lock name can collide with a counter
+        and the TTL index of the locks never removes them.
+
+        :key db_name: name of the locks database
+        :key collection_name: name of the locks collection
+        """
         db_name = kwargs.get("db_name", "locks")
         collection_name = kwargs.get("collection_name", "active_locks")
-        client = self.get_connection()
-        col = client[self.get_tenant_db(db_name)][collection_name]
+        return self.get_connection()[db_name][collection_name + "_fences"]
+
+    def ensure_lock_indexes(self, **kwargs):
+        """
+        TTL index removing expired locks.
+
+        :key db_name: name of the locks database
+        :key collection_name: name of the locks collection
+        :return: index name
+        """
+        return self.get_lock_collection(**kwargs).create_index(
+            "expire", name="lock_expire_ttl_index", expireAfterSeconds=0
+        )
+
+    def next_fencing_token(self, lock_id, **kwargs):
+        """
+        Increment and return the fencing counter of a lock.
+
+        :param lock_id: a string indentifying the lock
+        :key db_name: name of the locks database
+        :key collection_name: name of the locks collection
+        :return: int, strictly increasing per lock_id
+        """
+        counter = self.get_fence_collection(**kwargs).find_one_and_update(
+            {"_id": lock_id},
+            {"$inc": {"token": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return counter["token"]
+
+    def find_lock(self, lock_id, **kwargs):
+        """
+        Current lock document, expired or not.
+
+        :param lock_id: a string indentifying the lock
+        :key db_name: name of the locks database
+        :key collection_name: name of the locks collection
+        :return: dict with owner, token and expire, None when not locked
+        """
+        return self.get_lock_collection(**kwargs).find_one({"_id": lock_id})
+
+    def acquire_lock(self, lock_id, owner, token, expires_in=4, **kwargs):
+        """
+        Acquire a lock atomically with an upsert.
+
+        The lock is taken when it does not exist, has expired or is already
+        held by owner, and only with a fencing token newer than the last
+        holder's. Otherwise the upsert collides on _id and nothing changes.
+
+        :param lock_id: a string indentifying the lock
+        :param owner: unique id of the caller
+        :param token: fencing token from next_fencing_token
+        :param expires_in: how many seconds from now to expire the lock
+        :key db_name: name of the locks database
+        :key collection_name: name of the locks collection
+        :return: True if the lock was acquired, False otherwise
+        """
+        now = datetime.utcnow()
+        try:
+            self.get_lock_collection(**kwargs).update_one(
+                {
+                    "_id": lock_id,
+                    "$or": [{"expire": {"$lt": now}}, {"owner": owner}],
+                    "token": {"$lt": token},
+                },
+                {
+                    "$set": {
+                        "owner": owner,
+                        "token": token,
+                        "acquired_at": now,
+                        "expire": now + timedelta(seconds=expires_in),
+                    }
+                },
+                upsert=True,
+            )
+            return True
+        except pymongo.errors.DuplicateKeyError:
+            return False
+
+    def release_lock(self, lock_id, owner=None, **kwargs):
+        """
+        Release a lock.
 
-        result = col.delete_one({"_id": lock_id})
+        :param lock_id: a string indentifying the lock
+        :param owner: only release the lock when held by owner
+        :key db_name: name of the locks database
+        :key collection_name: name of the locks collection
+        :return: True if release was successful, False otherwise
+        """
+        query_filter = {"_id": lock_id}
+        if owner is not None:
+            query_filter["owner"] = owner
+        result = self.get_lock_collection(**kwargs).delete_one(query_filter)
         return True if result.deleted_count == 1 else False
 
-    def touch_lock(self, lock_id, expires_in=4, **kwargs):
+    def touch_lock(self, lock_id, expires_in=4, owner=None, **kwargs):
         """
         Touch a lock by updating its expiration.
 
         :param lock_id: a string indentifying the lock
         :param expires_in: how many seconds from now to expire the lock
+        :param owner: only touch the lock when held by owner
         :key db_name: name of the locks database
         :key collection_name: name of the locks collection
         :return: True if lock update was successful, False otherwise
         """
-
-        db_name = kwargs.get("db_name", "locks")
-        collection_name = kwargs.get("collection_name", "active_locks")
-        client = self.get_connection()
-        col = client[self.get_tenant_db(db_name)][collection_name]
+        query_filter = {"_id": lock_id}
+        if owner is not None:
+            query_filter["owner"] = owner
         expire = datetime.utcnow() + timedelta(seconds=expires_in)
 
-        result = col.update_one({"_id": lock_id}, {"$set": {"expire": expire}})
+        result = self.get_lock_collection(**kwargs).update_one(
+            query_filter, {"$set": {"expire": expire}}
+        )
         return True if result.modified_count == 1 else False
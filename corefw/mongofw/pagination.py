@@ -0,0 +1,74 @@
+import base64
+
+import bson
+from bson.errors import BSONError
+
+DEFAULT_PAGE_LIMIT = 500
+
+
+class InvalidPageToken(ValueError):
+    """Raised when a continuation token cannot be decoded"""
+
+
+def encode_page_token(last_value, last_id):
+    """
+    Opaque continuation token for the last row of a page
+    :param last_value: sort key value of the last row
+    :param last_id: _id of the last row, the tie breaker
+    :return: url safe string
+    """
+    raw = bson.encode({"v": last_value, "i": last_id})
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_page_token(page_token):
+    """
+    Decode a token made by ``encode_page_token``
+    :return: (last_value, last_id)
+    """
+    try:
+        padded = page_token + "=" * (-len(page_token) % 4)
+        decoded = bson.decode(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return decoded["v"], decoded["i"]
+    except (BSONError, KeyError, TypeError, ValueError) as ex:
+        raise InvalidPageToken("Invalid page token") from ex
+
+
+def keyset_filter(filter_dict, sort_by, direction, page_token):
+    """
+    Add the range condition that starts the page after the token position.
+    Ordering is (sort_by, _id) so rows sharing a sort value are never skipped
+    or repeated; the query collation applies to the range comparison as well.
+    """
+    if not page_token:
+        return filter_dict
+    last_value, last_id = decode_page_token(page_token)
+    operator = "$gt" if direction == 1 else "$lt"
+    after = {
+        "$or": [
+            {sort_by: {operator: last_value}},
+            {sort_by: last_value, "_id": {operator: last_id}},
+        ]
+    }
+    if not filter_dict:
+        return after
+    return {"$and": [filter_dict, after]}
+
+
+def keyset_sort(sort_by, direction):
+    """
+    Sort specification matching ``keyset_filter``
+    """
+    return [(sort_by, direction), ("_id", direction)]
+
+
+def get_sort_value(document, sort_by):
+    """
+    Read a possibly dotted sort key from a document
+    """
+    value = document
+    for part in sort_by.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
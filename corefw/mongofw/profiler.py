@@ -0,0 +1,295 @@
+import collections
+import threading
+import time
+
+import bson
+from pymongo import monitoring
+
+from corefw.loggerfw.logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+DEFAULT_SLOW_QUERY_MS = 100
+DEFAULT_SLOW_QUERY_BUFFER = 200
+
+# command name -> key holding the filter of the command
+FILTER_KEYS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+}
+# write commands carrying a list of statements, each with its filter in "q"
+STATEMENT_KEYS = {"update": "updates", "delete": "deletes"}
+
+
+def filter_shape(value):
+    """
+    Filter with every literal replaced by "?" so the slow query log never
+    holds customer data. Keys and operators are kept.
+    Ex: {"api_key": "abc", "n": {"$in": [1, 2]}}
+    -> {"api_key": "?", "n": {"$in": "?"}}
+    """
+    if isinstance(value, dict):
+        return {key: filter_shape(val) for key, val in value.items()}
+    if isinstance(value, list) and value and isinstance(value[0], dict):
+        return [filter_shape(val) for val in value]
+    return "?"
+
+
+def get_collection_name(event):
+    """
+    Collection targeted by a command event, None for database commands
+    """
+    if event.command_name == "getMore":
+        return event.command.get("collection")
+    collection_name = event.command.get(event.command_name)
+    return collection_name if isinstance(collection_name, str) else None
+
+
+def get_filter(command_name, command):
+    """
+    Filter of a command, None when the command has none
+    """
+    if command_name in FILTER_KEYS:
+        return command.get(FILTER_KEYS[command_name])
+    if command_name in STATEMENT_KEYS:
+        statements = command.get(STATEMENT_KEYS[command_name]) or [{}]
+        return statements[0].get("q")
+    if command_name == "aggregate":
+        return [
+            {name: filter_shape(stage) if name == "$match" else "?"}
+            for row in command.get("pipeline", [])
+            for name, stage in row.items()
+        ]
+    return None
+
+
+def get_document_count(command_name, reply):
+    """
+    Number of documents returned or written by a command
+    """
+    cursor = reply.get("cursor")
+    if cursor:
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if command_name == "findAndModify":
+        return 1 if reply.get("value") else 0
+    return reply.get("n", 0)
+
+
+class LatencyHistogram(object):
+    """
+    Log2 bucketed latency histogram in microseconds. Bucket i holds values
+    below 2 ** i µs, which keeps percentiles within a factor of two.
+    """
+
+    BUCKETS = 32
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, micros):
+        micros = max(int(micros), 0)
+        self.counts[min(micros.bit_length(), self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += micros
+        if micros > self.max:
+            self.max = micros
+
+    def percentile(self, percent):
+        """
+        Upper bound, in µs, of the bucket holding the percentile
+        """
+        if not self.count:
+            return 0
+        threshold = self.count * percent / 100.0
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= threshold:
+                return min(2**index, self.max)
+        return self.max
+
+
+class CommandStats(object):
+    """
+    Aggregated stats of one (collection, command) pair
+    """
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.errors = 0
+        self.documents = 0
+        self.reply_bytes = 0
+
+    def to_dict(self):
+        latency = self.latency
+        total_ms = latency.total / 1000.0
+        return {
+            "count": latency.count,
+            "errors": self.errors,
+            "total_ms": total_ms,
+            "mean_ms": total_ms / latency.count if latency.count else 0,
+            "p50_ms": latency.percentile(50) / 1000.0,
+            "p95_ms": latency.percentile(95) / 1000.0,
+            "p99_ms": latency.percentile(99) / 1000.0,
+            "max_ms": latency.max / 1000.0,
+            "documents": self.documents,
+            "reply_bytes": self.reply_bytes,
+        }
+
+
+class CommandProfiler(monitoring.CommandListener):
+    """
+    pymongo command listener recording per collection/command latency,
+    document counts, reply sizes and a ring buffer of slow queries.
+    Registered process wide by ``install_profiler``.
+    """
+
+    def __init__(
+        self,
+        slow_query_ms=DEFAULT_SLOW_QUERY_MS,
+        slow_query_buffer=DEFAULT_SLOW_QUERY_BUFFER,
+        record_reply_size=True,
+    ):
+        self.slow_query_ms = slow_query_ms
+        self.record_reply_size = record_reply_size
+        self.slow_queries = collections.deque(maxlen=slow_query_buffer)
+        self.stats = {}
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def event_key(event):
+        return event.request_id, event.connection_id
+
+    def started(self, event):
+        collection_name = get_collection_name(event)
+        if collection_name is None:
+            return
+        self.in_flight[self.event_key(event)] = (
+            collection_name,
+            get_filter(event.command_name, event.command),
+        )
+
+    def succeeded(self, event):
+        started = self.in_flight.pop(self.event_key(event), None)
+        if started is None:
+            return
+        collection_name, query_filter = started
+        documents = get_document_count(event.command_name, event.reply)
+        reply_bytes = len(bson.encode(event.reply)) if self.record_reply_size else 0
+        self.record(
+            collection_name,
+            event.command_name,
+            event.duration_micros,
+            query_filter,
+            documents=documents,
+            reply_bytes=reply_bytes,
+        )
+
+    def failed(self, event):
+        started = self.in_flight.pop(self.event_key(event), None)
+        if started is None:
+            return
+        collection_name, query_filter = started
+        self.record(
+            collection_name,
+            event.command_name,
+            event.duration_micros,
+            query_filter,
+            failure=event.failure,
+        )
+
+    def record(
+        self,
+        collection_name,
+        command_name,
+        duration_micros,
+        query_filter,
+        documents=0,
+        reply_bytes=0,
+        failure=None,
+    ):
+        key = (collection_name, command_name)
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = CommandStats()
+            stats.latency.record(duration_micros)
+            stats.documents += documents
+            stats.reply_bytes += reply_bytes
+            if failure is not None:
+                stats.errors += 1
+        if duration_micros >= self.slow_query_ms * 1000:
+            self.slow_queries.append(
+                {
+                    "time": time.time(),
+                    "collection": collection_name,
+                    "command": command_name,
+                    "duration_ms": duration_micros / 1000.0,
+                    "filter": filter_shape(query_filter)
+                    if query_filter is not None
+                    else None,
+                    "documents": documents,
+                    "reply_bytes": reply_bytes,
+                    "error": str(failure.get("errmsg")) if failure else None,
+                }
+            )
+
+    def snapshot(self):
+        """
+        Current stats, slowest total time first
+        """
+        with self.lock:
+            commands = [
+                dict(collection=key[0], command=key[1], **stats.to_dict())
+                for key, stats in self.stats.items()
+            ]
+        commands.sort(key=lambda row: row["total_ms"], reverse=True)
+        return {
+            "slow_query_ms": self.slow_query_ms,
+            "commands": commands,
+            "slow_queries": list(self.slow_queries),
+        }
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.slow_queries.clear()
+
+
+command_profiler = None
+
+
+def install_profiler(config):
+    """
+    Register the command profiler once per process when MONGO_PROFILER_ENABLED
+    is set. Must run before the first mongo client is created, which
+    initialize_app guarantees.
+    :return: the profiler or None when disabled
+    """
+    global command_profiler
+    if not config.get("MONGO_PROFILER_ENABLED"):
+        return command_profiler
+    if command_profiler is None:
+        command_profiler = CommandProfiler(
+            slow_query_ms=config.get("MONGO_SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS),
+            slow_query_buffer=config.get(
+                "MONGO_SLOW_QUERY_BUFFER", DEFAULT_SLOW_QUERY_BUFFER
+            ),
+            record_reply_size=config.get("MONGO_PROFILER_REPLY_SIZE", True),
+        )
+        monitoring.register(command_profiler)
+        LOGGER.info("Mongo command profiler installed")
+    return command_profiler
+
+
+def get_profiler():
+    """
+    Installed profiler or None
+    """
+    return command_profiler
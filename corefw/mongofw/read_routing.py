@@ -0,0 +1,123 @@
+import functools
+
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import (
+    Nearest,
+    Primary,
+    PrimaryPreferred,
+    Secondary,
+    SecondaryPreferred,
+)
+
+from corefw import get_settings
+
+READ_PREFERENCE_MODES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+EXTENSION_KEY = "corefw_read_routing"
+
+
+@functools.lru_cache(maxsize=64)
+def build_read_preference(mode, max_staleness_seconds=-1):
+    """
+    pymongo read preference for a mode name
+    :param mode: primary, primaryPreferred, secondary, secondaryPreferred, nearest
+    :param max_staleness_seconds: -1 for no bound, otherwise >= 90
+    :return: pymongo read preference
+    """
+    if mode not in READ_PREFERENCE_MODES:
+        raise ValueError("Unknown read preference: %s" % mode)
+    if mode == "primary":
+        return Primary()
+    return READ_PREFERENCE_MODES[mode](max_staleness=max_staleness_seconds)
+
+
+@functools.lru_cache(maxsize=8)
+def build_read_concern(level):
+    """
+    pymongo read concern for a level name, None keeps the server default
+    """
+    return ReadConcern(level) if level else None
+
+
+def parse_route(route):
+    """
+    Route config to (read preference, read concern)
+    :param route: mode name or {"mode": ..., "max_staleness_seconds": ...,
+    "read_concern": ...}
+    """
+    if isinstance(route, str):
+        route = {"mode": route}
+    read_preference = None
+    if route.get("mode"):
+        read_preference = build_read_preference(
+            route["mode"], route.get("max_staleness_seconds", -1)
+        )
+    return read_preference, build_read_concern(route.get("read_concern"))
+
+
+class ReadRouting(object):
+    """
+    Resolves where a read goes.
+
+    Precedence: a session (read-your-writes, always primary) > the per call
+    read preference > the per collection route > the default route. Writes
+    never use these settings and always go to the primary.
+
+    Config, next to MONGO_URL:
+        MONGO_READ_PREFERENCE = "primary"
+        MONGO_READ_PREFERENCES = {
+            "APIKEY_COLLECTION": {"mode": "secondaryPreferred",
+                                  "max_staleness_seconds": 90},
+            "GROUPS_COLLECTION": "nearest",
+        }
+    Keys are get_settings collection keys or plain collection names.
+    """
+
+    def __init__(self, default_route=None, collection_routes=None):
+        self.default = parse_route(default_route or {})
+        self.collections = {
+            name: parse_route(route)
+            for name, route in (collection_routes or {}).items()
+        }
+
+    def resolve(self, collection_name, read_preference=None, session=None):
+        """
+        :param collection_name:
+        :param read_preference: per call override, mode name or pymongo object
+        :param session: client session of the caller, if any
+        :return: (read preference or None, read concern or None)
+        """
+        route_preference, read_concern = self.collections.get(
+            collection_name, self.default
+        )
+        if session is not None:
+            return Primary(), read_concern
+        if isinstance(read_preference, str):
+            read_preference = build_read_preference(read_preference)
+        return read_preference or route_preference, read_concern
+
+
+def get_read_routing(app):
+    """
+    Read routing of the flask app, built once from its config
+    """
+    routing = app.extensions.get(EXTENSION_KEY)
+    if routing is None:
+        collection_routes = {}
+        for key, route in (app.config.get("MONGO_READ_PREFERENCES") or {}).items():
+            try:
+                collection_routes[get_settings(app, key)] = route
+            except KeyError:
+                collection_routes[key] = route
+        routing = ReadRouting(
+            default_route=app.config.get("MONGO_READ_PREFERENCE"),
+            collection_routes=collection_routes,
+        )
+        app.extensions[EXTENSION_KEY] = routing
+    return routing
@@ -0,0 +1,147 @@
+import collections
+
+from flask import current_app
+
+from corefw.exceptionsfw.exceptions import DataBaseException
+from corefw.loggerfw.logger import get_logger
+from corefw.mongofw.bulk import DELETE, INSERT, REPLACE, UPDATE, UPSERT
+from corefw.mongofw.data_access import DataAccessObject
+
+LOGGER = get_logger(__name__)
+
+
+class UnitOfWork(object):
+    """
+    Queue writes across collections and apply them on commit as one ordered
+    bulk write per collection, in a transaction when MONGO_TRANSACTIONS is
+    set (the default; transactions need a replica set).
+
+    Reads made through the unit of work use its causally consistent session
+    (and transaction), so they are consistent with the writes it commits.
+    Queued writes are not visible to reads before commit.
+
+        with UnitOfWork() as uow:
+            if not uow.get_resource({"name": name}, collection_name=groups):
+                ...
+            uow.update({"name": name}, {"status": status}, collection_name=groups)
+            uow.insert(api_key, collection_name=api_keys)
+        # committed here, nothing is written when the block raises
+    """
+
+    def __init__(self, dao=None, transaction=None, update_content_type="$set"):
+        """
+        :param dao: DataAccessObject to write through, its collection is the
+        default of every call
+        :param transaction: None to follow MONGO_TRANSACTIONS
+        :param update_content_type: update operator of update/upsert
+        """
+        self.dao = dao or DataAccessObject()
+        if transaction is None:
+            transaction = current_app.config.get("MONGO_TRANSACTIONS", True)
+        self.transaction = transaction
+        self.update_content_type = update_content_type
+        self.operations = collections.OrderedDict()
+        self.results = {}
+        self.session = None
+
+    def begin(self):
+        self.session = self.dao.mongo_conn.start_session(causal_consistency=True)
+        if self.transaction:
+            self.session.start_transaction()
+        return self
+
+    def queue(self, op_type, collection_name, **operation):
+        operation["op"] = op_type
+        collection_name = collection_name or self.dao.collection_name
+        self.operations.setdefault(collection_name, []).append(operation)
+        return operation
+
+    def insert(self, data, collection_name=None):
+        """
+        Queue an insert. data gets its _id on commit.
+        """
+        return self.queue(INSERT, collection_name, data=data)
+
+    def update(self, filter_dict, data, collection_name=None, upsert=False):
+        return self.queue(
+            UPDATE, collection_name, filter=filter_dict, data=data, upsert=upsert
+        )
+
+    def upsert(self, filter_dict, data, collection_name=None):
+        return self.queue(UPSERT, collection_name, filter=filter_dict, data=data)
+
+    def replace(self, filter_dict, data, collection_name=None, upsert=False):
+        return self.queue(
+            REPLACE, collection_name, filter=filter_dict, data=data, upsert=upsert
+        )
+
+    def delete(self, filter_dict, collection_name=None):
+        return self.queue(DELETE, collection_name, filter=filter_dict)
+
+    def get_resource(self, filter_dict, collection_name=None, project_fields=None):
+        return self.dao.get_resource(
+            filter_dict,
+            collection_name=collection_name,
+            project_fields=project_fields,
+            session=self.session,
+        )
+
+    def count(self, filter_dict, collection_name=None):
+        return self.dao.count(
+            filter_dict, collection_name=collection_name, session=self.session
+        )
+
+    def commit(self):
+        """
+        Flush the queued writes and commit the transaction
+        :return: bulk_write result per collection
+        :raises DataBaseException: nothing is kept when in a transaction
+        """
+        try:
+            for collection_name, operations in self.operations.items():
+                result = self.dao.bulk_write(
+                    operations,
+                    collection_name=collection_name,
+                    update_content_type=self.update_content_type,
+                    ordered=True,
+                    session=self.session,
+                )
+                self.results[collection_name] = result
+                if result["errors"]:
+                    raise DataBaseException(message=result["errors"][0]["error"])
+            if self.transaction:
+                self.session.commit_transaction()
+        except BaseException as exception:  # NOSONAR
+            LOGGER.error(exception)
+            self.rollback()
+            if isinstance(exception, DataBaseException):
+                raise
+            raise DataBaseException(message=str(exception))
+        finally:
+            self.operations = collections.OrderedDict()
+        return self.results
+
+    def rollback(self):
+        """
+        Drop the queued writes and abort the transaction
+        """
+        self.operations = collections.OrderedDict()
+        if self.session is not None and self.session.in_transaction:
+            self.session.abort_transaction()
+
+    def close(self):
+        if self.session is not None:
+            self.session.end_session()
+            self.session = None
+
+    def __enter__(self):
+        return self.begin()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            self.close()
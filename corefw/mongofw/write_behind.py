@@ -0,0 +1,188 @@
+import atexit
+import os
+import threading
+
+from flask import current_app
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from corefw.loggerfw.logger import get_logger
+from corefw.mongofw.mongo_client import MongoClient
+
+LOGGER = get_logger(__name__)
+
+DEFAULT_FLUSH_SECONDS = 10
+DEFAULT_MAX_PENDING = 10000
+
+
+class WriteBehindBuffer(object):
+    """
+    Coalescing buffer of ``$set`` updates written in the background.
+
+    Only the latest fields per document are kept, and every flush_seconds
+    (or once max_pending documents are waiting, or at exit) the buffer is
+    written as one unordered bulk write per collection. A busy document
+    costs at most one write per interval instead of one per request.
+
+    Meant for best effort fields such as api key ``last_used``: pending
+    updates are lost if the worker is killed, and reads don't see them
+    before the flush. Updates failing with a mongo error are retried with
+    the next flush; any other error drops them, counted under ``dropped``.
+    """
+
+    def __init__(
+        self,
+        mongo_conn,
+        flush_seconds=DEFAULT_FLUSH_SECONDS,
+        max_pending=DEFAULT_MAX_PENDING,
+    ):
+        self.mongo_conn = mongo_conn
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        # (collection, document key) -> (filter, fields)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.pid = None
+        self.stats = dict.fromkeys(
+            ("queued", "coalesced", "flushes", "written", "errors", "dropped"), 0
+        )
+        atexit.register(self.stop)
+
+    def set(self, collection_name, filter_dict, fields):
+        """
+        Queue ``{"$set": fields}`` on the document matching filter_dict,
+        merged with the fields already queued for it
+        """
+        key = (collection_name, tuple(sorted(filter_dict.items())))
+        with self.lock:
+            if self.pid != os.getpid():
+                self.start()
+            queued = self.pending.get(key)
+            if queued is None:
+                self.pending[key] = (filter_dict, dict(fields))
+                self.stats["queued"] += 1
+            else:
+                queued[1].update(fields)
+                self.stats["coalesced"] += 1
+            if len(self.pending) >= self.max_pending:
+                self.wakeup.set()
+
+    def start(self):
+        """
+        Start the flusher of this process, caller holds the lock. A forked
+        worker drops the updates inherited from its parent, which flushes
+        them itself.
+        """
+        self.pid = os.getpid()
+        self.pending = {}
+        self.stopped.clear()
+        self.thread = threading.Thread(
+            target=self.run, name="write-behind", daemon=True
+        )
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.flush_seconds)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as exception:  # the flusher must outlive any batch
+                LOGGER.exception(exception)
+                self.stats["errors"] += 1
+
+    def flush(self):
+        """
+        Write every pending update
+        :return: number of documents written
+        """
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            if not pending:
+                return 0
+            updates = {}
+            for (collection_name, _), (filter_dict, fields) in pending.items():
+                updates.setdefault(collection_name, []).append((filter_dict, fields))
+            written = 0
+            for collection_name, collection_updates in updates.items():
+                try:
+                    self.mongo_conn.bulk_write(
+                        collection_name,
+                        [
+                            UpdateOne(filter_dict, {"$set": fields})
+                            for filter_dict, fields in collection_updates
+                        ],
+                        ordered=False,
+                    )
+                    written += len(collection_updates)
+                except BulkWriteError as exception:
+                    # unordered: only the reported operations failed
+                    LOGGER.error(exception.details)
+                    failed = len(exception.details.get("writeErrors", []))
+                    written += len(collection_updates) - failed
+                    self.stats["errors"] += 1
+                    self.stats["dropped"] += failed
+                except PyMongoError as exception:
+                    LOGGER.error(exception)
+                    self.stats["errors"] += 1
+                    self.requeue(collection_name, pending)
+                except Exception as exception:
+                    # not transient (e.g. bson InvalidDocument), retrying won't help
+                    LOGGER.exception(exception)
+                    self.stats["errors"] += 1
+                    self.stats["dropped"] += len(collection_updates)
+            self.stats["flushes"] += 1
+            self.stats["written"] += written
+            return written
+
+    def requeue(self, collection_name, pending):
+        """
+        Put back the updates of a failed collection, newer queued fields win
+        """
+        with self.lock:
+            for key, (filter_dict, fields) in pending.items():
+                if key[0] != collection_name:
+                    continue
+                queued = self.pending.get(key)
+                if queued is not None:
+                    fields = dict(fields, **queued[1])
+                self.pending[key] = (filter_dict, fields)
+
+    def stop(self):
+        """
+        Stop the flusher and write what is pending
+        """
+        if self.pid != os.getpid():
+            return
+        self.stopped.set()
+        self.wakeup.set()
+        self.thread.join(timeout=self.flush_seconds)
+        self.flush()
+
+    def status(self):
+        return dict(self.stats, pending=len(self.pending))
+
+
+def get_last_used_buffer(app=None):
+    """
+    Write behind buffer of api key last_used updates of the flask app,
+    None when LAST_USED_FLUSH_SECONDS is 0 (write on every request)
+    """
+    app = app or current_app
+    flush_seconds = app.config.get("LAST_USED_FLUSH_SECONDS", DEFAULT_FLUSH_SECONDS)
+    if not flush_seconds:
+        return None
+    buffer = app.extensions.get("corefw_last_used_buffer")
+    if buffer is None:
+        buffer = WriteBehindBuffer(
+            MongoClient.from_config(app.config),
+            flush_seconds=flush_seconds,
+            max_pending=app.config.get("LAST_USED_MAX_PENDING", DEFAULT_MAX_PENDING),
+        )
+        app.extensions["corefw_last_used_buffer"] = buffer
+    return buffer
@@ -0,0 +1,102 @@
+import abc
+import threading
+
+from corefw.mongofw.client_registry import client_registry
+from corefw.storagefw.memory import MemoryClient
+
+DEFAULT_BACKEND = "mongo"
+
+
+class StorageBackend(abc.ABC):
+    """
+    Where MongoClient gets its connection from. A backend hands out objects
+    implementing the pymongo client API (client[db][collection]...), so the
+    DataAccessObject and everything above it run unchanged on any backend.
+
+    Select one with STORAGE_BACKEND in the app config; register new ones
+    with ``register_backend``; a subclass without get_client cannot be
+    instantiated.
+    """
+
+    name = None
+    supports_change_streams = False
+
+    @abc.abstractmethod
+    def get_client(self, mongo_url, **options):
+        """
+        Client for mongo_url, an object with the pymongo MongoClient API
+        """
+
+    def close(self):
+        pass
+
+
+class MongoBackend(StorageBackend):
+    """
+    A mongo server through the pooled pymongo clients of client_registry
+    """
+
+    name = "mongo"
+    supports_change_streams = True
+
+    def get_client(self, mongo_url, **options):
+        return client_registry.get_client(mongo_url, **options)
+
+    def close(self):
+        client_registry.close_all()
+
+
+class MemoryBackend(StorageBackend):
+    """
+    In process storage, see corefw.storagefw.memory. One store per mongo url
+    shared by the whole worker; client options are ignored and nothing is
+    shared across forked workers.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def get_client(self, mongo_url, **options):
+        client = self.clients.get(mongo_url)
+        if client is None:
+            with self.lock:
+                client = self.clients.setdefault(mongo_url, MemoryClient())
+        return client
+
+    def close(self):
+        with self.lock:
+            self.clients = {}
+
+
+BACKEND_FACTORIES = {MongoBackend.name: MongoBackend, MemoryBackend.name: MemoryBackend}
+backends = {}
+backends_lock = threading.Lock()
+
+
+def register_backend(name, factory):
+    """
+    Make a backend selectable through STORAGE_BACKEND
+    :param name: config value
+    :param factory: callable returning a StorageBackend
+    """
+    BACKEND_FACTORIES[name] = factory
+
+
+def get_backend(config=None):
+    """
+    Backend named by STORAGE_BACKEND in config, one instance per process
+    :param config: flask app config (or any mapping), None for the default
+    """
+    name = (config or {}).get("STORAGE_BACKEND") or DEFAULT_BACKEND
+    backend = backends.get(name)
+    if backend is None:
+        if name not in BACKEND_FACTORIES:
+            raise ValueError("Unknown storage backend: %s" % name)
+        with backends_lock:
+            backend = backends.get(name)
+            if backend is None:
+                backend = backends[name] = BACKEND_FACTORIES[name]()
+    return backend
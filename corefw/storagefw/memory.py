@@ -0,0 +1,959 @@
+"""
+In-memory storage engine exposing the subset of the pymongo client API used
+by corefw.mongofw.mongo_client.MongoClient, so the DataAccessObject, lock
+manager and services run unchanged against it. Meant for benchmarks of the
+service and auth hot paths and for load tests without a mongo server.
+
+Every collection is guarded by its own lock and documents are copied on the
+way in and out, so callers can mutate results like pymongo's. Equality and
+$in filters on the first field of an index are answered from a hash index,
+everything else is a scan. TTL indexes are accepted but never expire
+documents and change streams are not available.
+"""
+import threading
+
+import bson
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+from pymongo.collection import ReturnDocument
+from pymongo.errors import (
+    BulkWriteError,
+    DuplicateKeyError,
+    OperationFailure,
+    WriteError,
+)
+from pymongo.results import (
+    BulkWriteResult,
+    DeleteResult,
+    InsertManyResult,
+    InsertOneResult,
+    UpdateResult,
+)
+
+from corefw.storagefw.query import (
+    MISSING,
+    apply_update,
+    clone,
+    first_value,
+    is_operator_dict,
+    matches,
+    path_values,
+    project,
+    sort_documents,
+    sort_key,
+    split_path,
+    unsupported,
+    upsert_seed,
+)
+
+ID_INDEX = "_id_"
+
+
+def equality_strength(collation):
+    if not collation or collation.get("locale", "simple") == "simple":
+        return 3
+    return collation.get("strength", 3)
+
+
+def same_equality(index_collation, collation):
+    """
+    True when an index built with index_collation finds every string equal
+    under collation: the same collation, or both telling case apart
+    """
+    if index_collation == collation:
+        return True
+    return equality_strength(index_collation) >= 3 and equality_strength(collation) >= 3
+
+
+def index_name(keys):
+    return "_".join("%s_%s" % (field, direction) for field, direction in keys)
+
+
+def index_keys(keys):
+    """
+    pymongo create_index key argument to a list of (field, direction)
+    """
+    if isinstance(keys, str):
+        return [(keys, 1)]
+    return [tuple(key) for key in keys]
+
+
+class MemoryIndex(object):
+    """
+    One index: a hash of first field values to document ids used to plan
+    equality lookups, plus the full keys when unique
+    """
+
+    def __init__(self, name, keys, unique=False, sparse=False, collation=None, **info):
+        self.name = name
+        self.keys = keys
+        self.paths = [split_path(field) for field, _ in keys]
+        self.unique = unique
+        self.sparse = sparse
+        self.collation = collation
+        self.info = info
+        self.lookup = {}
+        self.unique_entries = {}
+
+    def describe(self):
+        info = {"v": 2, "key": list(self.keys)}
+        if self.unique and self.name != ID_INDEX:
+            info["unique"] = True
+        if self.sparse:
+            info["sparse"] = True
+        if self.collation:
+            info["collation"] = dict(self.collation)
+        info.update(self.info)
+        return info
+
+    def same_spec(self, other):
+        return self.describe() == other.describe()
+
+    def lookup_keys(self, document):
+        """
+        Hash keys of the first indexed field, one per array element
+        """
+        keys = set()
+        for value in path_values(document, self.paths[0]):
+            keys.add(sort_key(value, self.collation))
+            if isinstance(value, list):
+                keys.update(sort_key(item, self.collation) for item in value)
+        return keys
+
+    def unique_key(self, document):
+        """
+        Full index key of a document, None when a sparse index skips it
+        """
+        values = [path_values(document, path)[0] for path in self.paths]
+        if self.sparse and all(value is MISSING for value in values):
+            return None
+        return tuple(sort_key(value, self.collation) for value in values)
+
+    def add(self, document_id, document):
+        for key in self.lookup_keys(document):
+            # dict rather than set to keep insertion order
+            self.lookup.setdefault(key, {})[document_id] = None
+        if self.unique:
+            key = self.unique_key(document)
+            if key is not None:
+                self.unique_entries[key] = document_id
+
+    def remove(self, document_id, document):
+        for key in self.lookup_keys(document):
+            ids = self.lookup.get(key)
+            if ids is not None:
+                ids.pop(document_id, None)
+                if not ids:
+                    del self.lookup[key]
+        if self.unique:
+            key = self.unique_key(document)
+            if key is not None and self.unique_entries.get(key) == document_id:
+                del self.unique_entries[key]
+
+    def conflict(self, document_id, document):
+        """
+        Id of another document holding the same unique key, if any
+        """
+        if not self.unique:
+            return None
+        key = self.unique_key(document)
+        if key is None:
+            return None
+        other = self.unique_entries.get(key)
+        return other if other is not None and other != document_id else None
+
+
+class CollectionStore(object):
+    """
+    Documents and indexes of one collection, shared by every MemoryCollection
+    view on it
+    """
+
+    def __init__(self, full_name):
+        self.full_name = full_name
+        self.documents = {}
+        self.indexes = {ID_INDEX: MemoryIndex(ID_INDEX, [("_id", 1)], unique=True)}
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def document_id(document):
+        return sort_key(document["_id"])
+
+    def duplicate_key_error(self, index, document):
+        key_value = {}
+        for field, _ in index.keys:
+            value = first_value(document, field)
+            key_value[field] = None if value is MISSING else value
+        message = (
+            "E11000 duplicate key error collection: %s index: %s dup key: %s"
+            % (self.full_name, index.name, key_value)
+        )
+        return DuplicateKeyError(
+            message,
+            11000,
+            {
+                "code": 11000,
+                "errmsg": message,
+                "keyPattern": dict(index.keys),
+                "keyValue": key_value,
+            },
+        )
+
+    def check_unique(self, document_id, document):
+        for index in self.indexes.values():
+            if index.conflict(document_id, document) is not None:
+                raise self.duplicate_key_error(index, document)
+
+    def insert(self, document):
+        document_id = self.document_id(document)
+        if document_id in self.documents:
+            raise self.duplicate_key_error(self.indexes[ID_INDEX], document)
+        self.check_unique(document_id, document)
+        self.documents[document_id] = document
+        for index in self.indexes.values():
+            index.add(document_id, document)
+
+    def replace(self, document_id, document):
+        """
+        Store a new version of a document, unique indexes checked first
+        """
+        previous = self.documents[document_id]
+        if self.document_id(document) != document_id:
+            raise WriteError(
+                "Performing an update on the path '_id' would modify the "
+                "immutable field '_id'",
+                66,
+            )
+        for index in self.indexes.values():
+            index.remove(document_id, previous)
+        try:
+            self.check_unique(document_id, document)
+        except DuplicateKeyError:
+            for index in self.indexes.values():
+                index.add(document_id, previous)
+            raise
+        self.documents[document_id] = document
+        for index in self.indexes.values():
+            index.add(document_id, document)
+
+    def delete(self, document_id):
+        document = self.documents.pop(document_id)
+        for index in self.indexes.values():
+            index.remove(document_id, document)
+
+    def restore(self, documents):
+        """
+        Put back the documents of a snapshot and rebuild the indexes, caller
+        holds the lock
+        """
+        self.documents = documents
+        for index in self.indexes.values():
+            index.lookup, index.unique_entries = {}, {}
+            for document_id, document in documents.items():
+                index.add(document_id, document)
+
+    def candidates(self, query_filter, collation):
+        """
+        Ids worth matching: the smallest hash index hit of the equality and
+        $in conditions, otherwise every document
+        """
+        best = None
+        for field, condition in (query_filter or {}).items():
+            if field.startswith("$"):
+                continue
+            if not is_operator_dict(condition):
+                wanted = [condition]
+            elif set(condition) <= {"$eq", "$in"} and len(condition) == 1:
+                wanted = (
+                    [condition["$eq"]] if "$eq" in condition else condition["$in"]
+                )
+            else:
+                continue
+            if any(isinstance(value, (dict, list)) for value in wanted):
+                continue
+            for index in self.indexes.values():
+                if index.keys[0][0] != field or not same_equality(
+                    index.collation, collation
+                ):
+                    continue
+                ids = {}
+                for value in wanted:
+                    ids.update(index.lookup.get(sort_key(value, index.collation), {}))
+                if best is None or len(ids) < len(best):
+                    best = ids
+                break
+        if best is None:
+            return list(self.documents)
+        return list(best)
+
+    def find_ids(self, query_filter, collation=None, sort=None, skip=0, limit=0):
+        """
+        Ids of matching documents in natural or sort order. Caller holds the
+        lock.
+        """
+        wanted = skip + limit if limit and not sort else 0
+        ids = []
+        for document_id in self.candidates(query_filter, collation):
+            if matches(self.documents[document_id], query_filter, collation):
+                ids.append(document_id)
+                if len(ids) == wanted:
+                    break
+        if sort:
+            ordered = sort_documents(
+                [self.documents[document_id] for document_id in ids], sort, collation
+            )
+            ids = [self.document_id(document) for document in ordered]
+        if skip:
+            ids = ids[skip:]
+        if limit:
+            ids = ids[:limit]
+        return ids
+
+
+class BulkCollector(object):
+    """
+    Receives pymongo write models through their ``_add_to_bulk`` hook, the
+    protocol pymongo's own bulk API uses
+    """
+
+    def __init__(self):
+        self.operations = []
+
+    def add_insert(self, document):
+        if not isinstance(document, RawBSONDocument) and "_id" not in document:
+            document["_id"] = ObjectId()
+        self.operations.append(("insert", document))
+
+    def add_update(self, selector, update, multi=False, upsert=False, **kwargs):
+        self.operations.append(("update", selector, update, multi, upsert, kwargs))
+
+    def add_replace(self, selector, replacement, upsert=False, **kwargs):
+        self.operations.append(("replace", selector, replacement, upsert, kwargs))
+
+    def add_delete(self, selector, limit, **kwargs):
+        self.operations.append(("delete", selector, limit, kwargs))
+
+
+class MemoryCursor(object):
+    """
+    The subset of pymongo.cursor.Cursor used by the framework. Results are
+    computed on first iteration.
+    """
+
+    def __init__(self, collection, query_filter, projection, session=None):
+        self.collection = collection
+        self.query_filter = query_filter or {}
+        self.projection = projection
+        self.session = session
+        self.sort_spec = None
+        self.skip_count = 0
+        self.limit_count = 0
+        self.collation_spec = None
+        self.results = None
+
+    def collation(self, collation):
+        self.collation_spec = collation
+        return self
+
+    def sort(self, key_or_list, direction=None):
+        if isinstance(key_or_list, str):
+            key_or_list = [(key_or_list, direction or 1)]
+        self.sort_spec = key_or_list
+        return self
+
+    def skip(self, skip):
+        self.skip_count = skip
+        return self
+
+    def limit(self, limit):
+        self.limit_count = limit
+        return self
+
+    def batch_size(self, batch_size):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.results is None:
+            self.results = iter(
+                self.collection.run_find(
+                    self.query_filter,
+                    self.projection,
+                    collation=self.collation_spec,
+                    sort=self.sort_spec,
+                    skip=self.skip_count,
+                    limit=self.limit_count,
+                )
+            )
+        return next(self.results)
+
+    next = __next__
+
+    @property
+    def alive(self):
+        return self.results is None or self.results.__length_hint__() > 0
+
+    def close(self):
+        self.results = iter(())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def aggregate_documents(documents, pipeline, collation):
+    for stage in pipeline:
+        (name, argument), = stage.items()
+        if name == "$match":
+            documents = [doc for doc in documents if matches(doc, argument, collation)]
+        elif name == "$sort":
+            documents = sort_documents(list(documents), argument, collation)
+        elif name == "$skip":
+            documents = documents[argument:]
+        elif name == "$limit":
+            documents = documents[:argument]
+        elif name == "$project":
+            documents = [project(doc, argument) for doc in documents]
+        elif name == "$unset":
+            fields = [argument] if isinstance(argument, str) else argument
+            documents = [project(doc, dict.fromkeys(fields, 0)) for doc in documents]
+        elif name == "$count":
+            documents = [{argument: len(documents)}] if documents else []
+        elif name == "$facet":
+            documents = [
+                {
+                    field: aggregate_documents(list(documents), sub_pipeline, collation)
+                    for field, sub_pipeline in argument.items()
+                }
+            ]
+        else:
+            raise unsupported(name)
+    return documents
+
+
+class MemoryCollection(object):
+    """
+    pymongo.collection.Collection look-alike over a CollectionStore
+    """
+
+    def __init__(self, database, name, store, raw=False):
+        self.database = database
+        self.name = name
+        self.full_name = store.full_name
+        self.store = store
+        self.raw = raw
+
+    def with_options(self, codec_options=None, **kwargs):
+        raw = self.raw
+        if codec_options is not None:
+            raw = codec_options.document_class is RawBSONDocument
+        return MemoryCollection(self.database, self.name, self.store, raw=raw)
+
+    def output(self, document, projection=None):
+        document = project(document, projection)
+        if self.raw:
+            return RawBSONDocument(bson.encode(document))
+        return document
+
+    def run_find(self, query_filter, projection, collation=None, **kwargs):
+        store = self.store
+        with store.lock:
+            ids = store.find_ids(query_filter, collation, **kwargs)
+            return [self.output(store.documents[doc_id], projection) for doc_id in ids]
+
+    def find(self, filter=None, projection=None, session=None, **kwargs):
+        cursor = MemoryCursor(self, filter, projection, session=session)
+        if kwargs.get("sort"):
+            cursor.sort(kwargs["sort"])
+        if kwargs.get("skip"):
+            cursor.skip(kwargs["skip"])
+        if kwargs.get("limit"):
+            cursor.limit(kwargs["limit"])
+        if kwargs.get("collation"):
+            cursor.collation(kwargs["collation"])
+        return cursor
+
+    def find_one(self, filter=None, projection=None, session=None, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        kwargs["limit"] = 1
+        for document in self.find(filter, projection, session=session, **kwargs):
+            return document
+        return None
+
+    def count_documents(self, filter, session=None, collation=None, **kwargs):
+        with self.store.lock:
+            return len(
+                self.store.find_ids(
+                    filter,
+                    collation,
+                    skip=kwargs.get("skip", 0),
+                    limit=kwargs.get("limit", 0),
+                )
+            )
+
+    def estimated_document_count(self, **kwargs):
+        return len(self.store.documents)
+
+    def distinct(self, key, filter=None, session=None, **kwargs):
+        values = []
+        seen = set()
+        parts = split_path(key)
+        for document in self.find(filter):
+            for value in path_values(document, parts):
+                for item in value if isinstance(value, list) else [value]:
+                    item_key = sort_key(item)
+                    if item is not MISSING and item_key not in seen:
+                        seen.add(item_key)
+                        values.append(item)
+        return values
+
+    def aggregate(self, pipeline, session=None, collation=None, **kwargs):
+        with self.store.lock:
+            documents = [clone(doc) for doc in self.store.documents.values()]
+        return iter(
+            self.output(document) for document in aggregate_documents(
+                documents, pipeline, collation
+            )
+        )
+
+    def enlist(self, session):
+        """
+        Snapshot the collection before the first write of a transaction
+        """
+        if session is not None and session.in_transaction:
+            session.enlist(self.store)
+
+    def insert_one(self, document, session=None, **kwargs):
+        self.enlist(session)
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        with self.store.lock:
+            self.store.insert(clone(document))
+        return InsertOneResult(document["_id"], True)
+
+    def insert_many(self, documents, ordered=True, session=None, **kwargs):
+        self.enlist(session)
+        collector = BulkCollector()
+        for document in documents:
+            collector.add_insert(document)
+        self.run_bulk(collector.operations, ordered)
+        return InsertManyResult(
+            [operation[1]["_id"] for operation in collector.operations], True
+        )
+
+    def update_document(self, document_id, update, is_insert=False):
+        """
+        Apply an update or a replacement to a stored document, caller holds
+        the lock
+        :return: True when modified
+        """
+        current = self.store.documents[document_id]
+        if is_operator_dict(update):
+            document = clone(current)
+            if not apply_update(document, update, is_insert=is_insert):
+                return False
+        else:
+            document = clone(update)
+            document.setdefault("_id", current["_id"])
+        self.store.replace(document_id, document)
+        return True
+
+    def upsert_document(self, query_filter, update):
+        """
+        Insert the document of an upsert, caller holds the lock
+        :return: _id of the new document
+        """
+        document = upsert_seed(query_filter)
+        if is_operator_dict(update):
+            apply_update(document, update, is_insert=True)
+        else:
+            replacement = clone(update)
+            if "_id" in document:
+                replacement.setdefault("_id", document["_id"])
+            document = replacement
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        self.store.insert(document)
+        return document["_id"]
+
+    def run_update(self, query_filter, update, multi=False, upsert=False, **kwargs):
+        """
+        :return: update raw result, {"n", "nModified", "upserted"}
+        """
+        if update is None or (isinstance(update, dict) and not update):
+            raise unsupported("empty update")
+        collation = kwargs.get("collation")
+        with self.store.lock:
+            ids = self.store.find_ids(query_filter, collation, limit=0 if multi else 1)
+            if not ids and upsert:
+                upserted = self.upsert_document(query_filter, update)
+                return {"n": 1, "nModified": 0, "upserted": upserted}
+            modified = 0
+            for document_id in ids:
+                if self.update_document(document_id, update):
+                    modified += 1
+            return {"n": len(ids), "nModified": modified}
+
+    def update_one(self, filter, update, upsert=False, session=None, **kwargs):
+        self.enlist(session)
+        if not is_operator_dict(update):
+            raise ValueError("update only works with $ operators")
+        raw_result = self.run_update(filter, update, False, upsert, **kwargs)
+        return UpdateResult(raw_result, True)
+
+    def update_many(self, filter, update, upsert=False, session=None, **kwargs):
+        self.enlist(session)
+        if not is_operator_dict(update):
+            raise ValueError("update only works with $ operators")
+        raw_result = self.run_update(filter, update, True, upsert, **kwargs)
+        return UpdateResult(raw_result, True)
+
+    def replace_one(self, filter, replacement, upsert=False, session=None, **kwargs):
+        self.enlist(session)
+        if is_operator_dict(replacement):
+            raise ValueError("replacement can not include $ operators")
+        return UpdateResult(
+            self.run_update(filter, replacement, False, upsert, **kwargs), True
+        )
+
+    def run_delete(self, query_filter, limit, collation=None):
+        with self.store.lock:
+            ids = self.store.find_ids(query_filter, collation, limit=limit)
+            for document_id in ids:
+                self.store.delete(document_id)
+        return len(ids)
+
+    def delete_one(self, filter, session=None, collation=None, **kwargs):
+        self.enlist(session)
+        return DeleteResult({"n": self.run_delete(filter, 1, collation)}, True)
+
+    def delete_many(self, filter, session=None, collation=None, **kwargs):
+        self.enlist(session)
+        return DeleteResult({"n": self.run_delete(filter, 0, collation)}, True)
+
+    def find_one_and_modify(
+        self, query_filter, update, projection, sort, upsert, return_document, remove
+    ):
+        store = self.store
+        with store.lock:
+            ids = store.find_ids(query_filter, sort=sort, limit=1)
+            if not ids:
+                if not upsert:
+                    return None
+                upserted = self.upsert_document(query_filter, update)
+                if return_document != ReturnDocument.AFTER:
+                    return None
+                ids = [sort_key(upserted)]
+            elif remove:
+                before = store.documents[ids[0]]
+                store.delete(ids[0])
+                return self.output(before, projection)
+            else:
+                before = store.documents[ids[0]]
+                self.update_document(ids[0], update)
+                if return_document != ReturnDocument.AFTER:
+                    return self.output(before, projection)
+            return self.output(store.documents[ids[0]], projection)
+
+    def find_one_and_update(
+        self,
+        filter,
+        update,
+        projection=None,
+        sort=None,
+        upsert=False,
+        return_document=ReturnDocument.BEFORE,
+        session=None,
+        **kwargs
+    ):
+        if not is_operator_dict(update):
+            raise ValueError("update only works with $ operators")
+        self.enlist(session)
+        return self.find_one_and_modify(
+            filter, update, projection, sort, upsert, return_document, False
+        )
+
+    def find_one_and_replace(
+        self,
+        filter,
+        replacement,
+        projection=None,
+        sort=None,
+        upsert=False,
+        return_document=ReturnDocument.BEFORE,
+        session=None,
+        **kwargs
+    ):
+        self.enlist(session)
+        return self.find_one_and_modify(
+            filter, replacement, projection, sort, upsert, return_document, False
+        )
+
+    def find_one_and_delete(
+        self, filter, projection=None, sort=None, session=None, **kwargs
+    ):
+        self.enlist(session)
+        return self.find_one_and_modify(
+            filter, None, projection, sort, False, ReturnDocument.BEFORE, True
+        )
+
+    def run_bulk(self, operations, ordered):
+        """
+        Apply collected bulk operations
+        :return: bulk api result, raises BulkWriteError like pymongo
+        """
+        result = {
+            "writeErrors": [],
+            "writeConcernErrors": [],
+            "nInserted": 0,
+            "nUpserted": 0,
+            "nMatched": 0,
+            "nModified": 0,
+            "nRemoved": 0,
+            "upserted": [],
+        }
+        with self.store.lock:
+            for index, operation in enumerate(operations):
+                try:
+                    self.run_bulk_operation(result, index, operation)
+                except (OperationFailure, WriteError, ValueError) as error:
+                    result["writeErrors"].append(
+                        {
+                            "index": index,
+                            "code": getattr(error, "code", None) or 2,
+                            "errmsg": str(error),
+                            "op": operation[1],
+                        }
+                    )
+                    if ordered:
+                        break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return result
+
+    def run_bulk_operation(self, result, index, operation):
+        kind = operation[0]
+        if kind == "insert":
+            self.store.insert(clone(operation[1]))
+            result["nInserted"] += 1
+        elif kind == "delete":
+            _, selector, limit, kwargs = operation
+            result["nRemoved"] += self.run_delete(
+                selector, limit, kwargs.get("collation")
+            )
+        else:
+            if kind == "update":
+                _, selector, update, multi, upsert, kwargs = operation
+            else:
+                _, selector, update, upsert, kwargs = operation
+                multi = False
+            raw_result = self.run_update(
+                selector,
+                update,
+                multi,
+                upsert,
+                collation=kwargs.get("collation"),
+            )
+            if "upserted" in raw_result:
+                result["nUpserted"] += 1
+                result["upserted"].append(
+                    {"index": index, "_id": raw_result["upserted"]}
+                )
+            else:
+                result["nMatched"] += raw_result["n"]
+                result["nModified"] += raw_result["nModified"]
+
+    def bulk_write(self, requests, ordered=True, session=None, **kwargs):
+        self.enlist(session)
+        collector = BulkCollector()
+        for request in requests:
+            request._add_to_bulk(collector)
+        return BulkWriteResult(self.run_bulk(collector.operations, ordered), True)
+
+    def create_index(self, keys, name=None, unique=False, sparse=False, **kwargs):
+        keys = index_keys(keys)
+        kwargs.pop("background", None)
+        kwargs.pop("session", None)
+        index = MemoryIndex(
+            name or index_name(keys),
+            keys,
+            unique=unique,
+            sparse=sparse,
+            collation=kwargs.pop("collation", None),
+            **kwargs,
+        )
+        store = self.store
+        with store.lock:
+            existing = store.indexes.get(index.name)
+            if existing is not None:
+                if not existing.same_spec(index):
+                    raise OperationFailure(
+                        "An existing index has the same name as the requested "
+                        "index: %s" % index.name,
+                        86,
+                    )
+                return index.name
+            for other in store.indexes.values():
+                if other.same_spec(index):
+                    raise OperationFailure(
+                        "Index already exists with a different name: %s" % other.name,
+                        85,
+                    )
+            for document_id, document in store.documents.items():
+                if index.conflict(document_id, document) is not None:
+                    raise store.duplicate_key_error(index, document)
+                index.add(document_id, document)
+            store.indexes[index.name] = index
+        return index.name
+
+    def index_information(self, session=None):
+        with self.store.lock:
+            return {
+                name: index.describe() for name, index in self.store.indexes.items()
+            }
+
+    def drop_index(self, index_or_name, session=None, **kwargs):
+        name = index_or_name
+        if not isinstance(name, str):
+            name = index_name(index_keys(index_or_name))
+        with self.store.lock:
+            if name == ID_INDEX or name not in self.store.indexes:
+                raise OperationFailure("index not found with name [%s]" % name, 27)
+            del self.store.indexes[name]
+
+    def drop(self, session=None, **kwargs):
+        self.database.drop_collection(self.name)
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure(
+            "The $changeStream stage is only supported on replica sets", 40573
+        )
+
+
+class MemoryDatabase(object):
+    """
+    pymongo.database.Database look-alike
+    """
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.stores = {}
+        self.lock = threading.Lock()
+
+    def get_store(self, name):
+        store = self.stores.get(name)
+        if store is None:
+            with self.lock:
+                store = self.stores.get(name)
+                if store is None:
+                    store = self.stores[name] = CollectionStore(
+                        "%s.%s" % (self.name, name)
+                    )
+        return store
+
+    def get_collection(self, name, codec_options=None, **kwargs):
+        collection = MemoryCollection(self, name, self.get_store(name))
+        if codec_options is not None:
+            collection = collection.with_options(codec_options=codec_options)
+        return collection
+
+    def __getitem__(self, name):
+        return self.get_collection(name)
+
+    def list_collection_names(self, session=None, **kwargs):
+        return list(self.stores)
+
+    def drop_collection(self, name_or_collection, session=None, **kwargs):
+        name = getattr(name_or_collection, "name", name_or_collection)
+        with self.lock:
+            self.stores.pop(name, None)
+
+
+class MemorySession(object):
+    """
+    pymongo.client_session.ClientSession look-alike. Writes apply at once,
+    so a transaction does not isolate; aborting it restores every collection
+    it wrote to as it was before its first write, undoing concurrent writes
+    of other sessions to those collections too.
+    """
+
+    def __init__(self, client, causal_consistency=True):
+        self.client = client
+        self.causal_consistency = causal_consistency
+        self.in_transaction = False
+        self.has_ended = False
+        self.snapshots = {}
+
+    def enlist(self, store):
+        if store not in self.snapshots:
+            with store.lock:
+                self.snapshots[store] = dict(store.documents)
+
+    def start_transaction(self, **kwargs):
+        self.in_transaction = True
+        self.snapshots = {}
+        return self
+
+    def commit_transaction(self):
+        self.in_transaction = False
+        self.snapshots = {}
+
+    def abort_transaction(self):
+        for store, documents in self.snapshots.items():
+            with store.lock:
+                store.restore(documents)
+        self.in_transaction = False
+        self.snapshots = {}
+
+    def end_session(self):
+        if self.in_transaction:
+            self.abort_transaction()
+        self.has_ended = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.end_session()
+
+
+class MemoryClient(object):
+    """
+    pymongo.MongoClient look-alike holding every database in process memory
+    """
+
+    def __init__(self):
+        self.databases = {}
+        self.lock = threading.Lock()
+
+    def get_database(self, name, **kwargs):
+        database = self.databases.get(name)
+        if database is None:
+            with self.lock:
+                database = self.databases.get(name)
+                if database is None:
+                    database = self.databases[name] = MemoryDatabase(self, name)
+        return database
+
+    def __getitem__(self, name):
+        return self.get_database(name)
+
+    def list_database_names(self, session=None):
+        return [name for name, database in self.databases.items() if database.stores]
+
+    def drop_database(self, name_or_database, session=None):
+        name = getattr(name_or_database, "name", name_or_database)
+        with self.lock:
+            self.databases.pop(name, None)
+
+    def start_session(self, causal_consistency=True, **kwargs):
+        return MemorySession(self, causal_consistency=causal_consistency)
+
+    def close(self):
+        pass
@@ -0,0 +1,516 @@
+"""
+Mongo query language for the in-memory engine: filter matching, projections,
+update operators and collation aware sort keys. Only the subset used by the
+framework is implemented; anything else raises OperationFailure like an
+unknown operator on the server.
+"""
+import datetime
+import re
+import unicodedata
+
+from bson import ObjectId
+from bson.binary import Binary
+from bson.regex import Regex
+from pymongo.errors import OperationFailure, WriteError
+
+MISSING = object()
+
+# BSON comparison order of types
+NULL_RANK = 1
+NUMBER_RANK = 2
+STRING_RANK = 3
+OBJECT_RANK = 4
+ARRAY_RANK = 5
+BINARY_RANK = 6
+OBJECT_ID_RANK = 7
+BOOL_RANK = 8
+DATE_RANK = 9
+OTHER_RANK = 10
+
+
+def unsupported(name):
+    return OperationFailure("%s is not supported by the memory backend" % name, 2)
+
+
+def clone(value):
+    """
+    Copy of a document, much faster than copy.deepcopy for bson values
+    """
+    if isinstance(value, dict):
+        return {key: clone(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [clone(val) for val in value]
+    return value
+
+
+def string_key(value, collation):
+    """
+    Sort key of a string under a collation. Strength 1 and 2 compare case
+    insensitively (1 also ignores accents); strength 3, the default, orders
+    case insensitively and breaks ties lower case first like ICU.
+    """
+    strength = collation.get("strength", 3)
+    folded = value.casefold()
+    if strength == 1:
+        folded = "".join(
+            char
+            for char in unicodedata.normalize("NFD", folded)
+            if not unicodedata.combining(char)
+        )
+    if strength < 3:
+        return (folded,)
+    return folded, value.swapcase()
+
+
+def sort_key(value, collation=None):
+    """
+    Totally ordered, hashable key following the BSON comparison order
+    """
+    if value is MISSING or value is None:
+        return NULL_RANK, 0
+    if isinstance(value, bool):
+        return BOOL_RANK, value
+    if isinstance(value, (int, float)):
+        return NUMBER_RANK, value
+    if isinstance(value, str):
+        if collation and collation.get("locale", "simple") != "simple":
+            return STRING_RANK, string_key(value, collation)
+        return STRING_RANK, value
+    if isinstance(value, dict):
+        return OBJECT_RANK, tuple(
+            (key, sort_key(val, collation)) for key, val in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return ARRAY_RANK, tuple(sort_key(val, collation) for val in value)
+    if isinstance(value, (bytes, Binary)):
+        return BINARY_RANK, bytes(value)
+    if isinstance(value, ObjectId):
+        return OBJECT_ID_RANK, value.binary
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return DATE_RANK, value
+    return OTHER_RANK, repr(value)
+
+
+def split_path(path):
+    return path.split(".")
+
+
+def path_values(value, parts):
+    """
+    Values at a dotted path, traversing arrays like the server does.
+    MISSING stands for an absent field.
+    """
+    if not parts:
+        return [value]
+    head, rest = parts[0], parts[1:]
+    if isinstance(value, dict):
+        if head not in value:
+            return [MISSING]
+        return path_values(value[head], rest)
+    if isinstance(value, list):
+        values = []
+        if head.isdigit() and int(head) < len(value):
+            values.extend(path_values(value[int(head)], rest))
+        for item in value:
+            if isinstance(item, dict):
+                values.extend(path_values(item, parts))
+        return values or [MISSING]
+    return [MISSING]
+
+
+def first_value(document, path):
+    values = path_values(document, split_path(path))
+    return values[0]
+
+
+def expand(values):
+    """
+    Values and the elements of array values, what equality matches against
+    """
+    for value in values:
+        yield value
+        if isinstance(value, list):
+            yield from value
+
+
+def is_operator_dict(value):
+    return isinstance(value, dict) and bool(value) and next(iter(value)).startswith("$")
+
+
+def compile_regex(pattern, options=""):
+    if isinstance(pattern, Regex):
+        return pattern.try_compile()
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    flags = 0
+    for option in options or "":
+        flags |= {"i": re.I, "m": re.M, "s": re.S, "x": re.X}.get(option, 0)
+    return re.compile(pattern, flags)
+
+
+def values_equal(values, expected, collation):
+    if type(expected) is str and not collation:
+        # fast path for the common string equality
+        return any(
+            value == expected or (isinstance(value, list) and expected in value)
+            for value in values
+        )
+    if isinstance(expected, (re.Pattern, Regex)):
+        regex = compile_regex(expected)
+        return any(
+            isinstance(value, str) and regex.search(value) for value in expand(values)
+        )
+    expected_key = sort_key(expected, collation)
+    return any(sort_key(value, collation) == expected_key for value in expand(values))
+
+
+def values_compare(values, expected, collation, accept):
+    expected_rank, expected_key = sort_key(expected, collation)
+    for value in expand(values):
+        if value is MISSING:
+            continue
+        rank, key = sort_key(value, collation)
+        if rank == expected_rank and accept(key, expected_key):
+            return True
+    return False
+
+
+def elem_matches(element, condition, collation):
+    if is_operator_dict(condition):
+        return match_condition([element], condition, collation)
+    return isinstance(element, dict) and matches(element, condition, collation)
+
+
+def match_operator(values, operator, argument, condition, collation):
+    if operator == "$eq":
+        return values_equal(values, argument, collation)
+    if operator == "$ne":
+        return not values_equal(values, argument, collation)
+    if operator == "$gt":
+        return values_compare(values, argument, collation, lambda a, b: a > b)
+    if operator == "$gte":
+        return values_compare(values, argument, collation, lambda a, b: a >= b)
+    if operator == "$lt":
+        return values_compare(values, argument, collation, lambda a, b: a < b)
+    if operator == "$lte":
+        return values_compare(values, argument, collation, lambda a, b: a <= b)
+    if operator == "$in":
+        return any(values_equal(values, value, collation) for value in argument)
+    if operator == "$nin":
+        return not any(values_equal(values, value, collation) for value in argument)
+    if operator == "$exists":
+        return any(value is not MISSING for value in values) == bool(argument)
+    if operator == "$not":
+        if isinstance(argument, (re.Pattern, Regex)):
+            return not values_equal(values, argument, collation)
+        return not match_condition(values, argument, collation)
+    if operator == "$size":
+        return any(
+            isinstance(value, list) and len(value) == argument for value in values
+        )
+    if operator == "$all":
+        return bool(argument) and all(
+            values_equal(values, value, collation) for value in argument
+        )
+    if operator == "$elemMatch":
+        return any(
+            isinstance(value, list)
+            and any(elem_matches(element, argument, collation) for element in value)
+            for value in values
+        )
+    if operator == "$regex":
+        regex = compile_regex(argument, condition.get("$options"))
+        return any(
+            isinstance(value, str) and regex.search(value) for value in expand(values)
+        )
+    if operator == "$options":
+        return True
+    raise unsupported(operator)
+
+
+def match_condition(values, condition, collation):
+    if is_operator_dict(condition):
+        return all(
+            match_operator(values, operator, argument, condition, collation)
+            for operator, argument in condition.items()
+        )
+    return values_equal(values, condition, collation)
+
+
+def matches(document, query_filter, collation=None):
+    """
+    True when document matches a mongo filter
+    """
+    for key, condition in (query_filter or {}).items():
+        if key == "$and":
+            if not all(matches(document, sub, collation) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(document, sub, collation) for sub in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(document, sub, collation) for sub in condition):
+                return False
+        elif key.startswith("$"):
+            raise unsupported(key)
+        else:
+            if "." in key:
+                values = path_values(document, split_path(key))
+            else:
+                values = [document.get(key, MISSING)]
+            if not match_condition(values, condition, collation):
+                return False
+    return True
+
+
+def path_tree(paths):
+    """
+    {"a.b": .., "c": ..} -> {"a": {"b": True}, "c": True}
+    """
+    tree = {}
+    for path in paths:
+        node = tree
+        parts = split_path(path)
+        for part in parts[:-1]:
+            child = node.setdefault(part, {})
+            if child is True:
+                break
+            node = child
+        else:
+            node[parts[-1]] = True
+    return tree
+
+
+def include_tree(value, tree):
+    if isinstance(value, list):
+        return [include_tree(item, tree) for item in value if isinstance(item, dict)]
+    record = {}
+    for key, val in value.items():
+        sub_tree = tree.get(key)
+        if sub_tree is True:
+            record[key] = clone(val)
+        elif sub_tree is not None and isinstance(val, (dict, list)):
+            record[key] = include_tree(val, sub_tree)
+    return record
+
+
+def exclude_tree(value, tree):
+    if isinstance(value, list):
+        return [
+            exclude_tree(item, tree) if isinstance(item, dict) else clone(item)
+            for item in value
+        ]
+    record = {}
+    for key, val in value.items():
+        sub_tree = tree.get(key)
+        if sub_tree is True:
+            continue
+        if sub_tree is not None and isinstance(val, (dict, list)):
+            record[key] = exclude_tree(val, sub_tree)
+        else:
+            record[key] = clone(val)
+    return record
+
+
+def project(document, projection):
+    """
+    Copy of document with a find projection applied
+    """
+    if not projection:
+        return clone(document)
+    if isinstance(projection, (list, tuple)):
+        projection = dict.fromkeys(projection, 1)
+    if any(isinstance(value, dict) for value in projection.values()):
+        raise unsupported("projection operators")
+    show_id = projection.get("_id", 1)
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    included = [key for key, value in fields.items() if value]
+    if included:
+        if len(included) != len(fields):
+            raise OperationFailure(
+                "Cannot do exclusion on field in inclusion projection", 31254
+            )
+        if show_id:
+            included.append("_id")
+        return include_tree(document, path_tree(included))
+    excluded = list(fields)
+    if not show_id:
+        excluded.append("_id")
+    return exclude_tree(document, path_tree(excluded))
+
+
+def get_parent(document, path, create):
+    """
+    (container, last key) of a dotted path, None when absent and not create
+    """
+    parts = split_path(path)
+    node = document
+    for part in parts[:-1]:
+        if isinstance(node, list) and part.isdigit():
+            index = int(part)
+            if index >= len(node):
+                return None, None
+            node = node[index]
+            continue
+        if not isinstance(node, dict):
+            return None, None
+        if part not in node or node[part] is None:
+            if not create:
+                return None, None
+            node[part] = {}
+        node = node[part]
+    return node, parts[-1]
+
+
+def get_path(document, path):
+    parent, key = get_parent(document, path, False)
+    if isinstance(parent, dict):
+        return parent.get(key, MISSING)
+    if isinstance(parent, list) and key.isdigit() and int(key) < len(parent):
+        return parent[int(key)]
+    return MISSING
+
+
+def set_path(document, path, value):
+    parent, key = get_parent(document, path, True)
+    if isinstance(parent, list) and key.isdigit():
+        index = int(key)
+        parent.extend([None] * (index + 1 - len(parent)))
+        parent[index] = value
+    elif isinstance(parent, dict):
+        parent[key] = value
+    else:
+        raise WriteError("Cannot create field in element %s" % path, 28)
+
+
+def unset_path(document, path):
+    parent, key = get_parent(document, path, False)
+    if isinstance(parent, dict):
+        parent.pop(key, None)
+    elif isinstance(parent, list) and key.isdigit() and int(key) < len(parent):
+        parent[int(key)] = None
+
+
+def array_at(document, path, operator):
+    current = get_path(document, path)
+    if current is MISSING:
+        current = []
+        set_path(document, path, current)
+    if not isinstance(current, list):
+        raise WriteError("%s requires an array at %s" % (operator, path), 2)
+    return current
+
+
+def each_value(value):
+    if isinstance(value, dict) and "$each" in value:
+        return value["$each"]
+    return [value]
+
+
+def apply_update(document, update, is_insert=False):
+    """
+    Apply update operators to document in place
+    :return: True when the document changed
+    """
+    if not is_operator_dict(update):
+        raise unsupported("replacement document in an update")
+    before = sort_key(document)
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            if operator == "$set":
+                set_path(document, path, clone(value))
+            elif operator == "$setOnInsert":
+                if is_insert:
+                    set_path(document, path, clone(value))
+            elif operator == "$unset":
+                unset_path(document, path)
+            elif operator == "$inc":
+                current = get_path(document, path)
+                set_path(document, path, (0 if current is MISSING else current) + value)
+            elif operator in ("$min", "$max"):
+                current = get_path(document, path)
+                lower = current is not MISSING and sort_key(current) < sort_key(value)
+                if current is MISSING or (lower == (operator == "$max")):
+                    set_path(document, path, clone(value))
+            elif operator == "$currentDate":
+                set_path(document, path, datetime.datetime.utcnow())
+            elif operator == "$rename":
+                current = get_path(document, path)
+                if current is not MISSING:
+                    unset_path(document, path)
+                    set_path(document, value, current)
+            elif operator == "$push":
+                array_at(document, path, operator).extend(
+                    clone(item) for item in each_value(value)
+                )
+            elif operator == "$addToSet":
+                current = array_at(document, path, operator)
+                for item in each_value(value):
+                    if not values_equal([current], item, None):
+                        current.append(clone(item))
+            elif operator == "$pull":
+                current = get_path(document, path)
+                if isinstance(current, list):
+                    current[:] = [
+                        item
+                        for item in current
+                        if not (
+                            elem_matches(item, value, None)
+                            if isinstance(value, dict)
+                            else values_equal([item], value, None)
+                        )
+                    ]
+            else:
+                raise unsupported(operator)
+    return sort_key(document) != before
+
+
+def upsert_seed(query_filter):
+    """
+    Document inserted by an upsert before the update is applied: the
+    equality conditions of the filter
+    """
+    seed = {}
+    for key, condition in (query_filter or {}).items():
+        if key == "$and":
+            for sub in condition:
+                seed.update(upsert_seed(sub))
+        elif key.startswith("$"):
+            continue
+        elif not is_operator_dict(condition):
+            set_path(seed, key, clone(condition))
+        elif "$eq" in condition:
+            set_path(seed, key, clone(condition["$eq"]))
+    return seed
+
+
+def sort_spec(sort, direction=None):
+    """
+    pymongo sort arguments to a list of (field, direction)
+    """
+    if isinstance(sort, str):
+        return [(sort, direction or 1)]
+    if isinstance(sort, dict):
+        return list(sort.items())
+    return list(sort)
+
+
+def sort_documents(documents, sort, collation=None):
+    """
+    Sort in place, arrays sort by their lowest (ascending) or highest
+    (descending) element like the server
+    """
+    for path, direction in reversed(sort_spec(sort)):
+        parts = split_path(path)
+
+        def key(document, parts=parts, direction=direction):
+            value = path_values(document, parts)[0]
+            if isinstance(value, list) and value:
+                keys = [sort_key(item, collation) for item in value]
+                return min(keys) if direction == 1 else max(keys)
+            return sort_key(value, collation)
+
+        documents.sort(key=key, reverse=direction == -1)
+    return documents
@@ -8,6 +8,7 @@ setup(
     name="corefw",
     version="1.0.0",
     install_requires=required,
+    extras_require={"async": ["motor==3.0.0"], "raw": ["python-bsonjs==0.3.0"]},
     python_requires=">=3.9",
     packages=find_packages(include=["corefw", "corefw.*"]),
 )
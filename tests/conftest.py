@@ -0,0 +1,41 @@
+import os
+import uuid
+
+import pytest
+
+# corefw loggers write to logs/ of the working directory from import time
+os.makedirs("logs", exist_ok=True)
+
+from flask import Flask  # noqa: E402
+from flask_restx import Api  # noqa: E402
+
+from corefw.exceptionsfw.exceptions import GatewayException  # noqa: E402
+
+BASE_CONFIG = {
+    "STORAGE_BACKEND": "memory",
+    "DB_NAME": "corefw_test",
+    "DB_PREFIX": "",
+    "ENVIRONMENT": "test",
+    "LOG_DATABASE_NAME": "logs",
+    "SECRET_KEY": "secret",
+    "KAFKA_SERVERS": "",
+    "BASE_HOST": "",
+}
+
+
+@pytest.fixture
+def make_app():
+    """
+    Flask app and api on a fresh in-memory database; consuming services
+    register the GatewayException handler, so the tests do too
+    """
+
+    def make(**config):
+        app = Flask(__name__)
+        app.config.update(BASE_CONFIG, MONGO_URL="mem://%s" % uuid.uuid4().hex)
+        app.config.update(config)
+        api = Api(app)
+        api.errorhandler(GatewayException)(lambda exception: exception.response())
+        return app, api
+
+    return make
@@ -0,0 +1,62 @@
+import asyncio
+import gc
+
+import pytest
+
+from corefw.mongofw import async_data_access
+from corefw.mongofw.async_data_access import AsyncClientRegistry
+
+
+class FakeMotorClient(object):
+    created = []
+
+    def __init__(self, mongo_url, **options):
+        self.mongo_url = mongo_url
+        self.options = options
+        self.closed = False
+        self.created.append(self)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    FakeMotorClient.created = []
+    monkeypatch.setattr(async_data_access, "AsyncIOMotorClient", FakeMotorClient)
+    return AsyncClientRegistry()
+
+
+def test_one_client_per_loop(registry):
+    async def get_twice():
+        first = registry.get_client("mongodb://db")
+        return first, registry.get_client("mongodb://db")
+
+    first, second = asyncio.run(get_twice())
+    assert first is second
+    assert len(FakeMotorClient.created) == 1
+
+
+def test_clients_of_finished_loops_are_closed(registry):
+    async def get_client():
+        return registry.get_client("mongodb://db")
+
+    for _ in range(20):
+        asyncio.run(get_client())
+        assert registry.client_count() <= 1
+    gc.collect()
+    assert registry.client_count() == 0
+    assert len(FakeMotorClient.created) == 20
+    assert all(client.closed for client in FakeMotorClient.created)
+
+
+def test_closed_loop_is_evicted_on_lookup(registry):
+    async def get_client():
+        return registry.get_client("mongodb://db")
+
+    loop = asyncio.new_event_loop()
+    stale = loop.run_until_complete(get_client())
+    loop.close()
+    asyncio.run(get_client())
+    assert stale.closed
+    assert registry.client_count() == 0
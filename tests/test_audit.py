@@ -0,0 +1,103 @@
+import threading
+import time
+
+from bson.errors import InvalidDocument
+from flask_restx import Resource
+
+from corefw.appfw.services.apikeys_services import ApiKeysService
+from corefw.authfw.auth import auth
+from corefw.authfw.log_decorator import log
+from corefw.loggerfw.logger import get_logger
+from corefw.mongofw.audit import AuditLogWriter, get_audit_writer
+
+
+@log
+def load_report():
+    return {"rows": []}
+
+
+@log
+def load_totals():
+    return {"total": 0}
+
+
+def test_one_audit_entry_per_request(make_app):
+    app, api = make_app()
+
+    @api.route("/reports")
+    class Reports(Resource):
+        @auth(get_logger(__name__), "reports")
+        def get(self):
+            return dict(load_report(), **load_totals()), 200, {}
+
+    with app.app_context():
+        ApiKeysService().create_group(name="reporting", associated_apps=["reports"])
+        api_key, _ = ApiKeysService().create_api_key(
+            name="reporter", associated_groups=["reporting"]
+        )
+        writer = get_audit_writer()
+    entries = []
+    writer.record = entries.append
+    client = app.test_client()
+    assert client.get("/reports", headers={"x-api-key": api_key}).status_code == 200
+    assert client.get("/reports").status_code == 400
+    assert [(entry["function"], entry["status"]) for entry in entries] == [
+        ("get", 200),
+        ("get", 400),
+    ]
+    assert entries[0]["route"] == "reports"
+    assert entries[0]["identifier"] == "reporter"
+
+
+def test_log_outside_a_request_only_times(make_app):
+    app, _ = make_app()
+    with app.app_context():
+        writer = get_audit_writer()
+        entries = []
+        writer.record = entries.append
+        assert load_report() == {"rows": []}
+    assert entries == []
+
+
+def test_log_audits_a_request_without_auth(make_app):
+    app, _ = make_app()
+    with app.test_request_context("/reports"):
+        writer = get_audit_writer()
+        entries = []
+        writer.record = entries.append
+        load_report()
+        load_totals()
+    assert [entry["function"] for entry in entries] == ["load_report"]
+
+
+class FailingMongoConn(object):
+    """
+    create_many raising InvalidDocument on the first batch only
+    """
+
+    def __init__(self):
+        self.batches = []
+        self.written = threading.Event()
+
+    def create_many(self, db_name, collection_name, batch, **kwargs):
+        if not self.batches:
+            self.batches.append(None)
+            raise InvalidDocument("cannot encode object: %r" % batch[0]["payload"])
+        self.batches.append(list(batch))
+        self.written.set()
+
+
+def test_writer_survives_unencodable_entries():
+    conn = FailingMongoConn()
+    writer = AuditLogWriter(conn, "logs", "audit", flush_seconds=0.01)
+    assert writer.record({"function": "bad", "payload": object()})
+    deadline = time.monotonic() + 5
+    while writer.status()["dropped"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert writer.record({"function": "good"})
+    assert conn.written.wait(5)
+    assert writer.thread.is_alive()
+    assert conn.batches[1] == [{"function": "good"}]
+    status = writer.status()
+    assert (status["errors"], status["dropped"], status["written"]) == (1, 1, 1)
+    writer.stop()
@@ -0,0 +1,36 @@
+import pytest
+
+from corefw.storagefw import backends
+from corefw.storagefw.backends import (
+    MemoryBackend,
+    StorageBackend,
+    get_backend,
+    register_backend,
+)
+
+
+def test_backend_without_get_client_cannot_be_created():
+    class IncompleteBackend(StorageBackend):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        IncompleteBackend()
+
+
+def test_registered_backend_is_selectable(monkeypatch):
+    monkeypatch.setattr(backends, "BACKEND_FACTORIES", dict(backends.BACKEND_FACTORIES))
+    monkeypatch.setattr(backends, "backends", {})
+
+    class SharedMemoryBackend(MemoryBackend):
+        name = "shared-memory"
+
+    register_backend(SharedMemoryBackend.name, SharedMemoryBackend)
+    backend = get_backend({"STORAGE_BACKEND": "shared-memory"})
+    assert isinstance(backend, SharedMemoryBackend)
+    assert backend.get_client("mem://a") is backend.get_client("mem://a")
+    assert get_backend({"STORAGE_BACKEND": "shared-memory"}) is backend
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        get_backend({"STORAGE_BACKEND": "missing"})
@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+from corefw.appfw.services.integration_services import IntegrationService
+from corefw.authfw.credential_cache import get_credential_cache
+from corefw.authfw.integration import get_integration
+from corefw.exceptionsfw.exceptions import GatewayException
+
+
+def create(provider, token="secret"):
+    IntegrationService().create_integration(
+        provider_code=provider,
+        provider_name=provider.title(),
+        config_data={"region": "eu"},
+        credentials=[{"name": "token", "value": token}],
+    )
+
+
+@pytest.fixture
+def app(make_app):
+    app, _ = make_app(CREDENTIAL_CACHE_TTL=60, CREDENTIAL_CACHE_SIZE=2)
+    with app.app_context():
+        yield app
+
+
+def test_cached_until_ttl_expires(make_app):
+    app, _ = make_app(CREDENTIAL_CACHE_TTL=0.05)
+    with app.app_context():
+        create("acme")
+        cached = get_integration("acme", False)
+        assert cached.secret("token") == "secret"
+        assert get_integration("acme", False) is cached
+        time.sleep(0.06)
+        reloaded = get_integration("acme", False)
+        assert reloaded is not cached
+        assert cached.wiped and cached.secrets == {}
+        assert reloaded.secret("token") == "secret"
+
+
+def test_update_provider_invalidates(app):
+    create("acme")
+    cached = get_integration("acme", False)
+    assert cached.secret("token") == "secret"
+    secret = cached.secrets["token"]
+    IntegrationService().update_integration(
+        "acme", credentials=[{"name": "token", "value": "rotated"}]
+    )
+    assert cached.wiped and secret == bytearray(len(secret))
+    assert get_integration("acme", False).secret("token") == "rotated"
+
+
+def test_delete_provider_invalidates(app):
+    create("acme")
+    cached = get_integration("acme", False)
+    IntegrationService().delete_integration("acme")
+    assert cached.wiped
+    with pytest.raises(GatewayException):
+        get_integration("acme", False)
+
+
+def test_least_recently_used_evicted(app):
+    for provider in ("acme", "globex", "initech"):
+        create(provider)
+    acme = get_integration("acme", False)
+    globex = get_integration("globex", False)
+    assert get_integration("acme", False) is acme
+    get_integration("initech", False)
+    assert globex.wiped and not acme.wiped
+    assert len(get_credential_cache()) == 2
+    assert globex.secret("token") == "secret"
+    assert globex.secrets == {}
+
+
+def test_no_cache_when_ttl_is_zero(make_app):
+    app, _ = make_app(CREDENTIAL_CACHE_TTL=0)
+    with app.app_context():
+        create("acme")
+        assert get_credential_cache() is None
+        assert get_integration("acme", False) is not get_integration("acme", False)
@@ -0,0 +1,71 @@
+import pytest
+
+from corefw import get_settings
+from corefw.appfw.services.apikeys_services import ApiKeysService
+from corefw.constants.constants import EFFECTIVE_APPS
+from corefw.constants.messages import (
+    DUPLICATE_GROUP_NAME,
+    FAILED_TO_REFRESH_PERMISSIONS,
+    GROUP_NOT_FOUND,
+)
+from corefw.exceptionsfw.exceptions import DataBaseException, GatewayException
+from corefw.mongofw.data_access import DataAccessObject
+from corefw.mongofw.indexes import reconcile_indexes
+
+
+@pytest.fixture
+def app(make_app):
+    app, _ = make_app()
+    with app.app_context():
+        reconcile_indexes()
+        yield app
+
+
+def stored_apps(api_key):
+    return DataAccessObject().get_resource({"api_key": api_key})[EFFECTIVE_APPS]
+
+
+def test_create_group_refreshes_keys_listing_it(app):
+    api_key, _ = ApiKeysService().create_api_key(
+        name="early", associated_groups=["reporting"]
+    )
+    assert stored_apps(api_key) == []
+    ApiKeysService().create_group(name="reporting", associated_apps=["reports"])
+    assert stored_apps(api_key) == ["reports"]
+
+
+def test_refresh_failure_reported_apart_from_create(app, monkeypatch):
+    def refresh_permissions(group_names=None, batch_size=None):
+        raise DataBaseException(message="connection reset")
+
+    service = ApiKeysService()
+    monkeypatch.setattr(service, "refresh_permissions", refresh_permissions)
+    with pytest.raises(GatewayException) as raised:
+        service.create_group(name="reporting", associated_apps=["reports"])
+    assert raised.value.args[0] == FAILED_TO_REFRESH_PERMISSIONS
+    groups = DataAccessObject(collection_name=get_settings(app, "GROUPS_COLLECTION"))
+    assert groups.get_resource({"name": "reporting"})
+    with pytest.raises(GatewayException) as raised:
+        ApiKeysService().create_group(name="reporting", associated_apps=["reports"])
+    assert raised.value.args[0] == DUPLICATE_GROUP_NAME
+
+
+def test_update_group_apps_refreshes_keys(app):
+    service = ApiKeysService()
+    service.create_group(name="reporting", associated_apps=["reports"])
+    service.create_group(name="billing", associated_apps=["invoices"])
+    api_key, _ = service.create_api_key(
+        name="reporter", associated_groups=["reporting", "billing"]
+    )
+    other, _ = service.create_api_key(name="biller", associated_groups=["billing"])
+    assert service.update_group("reporting", associated_apps=["reports", "admin"])
+    assert stored_apps(api_key) == ["admin", "invoices", "reports"]
+    assert stored_apps(other) == ["invoices"]
+    service.update_group("reporting", associated_apps=[])
+    assert stored_apps(api_key) == ["invoices"]
+
+
+def test_update_missing_group(app):
+    with pytest.raises(GatewayException) as raised:
+        ApiKeysService().update_group("missing", associated_apps=["reports"])
+    assert raised.value.args[0] == GROUP_NOT_FOUND
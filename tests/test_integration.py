@@ -0,0 +1,70 @@
+import pytest
+from flask import g
+
+from corefw.appfw.services.integration_services import IntegrationService
+from corefw.authfw.integration import integration
+
+
+class CountingFernet(object):
+    def __init__(self, fernet):
+        self.fernet = fernet
+        self.calls = 0
+
+    def decrypt(self, token):
+        self.calls += 1
+        return self.fernet.decrypt(token)
+
+
+@pytest.fixture
+def app(make_app):
+    app, _ = make_app()
+    with app.app_context():
+        IntegrationService().create_integration(
+            provider_code="acme",
+            provider_name="Acme",
+            config_data={"region": "eu"},
+            credentials=[
+                {"name": "client_id", "value": "id-1"},
+                {"name": "client_secret", "value": "secret-1"},
+            ],
+        )
+    return app
+
+
+def test_credentials_decrypted_lazily_and_once(app):
+    seen = {}
+
+    @integration("acme")
+    def handler():
+        credentials = g.credentials
+        decrypted = credentials.integration
+        if not isinstance(decrypted.fernet, CountingFernet):
+            decrypted.fernet = CountingFernet(decrypted.fernet)
+        seen["fernet"] = decrypted.fernet
+        seen["names"] = list(credentials)
+        seen["before"] = decrypted.fernet.calls
+        seen["values"] = [credentials["client_id"], credentials["client_id"]]
+        seen["after"] = decrypted.fernet.calls
+        return g.config_data
+
+    with app.test_request_context("/acme"):
+        assert handler() == {"region": "eu"}
+    assert seen["names"] == ["client_id", "client_secret"]
+    assert (seen["before"], seen["after"]) == (0, 1)
+    assert seen["values"] == ["id-1", "id-1"]
+    with app.test_request_context("/acme"):
+        handler()
+    # the second request reads the secret kept by the credential cache
+    assert seen["fernet"].calls == 1
+
+
+def test_rows_keep_the_former_list(app):
+    @integration("acme")
+    def handler():
+        return g.credentials.rows()
+
+    with app.test_request_context("/acme"):
+        assert handler() == [
+            {"name": "client_id", "value": "id-1"},
+            {"name": "client_secret", "value": "secret-1"},
+        ]
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from corefw.exceptionsfw.exceptions import LockNotAcquiredException
+from corefw.mongofw.locks import get_lock_manager, lock_metrics
+
+
+@pytest.fixture
+def manager(make_app):
+    app, _ = make_app()
+    return get_lock_manager(app)
+
+
+def fence_token(manager, lock_id):
+    counter = manager.mongo_conn.get_fence_collection(**manager.options).find_one(
+        {"_id": lock_id}
+    )
+    return counter and counter["token"]
+
+
+def test_acquire_and_release(manager):
+    lease = manager.acquire("job", ttl=5, renew=False)
+    assert manager.mongo_conn.find_lock("job")["owner"] == lease.owner
+    assert lease.release() is True
+    assert manager.mongo_conn.find_lock("job") is None
+    with manager.lock("job", ttl=5, renew=False) as lease:
+        assert lease.token == 2
+
+
+def test_contended_attempts_draw_no_token(manager):
+    lease = manager.acquire("job", ttl=5, renew=False)
+    contended = lock_metrics.snapshot()["job"]["contended"]
+    for _ in range(3):
+        with pytest.raises(LockNotAcquiredException):
+            manager.acquire("job", blocking=False)
+    with pytest.raises(LockNotAcquiredException):
+        manager.acquire("job", timeout=0.05, retry_interval=0.01)
+    assert lock_metrics.snapshot()["job"]["contended"] > contended + 3
+    assert fence_token(manager, "job") == lease.token == 1
+    lease.release()
+    assert manager.acquire("job", ttl=5, renew=False).token == 2
+
+
+def test_fence_counters_apart_from_locks(manager):
+    fenced = manager.acquire("fence:job", ttl=5, renew=False)
+    plain = manager.acquire("job", ttl=5, renew=False)
+    assert (fenced.token, plain.token) == (1, 1)
+    assert manager.mongo_conn.find_lock("fence:job")["owner"] == fenced.owner
+    assert manager.mongo_conn.find_lock("job")["owner"] == plain.owner
+    plain.release()
+    assert manager.acquire("job", ttl=5, renew=False).token == 2
+    assert fence_token(manager, "fence:job") == 1
+
+
+def test_expired_lock_taken_over(manager):
+    stale = manager.acquire("job", ttl=0, renew=False)
+    time.sleep(0.01)
+    fresh = manager.acquire("job", ttl=5, blocking=False, renew=False)
+    assert fresh.token > stale.token
+    assert stale.release() is False
+    assert manager.mongo_conn.find_lock("job")["owner"] == fresh.owner
+
+
+def test_exclusive_with_increasing_tokens(manager):
+    holders, tokens = [], []
+
+    def work():
+        with manager.lock("job", ttl=5, timeout=10, retry_interval=0.005):
+            holders.append(threading.current_thread().name)
+            assert len(holders) == 1
+            tokens.append(fence_token(manager, "job"))
+            time.sleep(0.002)
+            holders.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(tokens) == 8
+    assert tokens == sorted(tokens) and len(set(tokens)) == 8
@@ -0,0 +1,212 @@
+import threading
+
+import pytest
+from pymongo import InsertOne, UpdateOne
+from pymongo.collection import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from corefw.storagefw.memory import MemoryClient
+
+CASE_INSENSITIVE = {"locale": "en", "strength": 2}
+
+
+@pytest.fixture
+def collection():
+    collection = MemoryClient()["d"]["things"]
+    collection.insert_many(
+        [
+            {"_id": 1, "name": "alpha", "n": 1, "tags": ["a", "b"], "meta": {"k": 1}},
+            {"_id": 2, "name": "Beta", "n": 5, "tags": ["b"]},
+            {"_id": 3, "name": "gamma", "n": 10, "meta": {"k": 2}},
+        ]
+    )
+    return collection
+
+
+def ids(cursor):
+    return [document["_id"] for document in cursor]
+
+
+@pytest.mark.parametrize(
+    "query_filter, expected",
+    [
+        ({"name": "alpha"}, [1]),
+        ({"n": {"$gt": 1, "$lte": 10}}, [2, 3]),
+        ({"n": {"$in": [1, 10]}}, [1, 3]),
+        ({"n": {"$ne": 5}}, [1, 3]),
+        ({"n": {"$not": {"$gt": 1}}}, [1]),
+        ({"tags": "b"}, [1, 2]),
+        ({"tags": {"$all": ["a", "b"]}}, [1]),
+        ({"tags": {"$size": 1}}, [2]),
+        ({"meta.k": 2}, [3]),
+        ({"meta": {"$exists": False}}, [2]),
+        ({"name": {"$regex": "^g"}}, [3]),
+        ({"$or": [{"n": 1}, {"name": "gamma"}]}, [1, 3]),
+        ({"$and": [{"tags": "b"}, {"n": {"$gte": 5}}]}, [2]),
+        ({"missing": None}, [1, 2, 3]),
+    ],
+)
+def test_filters(collection, query_filter, expected):
+    assert ids(collection.find(query_filter)) == expected
+    assert collection.count_documents(query_filter) == len(expected)
+
+
+@pytest.mark.parametrize(
+    "projection, expected",
+    [
+        ({"name": 1}, {"_id": 1, "name": "alpha"}),
+        ({"name": 1, "_id": 0}, {"name": "alpha"}),
+        ({"meta.k": 1, "_id": 0}, {"meta": {"k": 1}}),
+        ({"tags": 0, "meta": 0}, {"_id": 1, "name": "alpha", "n": 1}),
+    ],
+)
+def test_projections(collection, projection, expected):
+    assert collection.find_one({"_id": 1}, projection) == expected
+
+
+def test_results_are_copies(collection):
+    document = collection.find_one({"_id": 1})
+    document["tags"].append("changed")
+    assert collection.find_one({"_id": 1})["tags"] == ["a", "b"]
+
+
+def test_sort_with_collation(collection):
+    assert ids(collection.find({}).sort("name", 1)) == [2, 1, 3]
+    cursor = collection.find({}).collation(CASE_INSENSITIVE).sort("name", 1)
+    assert ids(cursor) == [1, 2, 3]
+    assert ids(collection.find({}).sort("n", -1).skip(1).limit(1)) == [2]
+
+
+def test_updates_and_upsert(collection):
+    collection.update_one(
+        {"_id": 1},
+        {"$set": {"meta.k": 3}, "$inc": {"n": 2}, "$push": {"tags": "c"}},
+    )
+    assert collection.find_one({"_id": 1}, {"meta": 1, "n": 1, "tags": 1}) == {
+        "_id": 1,
+        "n": 3,
+        "tags": ["a", "b", "c"],
+        "meta": {"k": 3},
+    }
+    after = collection.find_one_and_update(
+        {"name": "delta"},
+        {"$inc": {"n": 1}, "$setOnInsert": {"created": True}},
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    assert after == {"name": "delta", "n": 1, "created": True}
+    collection.update_one({"name": "delta"}, {"$inc": {"n": 1}}, upsert=True)
+    assert collection.find_one({"name": "delta"}, {"_id": 0}) == {
+        "name": "delta",
+        "n": 2,
+        "created": True,
+    }
+
+
+def test_unique_index(collection):
+    collection.create_index("name", unique=True)
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({"name": "alpha"})
+    with pytest.raises(DuplicateKeyError):
+        collection.update_one({"_id": 2}, {"$set": {"name": "alpha"}})
+    # the failed update left the document and its index entries alone
+    assert collection.find_one({"name": "Beta"})["_id"] == 2
+    collection.update_one({"_id": 2}, {"$set": {"name": "beta"}})
+    collection.insert_one({"_id": 4, "name": "Beta"})
+
+
+def test_unique_index_with_collation(collection):
+    collection.create_index("name", unique=True, collation=CASE_INSENSITIVE)
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({"name": "ALPHA"})
+    found = collection.find_one({"name": "GAMMA"}, collation=CASE_INSENSITIVE)
+    assert found["_id"] == 3
+
+
+def test_unique_index_on_missing_keys(collection):
+    # a missing key is indexed as null, so only one document may lack it
+    with pytest.raises(DuplicateKeyError):
+        collection.create_index("code", unique=True)
+    collection.delete_many({"_id": {"$in": [2, 3]}})
+    collection.create_index("code", unique=True)
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({"_id": 9})
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({"_id": 10, "code": None})
+
+
+def test_sparse_unique_index_skips_missing_keys():
+    collection = MemoryClient()["d"]["things"]
+    collection.create_index("code", unique=True, sparse=True)
+    collection.insert_one({"_id": 1})
+    collection.insert_one({"_id": 2})
+    collection.insert_one({"_id": 3, "code": "x"})
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({"_id": 4, "code": "x"})
+
+
+def test_unique_index_over_duplicates_is_refused(collection):
+    collection.insert_one({"_id": 4, "name": "alpha"})
+    with pytest.raises(DuplicateKeyError):
+        collection.create_index("name", unique=True)
+    assert "name_1" not in collection.index_information()
+
+
+def test_bulk_write_reports_errors(collection):
+    requests = [
+        InsertOne({"_id": 1}),
+        InsertOne({"_id": 7}),
+        UpdateOne({"_id": 2}, {"$set": {"n": 6}}),
+    ]
+    with pytest.raises(BulkWriteError) as unordered:
+        collection.bulk_write(requests, ordered=False)
+    details = unordered.value.details
+    assert [error["index"] for error in details["writeErrors"]] == [0]
+    assert (details["nInserted"], details["nModified"]) == (1, 1)
+    with pytest.raises(BulkWriteError) as ordered:
+        collection.bulk_write([InsertOne({"_id": 2}), InsertOne({"_id": 8})])
+    assert ordered.value.details["nInserted"] == 0
+    assert collection.find_one({"_id": 8}) is None
+
+
+def test_change_streams_are_unsupported(collection):
+    with pytest.raises(OperationFailure):
+        collection.watch()
+
+
+def run_threads(target, count=8):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_increments_are_not_lost():
+    collection = MemoryClient()["d"]["counters"]
+
+    def increment():
+        for _ in range(200):
+            collection.update_one({"_id": "hits"}, {"$inc": {"n": 1}}, upsert=True)
+
+    run_threads(increment)
+    assert collection.find_one({"_id": "hits"})["n"] == 1600
+
+
+def test_concurrent_unique_inserts_admit_one_writer():
+    collection = MemoryClient()["d"]["keys"]
+    collection.create_index("name", unique=True)
+    inserted = []
+
+    def insert():
+        for index in range(50):
+            try:
+                collection.insert_one({"name": "key-%d" % index})
+                inserted.append(index)
+            except DuplicateKeyError:
+                pass
+
+    run_threads(insert)
+    assert sorted(inserted) == list(range(50))
+    assert collection.count_documents({}) == 50
@@ -0,0 +1,209 @@
+import os
+import queue
+import time
+import uuid
+
+import pytest
+from pymongo.errors import AutoReconnect, OperationFailure
+
+from corefw.mongofw import mirror as mirror_module
+from corefw.mongofw.mirror import CollectionMirror, MirrorRegistry, apply_projection
+from corefw.mongofw.mongo_client import MongoClient
+
+
+class FakeStream(object):
+    """
+    Change stream over a queue of events, resume token = count of events seen
+    """
+
+    def __init__(self, collection, resume_after):
+        self.collection = collection
+        self.resume_token = resume_after
+        self.alive = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.alive = False
+
+    def try_next(self):
+        try:
+            change = self.collection.events.get(timeout=0.01)
+        except queue.Empty:
+            return None
+        if isinstance(change, Exception):
+            raise change
+        self.resume_token = {"_data": change.pop("_token")}
+        return change
+
+
+class FakeCollection(object):
+    def __init__(self, documents=()):
+        self.documents = {document["_id"]: dict(document) for document in documents}
+        self.events = queue.Queue()
+        self.watches = []
+        self.loads = 0
+
+    def find(self, filter_dict):
+        self.loads += 1
+        return [dict(document) for document in self.documents.values()]
+
+    def watch(self, resume_after=None, **kwargs):
+        self.watches.append(resume_after)
+        return FakeStream(self, resume_after)
+
+
+class FakeMongoConn(object):
+    def __init__(self, collection, db_name="d"):
+        self.collection = collection
+        self.db_name = db_name
+
+    def get_collection(self, collection_name):
+        return self.collection
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def change(token, operation, document_id, full_document=None):
+    event = {"_token": token, "operationType": operation}
+    event["documentKey"] = {"_id": document_id}
+    if full_document is not None:
+        event["fullDocument"] = full_document
+    return event
+
+
+@pytest.fixture
+def collection():
+    return FakeCollection([{"_id": 1, "name": "a"}, {"_id": 2, "name": "b"}])
+
+
+@pytest.fixture
+def mirror(collection, monkeypatch):
+    monkeypatch.setattr(mirror_module, "DEFAULT_RETRY_SECONDS", 0.01)
+    mirror = CollectionMirror(FakeMongoConn(collection), "apikeys")
+    mirror.start()
+    assert mirror.ready.wait(5)
+    yield mirror
+    mirror.stop()
+    mirror.thread.join(5)
+
+
+def test_boot_load(mirror, collection):
+    assert collection.loads == 1
+    assert collection.watches == [None]
+    assert mirror.find_one({"name": "a"}) == (True, {"name": "a"})
+    assert mirror.find_one({"name": "z"}) == (True, None)
+    assert mirror.find_one({"name": {"$in": ["a"]}}) == mirror_module.MISS
+
+
+def test_change_stream_events_are_applied(mirror):
+    assert mirror.find_one({"name": "a"}) == (True, {"name": "a"})
+    events = [
+        change(1, "insert", 3, {"_id": 3, "name": "c"}),
+        change(2, "update", 1, {"_id": 1, "name": "renamed"}),
+        change(3, "delete", 2),
+    ]
+    for event in events:
+        mirror.mongo_conn.collection.events.put(event)
+    wait_for(lambda: mirror.resume_token == {"_data": 3})
+    assert mirror.find_one({"name": "c"}) == (True, {"name": "c"})
+    assert mirror.find_one({"name": "a"}) == (True, None)
+    assert mirror.find_one({"name": "renamed"}) == (True, {"name": "renamed"})
+    assert mirror.find_one({"name": "b"}) == (True, None)
+    assert mirror.stats["events"] == 3
+
+
+def test_disconnect_resumes_after_last_event(mirror, collection):
+    collection.events.put(change(1, "insert", 3, {"_id": 3, "name": "c"}))
+    collection.events.put(AutoReconnect("connection reset"))
+    collection.events.put(change(2, "insert", 4, {"_id": 4, "name": "d"}))
+    wait_for(lambda: mirror.resume_token == {"_data": 2})
+    assert collection.watches == [None, {"_data": 1}]
+    assert collection.loads == 1
+    assert mirror.find_one({"name": "d"}) == (True, {"name": "d"})
+
+
+@pytest.mark.parametrize(
+    "failure",
+    [
+        OperationFailure("resume token not found"),
+        change(1, "invalidate", None),
+    ],
+)
+def test_lost_stream_falls_back_to_resync(mirror, collection, failure):
+    collection.documents[5] = {"_id": 5, "name": "written while away"}
+    collection.events.put(failure)
+    wait_for(lambda: collection.loads == 2 and mirror.ready.is_set())
+    assert collection.watches[-1] is None
+    assert mirror.stats["resyncs"] == 2
+    assert mirror.find_one({"name": "written while away"}) == (
+        True,
+        {"name": "written while away"},
+    )
+
+
+def test_periodic_resync(collection):
+    mirror = CollectionMirror(FakeMongoConn(collection), "apikeys", 0.05)
+    mirror.start()
+    try:
+        wait_for(lambda: collection.loads >= 2)
+    finally:
+        mirror.stop()
+        mirror.thread.join(5)
+
+
+def test_registry_is_keyed_by_database(collection):
+    registry = MirrorRegistry()
+    registry.configure(FakeMongoConn(collection), ["apikeys"])
+    try:
+        assert registry.get("d", "apikeys") is not None
+        assert registry.get("other", "apikeys") is None
+        assert list(registry.status()) == ["d.apikeys"]
+    finally:
+        registry.stop_all()
+
+
+@pytest.mark.parametrize(
+    "project_fields, expected",
+    [
+        (None, {"name": "a", "tags": ["x"]}),
+        ({"_id": 0}, {"name": "a", "tags": ["x"]}),
+        ({"name": 1}, {"name": "a"}),
+        ({"name": 1, "_id": 1}, {"name": "a"}),
+        ({"tags": 0}, {"name": "a"}),
+    ],
+)
+def test_projection_drops_id_like_mongo_client_find_one(project_fields, expected):
+    document = {"_id": 1, "name": "a", "tags": ["x"]}
+    assert apply_projection(document, project_fields) == expected
+
+
+@pytest.mark.skipif(
+    not os.environ.get("MONGO_REPLSET_URL"),
+    reason="needs a replica set, e.g. a local mongod --replSet rs0",
+)
+def test_mirror_against_replica_set():
+    mongo_conn = MongoClient(
+        os.environ["MONGO_REPLSET_URL"], "corefw_test_%s" % uuid.uuid4().hex
+    )
+    collection = mongo_conn.get_collection("apikeys")
+    collection.insert_one({"_id": 1, "name": "a"})
+    mirror = CollectionMirror(mongo_conn, "apikeys")
+    mirror.start()
+    try:
+        assert mirror.ready.wait(10)
+        assert mirror.find_one({"name": "a"}) == (True, {"name": "a"})
+        collection.insert_one({"_id": 2, "name": "b"})
+        collection.delete_one({"_id": 1})
+        wait_for(lambda: mirror.find_one({"name": "b"})[1] is not None, 10)
+        assert mirror.find_one({"name": "a"}) == (True, None)
+    finally:
+        mirror.stop()
+        mirror.thread.join(5)
+        mongo_conn.get_connection().drop_database(mongo_conn.db_name)
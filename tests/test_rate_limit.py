@@ -0,0 +1,165 @@
+import pytest
+from flask_restx import Resource
+from jsonschema import RefResolver
+from werkzeug.exceptions import BadRequest
+
+from corefw.appfw.routes import apikeys_ns
+from corefw.appfw.services.apikeys_services import ApiKeysService
+from corefw.authfw import rate_limit
+from corefw.authfw.auth import auth
+from corefw.authfw.rate_limit import (
+    MongoRateLimitBackend,
+    RateLimit,
+    TokenBucket,
+    get_rate_limiter,
+)
+from corefw.constants.messages import RATE_LIMIT_EXCEEDED
+from corefw.exceptionsfw.exceptions import GatewayException
+from corefw.loggerfw.logger import get_logger
+from corefw.models.v1.request_model import RATE_LIMIT_MODEL
+from corefw.mongofw.mongo_client import MongoClient
+
+
+class FakeClock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket()
+    limit = RateLimit(None, rate=2, burst=3)
+    assert bucket.take(limit, 0.0) == (True, 2, 0.5)
+    assert bucket.take(limit, 0.0) == (True, 1, 1.0)
+    assert bucket.take(limit, 0.0) == (True, 0, 1.5)
+    # empty: the next token comes after 1 / rate seconds
+    assert bucket.take(limit, 0.0) == (False, 0, 0.5)
+    assert bucket.take(limit, 0.25) == (False, 0, 0.25)
+    assert bucket.take(limit, 0.5) == (True, 0, 1.5)
+    # refill never exceeds burst
+    assert bucket.take(limit, 100.0) == (True, 2, 0.5)
+
+
+def test_token_bucket_default_burst():
+    assert RateLimit(None, rate=0.5).burst == 1
+    assert RateLimit(None, rate=2.5).burst == 3
+
+
+def test_mongo_backend_fixed_window_rollover(make_app, monkeypatch):
+    app, _ = make_app()
+    clock = FakeClock(100.5)
+    monkeypatch.setattr(rate_limit, "time", clock)
+    backend = MongoRateLimitBackend(MongoClient.from_config(app.config))
+    limit = RateLimit(None, rate=1, burst=2)
+    # burst / rate = 2 second windows starting at 100
+    assert backend.acquire("key", limit) == (True, 1, 1.5)
+    assert backend.acquire("key", limit) == (True, 0, 1.5)
+    clock.now = 101.5
+    assert backend.acquire("key", limit) == (False, 0, 0.5)
+    clock.now = 102.0
+    assert backend.acquire("key", limit) == (True, 1, 2.0)
+    assert backend.acquire("other", limit) == (True, 1, 2.0)
+    counters = backend.mongo_conn.get_collection("rate_limits").find({}).sort("_id")
+    assert [(row["_id"], row["count"]) for row in counters] == [
+        # the refused request gave its count back
+        ("key:100", 2),
+        ("key:102", 1),
+        ("other:102", 1),
+    ]
+
+
+@pytest.mark.parametrize("backend", ["local", "mongo"])
+def test_auth_refuses_with_429_and_headers(make_app, monkeypatch, backend):
+    monkeypatch.setattr(rate_limit, "time", FakeClock(1000.0))
+    app, api = make_app(RATE_LIMIT_ENABLED=True, RATE_LIMIT_BACKEND=backend)
+
+    @api.route("/reports")
+    class Reports(Resource):
+        @auth(get_logger(__name__), "reports")
+        def get(self):
+            return {"ok": True}, 200, {}
+
+    with app.app_context():
+        ApiKeysService().create_group(
+            name="reporting",
+            associated_apps=["reports"],
+            rate_limit={"rate": 1, "burst": 2},
+        )
+        api_key, _ = ApiKeysService().create_api_key(
+            name="reporter", associated_groups=["reporting"]
+        )
+    client = app.test_client()
+    headers = {"x-api-key": api_key}
+
+    responses = [client.get("/reports", headers=headers) for _ in range(3)]
+    assert [response.status_code for response in responses] == [200, 200, 429]
+    assert [response.headers["RateLimit-Remaining"] for response in responses] == [
+        "1",
+        "0",
+        "0",
+    ]
+    assert responses[0].headers["RateLimit-Limit"] == "2"
+    assert "Retry-After" not in responses[1].headers
+    refused = responses[2]
+    assert int(refused.headers["Retry-After"]) >= 1
+    assert refused.headers["Retry-After"] == refused.headers["RateLimit-Reset"]
+    assert refused.get_json()["code"] == RATE_LIMIT_EXCEEDED[0]
+
+
+def test_auth_without_rate_limit_sets_no_headers(make_app):
+    app, api = make_app()
+
+    @api.route("/reports")
+    class Reports(Resource):
+        @auth(get_logger(__name__), "reports")
+        def get(self):
+            return {"ok": True}, 200, {}
+
+    with app.app_context():
+        ApiKeysService().create_group(name="reporting", associated_apps=["reports"])
+        api_key, _ = ApiKeysService().create_api_key(
+            name="reporter", associated_groups=["reporting"]
+        )
+    response = app.test_client().get("/reports", headers={"x-api-key": api_key})
+    assert response.status_code == 200
+    assert "RateLimit-Limit" not in response.headers
+
+
+@pytest.mark.parametrize("backend", ["local", "mongo"])
+def test_refused_route_takes_no_key_wide_token(make_app, monkeypatch, backend):
+    monkeypatch.setattr(rate_limit, "time", FakeClock(1000.0))
+    app, _ = make_app(RATE_LIMIT_ENABLED=True, RATE_LIMIT_BACKEND=backend)
+    spec = {"rate": 1, "burst": 3, "routes": {"export": {"rate": 1, "burst": 1}}}
+    statuses = []
+    with app.app_context():
+        limiter = get_rate_limiter()
+        for route_name in ("export", "export", "export", "reports", "reports"):
+            with app.test_request_context("/" + route_name):
+                try:
+                    limiter.enforce("key", route_name, spec)
+                    statuses.append(200)
+                except GatewayException as exception:
+                    statuses.append(exception.status)
+    # the key wide bucket still has the tokens of the refused exports
+    assert statuses == [200, 429, 429, 200, 200]
+
+
+def test_route_limits_are_nested_models():
+    resolver = RefResolver.from_schema(
+        {
+            "definitions": {
+                name: model.__schema__ for name, model in apikeys_ns.models.items()
+            }
+        }
+    )
+    RATE_LIMIT_MODEL.validate(
+        {"rate": 1, "routes": {"export": {"rate": 5, "burst": 10}}}, resolver
+    )
+    for routes in ("export", {"export": 5}, {"export": {"burst": 1}}):
+        with pytest.raises(BadRequest):
+            RATE_LIMIT_MODEL.validate({"rate": 1, "routes": routes}, resolver)
@@ -0,0 +1,32 @@
+import json
+
+from corefw.constants.messages import EXPORT_INTERRUPTED
+from corefw.exceptionsfw.exceptions import DataBaseException
+from corefw.helpersfw.response_helpers import ndjson_response
+
+
+def export(make_app, rows):
+    app, _ = make_app()
+    app.add_url_rule("/export", "export", lambda: ndjson_response(rows()))
+    response = app.test_client().get("/export")
+    return response, [json.loads(line) for line in response.data.splitlines()]
+
+
+def test_ndjson_streams_rows(make_app):
+    response, lines = export(make_app, lambda: iter([{"n": 1}, {"n": 2}]))
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert lines == [{"n": 1}, {"n": 2}]
+
+
+def test_ndjson_error_ends_with_error_line(make_app):
+    def rows():
+        yield {"n": 1}
+        raise DataBaseException(message="cursor killed")
+
+    response, lines = export(make_app, rows)
+    assert response.status_code == 200
+    assert lines == [
+        {"n": 1},
+        {"error": {"code": EXPORT_INTERRUPTED[0], "message": EXPORT_INTERRUPTED[1]}},
+    ]
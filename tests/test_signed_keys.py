@@ -0,0 +1,190 @@
+import time
+
+import pytest
+from flask_restx import Resource
+from pymongo.errors import AutoReconnect
+
+from corefw import get_settings
+from corefw.appfw.services.apikeys_services import ApiKeysService
+from corefw.authfw.auth import auth
+from corefw.authfw.signed_keys import (
+    Keyring,
+    RevocationList,
+    SignedKeyError,
+    get_signed_keys,
+    is_signed_key,
+)
+from corefw.constants.constants import ACTIVE, EXPIRES_AT, KEY_ID, STATUS
+from corefw.constants.messages import (
+    FORBIDDEN_ACCESS,
+    INVALID_API_KEY,
+    INVALID_JWT_TOKEN_EXPIRED,
+    JWT_TOKEN_EXPIRED,
+    REVOCATIONS_UNAVAILABLE,
+)
+from corefw.loggerfw.logger import get_logger
+from corefw.mongofw.data_access import DataAccessObject
+from corefw.mongofw.mongo_client import MongoClient
+
+OLD_KEYRING = Keyring({"2024-01": "old secret"}, "2024-01")
+CLAIMS = {"jti": "k1", "sub": "reporter", "apps": ["reports"], "all": False}
+
+
+def sign(keyring, exp=4102444800):
+    return keyring.sign(dict(CLAIMS, exp=exp))
+
+
+def test_keyring_verifies_its_tokens():
+    token = sign(OLD_KEYRING)
+    assert is_signed_key(token)
+    assert OLD_KEYRING.verify(token)["jti"] == "k1"
+
+
+@pytest.mark.parametrize(
+    "token, message",
+    [
+        # malformed, bad signature, unknown kid, expired
+        ("a.b.c", INVALID_JWT_TOKEN_EXPIRED),
+        (sign(Keyring({"2024-01": "forged"}, "2024-01")), INVALID_JWT_TOKEN_EXPIRED),
+        (sign(Keyring({"2023-01": "secret"}, "2023-01")), INVALID_JWT_TOKEN_EXPIRED),
+        (sign(OLD_KEYRING, exp=1), JWT_TOKEN_EXPIRED),
+    ],
+)
+def test_keyring_refuses(token, message):
+    with pytest.raises(SignedKeyError) as refused:
+        OLD_KEYRING.verify(token)
+    assert refused.value.message == message
+
+
+def test_kid_rotation():
+    old_token = sign(OLD_KEYRING)
+    rotated = Keyring({"2024-01": "old secret", "2024-06": "new secret"}, "2024-06")
+    new_token = sign(rotated)
+    assert rotated.verify(old_token)["jti"] == "k1"
+    assert rotated.verify(new_token)["jti"] == "k1"
+    retired = Keyring({"2024-06": "new secret"}, "2024-06")
+    assert retired.verify(new_token)["jti"] == "k1"
+    with pytest.raises(SignedKeyError):
+        retired.verify(old_token)
+
+
+def test_active_kid_must_be_in_keyring():
+    with pytest.raises(ValueError):
+        Keyring({"2024-01": "secret"}, "2024-06")
+
+
+@pytest.fixture
+def signed_app(make_app):
+    app, api = make_app(
+        SIGNED_KEY_SECRETS={"2024-06": "secret"},
+        SIGNED_KEY_ACTIVE_KID="2024-06",
+        SIGNED_KEY_REVOCATION_REFRESH=0,
+    )
+    for route_name in ("reports", "admin"):
+
+        @api.route("/" + route_name, endpoint=route_name)
+        class Route(Resource):
+            @auth(get_logger(__name__), route_name)
+            def get(self):
+                return {"ok": True}, 200, {}
+
+    with app.app_context():
+        ApiKeysService().create_group(name="reporting", associated_apps=["reports"])
+    return app
+
+
+def test_signed_key_issue_and_verify(signed_app):
+    with signed_app.app_context():
+        api_key, _ = ApiKeysService().create_api_key(
+            name="reporter", associated_groups=["reporting"], signed=True
+        )
+        claims = get_signed_keys().verify(api_key)
+    assert (claims["sub"], claims["apps"], claims["all"]) == (
+        "reporter",
+        ["reports"],
+        False,
+    )
+    client = signed_app.test_client()
+    headers = {"x-api-key": api_key}
+    assert client.get("/reports", headers=headers).status_code == 200
+    forbidden = client.get("/admin", headers=headers)
+    assert forbidden.status_code == 403
+    assert forbidden.get_json()["code"] == FORBIDDEN_ACCESS[0]
+
+
+def test_revoked_signed_key_is_refused(signed_app):
+    with signed_app.app_context():
+        api_key, _ = ApiKeysService().create_api_key(
+            name="reporter", associated_groups=["reporting"], signed=True
+        )
+    client = signed_app.test_client()
+    headers = {"x-api-key": api_key}
+    assert client.get("/reports", headers=headers).status_code == 200
+    with signed_app.app_context():
+        ApiKeysService().update_api_key(api_key, **{STATUS: "INACTIVE"})
+    refused = client.get("/reports", headers=headers)
+    assert refused.status_code == 404
+    assert refused.get_json()["code"] == INVALID_API_KEY[0]
+
+
+class FlakyMongoConn(object):
+    db_name = "corefw_test"
+
+    def __init__(self, revoked=()):
+        self.revoked = list(revoked)
+        self.down = False
+
+    def distinct(self, db_name, collection_name, key, filter_dict):
+        if self.down:
+            raise AutoReconnect("connection refused")
+        return self.revoked
+
+
+def test_revocations_skip_expired_keys(make_app):
+    app, _ = make_app()
+    now = int(time.time())
+    with app.app_context():
+        for api_key in (
+            {KEY_ID: "revoked", STATUS: "INACTIVE", EXPIRES_AT: now + 60},
+            {KEY_ID: "expired", STATUS: "INACTIVE", EXPIRES_AT: now - 1},
+            {KEY_ID: "active", STATUS: ACTIVE, EXPIRES_AT: now + 60},
+            {"name": "plain", STATUS: "INACTIVE"},
+        ):
+            DataAccessObject().create(data=api_key)
+        revocations = RevocationList(
+            MongoClient.from_config(app.config),
+            get_settings(app, "APIKEY_COLLECTION"),
+        )
+        revocations.load()
+    assert revocations.revoked == {"revoked"}
+
+
+def test_revocations_fail_closed_until_loaded():
+    mongo_conn = FlakyMongoConn(revoked=["k1"])
+    revocations = RevocationList(mongo_conn, "api_keys", refresh_seconds=0)
+    mongo_conn.down = True
+    with pytest.raises(SignedKeyError) as refused:
+        revocations.is_revoked("k1")
+    assert (refused.value.message, refused.value.status) == (
+        REVOCATIONS_UNAVAILABLE,
+        503,
+    )
+    mongo_conn.down = False
+    assert revocations.is_revoked("k1")
+    mongo_conn.down = True
+    # a later outage keeps the list loaded last
+    assert revocations.is_revoked("k1")
+    assert not revocations.is_revoked("k2")
+
+
+def test_signed_key_refused_with_503_before_revocations_load(signed_app):
+    with signed_app.app_context():
+        api_key, _ = ApiKeysService().create_api_key(
+            name="reporter", associated_groups=["reporting"], signed=True
+        )
+        revocations = get_signed_keys().revocations
+    revocations.mongo_conn = FlakyMongoConn()
+    revocations.mongo_conn.down = True
+    refused = signed_app.test_client().get("/reports", headers={"x-api-key": api_key})
+    assert refused.status_code == 503
+    assert refused.get_json()["code"] == REVOCATIONS_UNAVAILABLE[0]
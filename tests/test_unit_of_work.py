@@ -0,0 +1,91 @@
+import pytest
+
+from corefw.exceptionsfw.exceptions import DataBaseException
+from corefw.mongofw.data_access import DataAccessObject
+from corefw.mongofw.unit_of_work import UnitOfWork
+
+
+@pytest.fixture
+def dao(make_app):
+    app, _ = make_app()
+    with app.app_context():
+        dao = DataAccessObject(collection_name="things")
+        dao.create_index([("name", 1)], "name_unique", is_unique=True)
+        yield dao
+
+
+def test_ordered_bulk_write_skips_after_failure(dao):
+    dao.create(data={"name": "taken"})
+    result = dao.bulk_write(
+        [
+            {"op": "insert", "data": {"name": "first"}},
+            {"op": "insert", "data": {"name": "taken"}},
+            {"op": "insert", "data": {"name": "never"}},
+            {"op": "update", "filter": {"name": "first"}, "data": {"n": 1}},
+        ],
+        ordered=True,
+    )
+    assert [(row["ok"], row.get("skipped", False)) for row in result["results"]] == [
+        (True, False),
+        (False, False),
+        (False, True),
+        (False, True),
+    ]
+    assert "inserted_id" not in result["results"][2]
+    assert [error["index"] for error in result["errors"]] == [1]
+    assert dao.count({"name": "never"}) == 0
+
+
+def test_ordered_bulk_write_skips_later_batches(dao):
+    dao.create(data={"name": "taken"})
+    result = dao.bulk_write(
+        [{"op": "insert", "data": {"name": name}} for name in ("taken", "a", "b")],
+        ordered=True,
+        max_batch_operations=1,
+    )
+    assert [row.get("skipped", False) for row in result["results"]] == [
+        False,
+        True,
+        True,
+    ]
+    assert result["inserted_count"] == 0
+
+
+def test_unordered_bulk_write_runs_everything(dao):
+    dao.create(data={"name": "taken"})
+    result = dao.bulk_write(
+        [{"op": "insert", "data": {"name": name}} for name in ("taken", "a", "b")]
+    )
+    assert [row["ok"] for row in result["results"]] == [False, True, True]
+    assert not any(row.get("skipped") for row in result["results"])
+
+
+def test_unit_of_work_commits_across_collections(dao):
+    with UnitOfWork(dao) as uow:
+        uow.insert({"name": "group"}, collection_name="groups")
+        uow.insert({"name": "key"})
+        assert uow.count({"name": "key"}) == 0
+    assert dao.count({"name": "key"}) == 1
+    assert dao.count({"name": "group"}, collection_name="groups") == 1
+
+
+def test_unit_of_work_rolls_back_on_failure(dao):
+    dao.create(data={"name": "taken"})
+    with pytest.raises(DataBaseException):
+        with UnitOfWork(dao) as uow:
+            uow.insert({"name": "group"}, collection_name="groups")
+            uow.update({"name": "taken"}, {"seen": True})
+            uow.insert({"name": "taken"})
+    assert dao.count({"name": "group"}, collection_name="groups") == 0
+    assert dao.count({"seen": True}) == 0
+    assert dao.count({"name": "taken"}) == 1
+
+
+def test_memory_abort_restores_indexes(dao):
+    session = dao.mongo_conn.start_session()
+    session.start_transaction()
+    dao.bulk_write([{"op": "insert", "data": {"name": "a"}}], session=session)
+    session.abort_transaction()
+    assert dao.count({"name": "a"}) == 0
+    dao.create(data={"name": "a"})
+    assert dao.count({"name": "a"}) == 1
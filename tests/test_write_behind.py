@@ -0,0 +1,65 @@
+import threading
+
+from bson.errors import InvalidDocument
+from pymongo.errors import AutoReconnect
+
+from corefw.mongofw.write_behind import WriteBehindBuffer
+
+
+class FakeMongoConn(object):
+    """
+    Records bulk writes, raising the queued error of a collection once
+    """
+
+    def __init__(self):
+        self.writes = []
+        self.errors = {}
+        self.written = threading.Event()
+
+    def bulk_write(self, collection_name, requests, ordered=True):
+        error = self.errors.pop(collection_name, None)
+        if error is not None:
+            raise error
+        self.writes.append((collection_name, len(requests)))
+        self.written.set()
+
+
+def test_coalesces_updates():
+    conn = FakeMongoConn()
+    buffer = WriteBehindBuffer(conn, flush_seconds=60)
+    buffer.set("keys", {"api_key": "a"}, {"last_used": 1})
+    buffer.set("keys", {"api_key": "a"}, {"last_used": 2})
+    buffer.set("keys", {"api_key": "b"}, {"last_used": 1})
+    assert buffer.flush() == 2
+    assert conn.writes == [("keys", 2)]
+    assert buffer.status()["coalesced"] == 1
+    buffer.stop()
+
+
+def test_transient_error_requeues():
+    conn = FakeMongoConn()
+    buffer = WriteBehindBuffer(conn, flush_seconds=60)
+    conn.errors["keys"] = AutoReconnect("down")
+    buffer.set("keys", {"api_key": "a"}, {"last_used": 1})
+    assert buffer.flush() == 0
+    assert buffer.status()["pending"] == 1
+    assert buffer.flush() == 1
+    assert buffer.status()["dropped"] == 0
+    buffer.stop()
+
+
+def test_invalid_document_dropped_and_flusher_survives():
+    conn = FakeMongoConn()
+    buffer = WriteBehindBuffer(conn, flush_seconds=0.01)
+    conn.errors["keys"] = InvalidDocument("cannot encode object")
+    buffer.set("keys", {"api_key": "a"}, {"last_used": object()})
+    buffer.set("groups", {"name": "g"}, {"last_used": 1})
+    assert conn.written.wait(5)
+    assert conn.writes == [("groups", 1)]
+    assert buffer.status()["dropped"] == 1
+    conn.written.clear()
+    buffer.set("keys", {"api_key": "b"}, {"last_used": 1})
+    assert conn.written.wait(5)
+    assert buffer.thread.is_alive()
+    assert ("keys", 1) in conn.writes
+    buffer.stop()